@@ -0,0 +1,120 @@
+'''
+Benchmark of the balancing strategies in utilities.forge_graph.
+
+For random cities of the given sizes, compares wall time, number of
+virtual edges, deadhead cost and real circuit length of every strategy,
+and of the original iterative balancing with one shortest-path search
+per (excess-in, excess-out) pair.
+Run from the repository root:
+    python -m benchmarks.benchmark_balance_graph --city-sizes 8 16 24
+'''
+import argparse
+import time
+
+import networkx as nx
+
+from utilities import get_random_city as grc
+from utilities import get_graph as gg
+from utilities import forge_graph as fg
+from utilities import get_route as gr
+
+
+# PAIRWISE (ORIGINAL) BALANCING ===============================================
+def get_virtual_edges_pairwise(
+        g: nx.DiGraph) -> list:
+    imbalanced_nodes = fg.get_imbalanced_nodes(g)
+    excess_ins = imbalanced_nodes['excess_ins']
+    excess_outs = imbalanced_nodes['excess_outs']
+    virtual_edges = []
+    for n in excess_ins:
+        shortest_path = len(g.edges())
+        nearest_node = None
+        for m in excess_outs:
+            path = nx.shortest_path_length(g, source=n, target=m)
+            if path < shortest_path and (n, m) not in g.edges():
+                shortest_path = path
+                nearest_node = m
+        if nearest_node is None:
+            break
+        virtual_edges.append((n, nearest_node))
+        excess_outs.remove(nearest_node)
+    return virtual_edges
+
+
+def balance_graph_pairwise(
+        g: nx.DiGraph) -> nx.DiGraph:
+    virtual_g = g.copy()
+    while nx.is_eulerian(virtual_g) is False:
+        virtual_g.add_edges_from(
+            get_virtual_edges_pairwise(virtual_g), type='virtual_edge')
+    return virtual_g
+
+
+# BENCHMARK ===================================================================
+def get_pruned_graph(
+        city_size: tuple):
+    city = grc.get_random_city(city_size=city_size)
+    inverted_g = gg.get_inverted_graph(city)
+    inverted_g = fg.prune_u_turns(inverted_g)
+    inverted_g = fg.prune_left_turns(inverted_g)
+    return inverted_g
+
+
+def run_benchmark(
+        city_sizes: list,
+        strategies: list,
+        max_pairwise_size: int = 16) -> list:
+    results = []
+    for size in city_sizes:
+        inverted_g = get_pruned_graph((size, size))
+        size_strategies = list(strategies)
+        if size <= max_pairwise_size:
+            size_strategies.append('pairwise')
+        for strategy in size_strategies:
+            start = time.perf_counter()
+            if strategy == 'pairwise':
+                virtual_g = balance_graph_pairwise(inverted_g)
+            else:
+                virtual_g = fg.balance_graph(inverted_g, strategy)
+            wall_time = time.perf_counter() - start
+            virtual_circuit = gr.get_virtual_path(virtual_g)
+            real_circuit = gr.get_real_path(
+                virtual_circuit, inverted_g, virtual_g)
+            results.append({
+                'city_size': size,
+                'strategy': strategy,
+                'n_edges': len(inverted_g.edges()),
+                'wall_time': wall_time,
+                'n_virtual_edges': (
+                    len(virtual_g.edges()) - len(inverted_g.edges())),
+                'deadhead_cost': fg.get_deadhead_cost(inverted_g, virtual_g),
+                'circuit_len': len(real_circuit['circuit_by_edge']),
+                })
+    return results
+
+
+def print_results(
+        results: list):
+    print(
+        f"{'city':>6} {'strategy':>10} {'edges':>8} {'time':>9} "
+        f"{'virtual':>8} {'deadhead':>9} {'circuit':>8}")
+    for r in results:
+        print(
+            f"{r['city_size']:>6} {r['strategy']:>10} {r['n_edges']:>8} "
+            f"{r['wall_time']:>8.3f}s {r['n_virtual_edges']:>8} "
+            f"{r['deadhead_cost']:>9} {r['circuit_len']:>8}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--city-sizes', type=int, nargs='+', default=[8, 16, 24])
+    parser.add_argument(
+        '--strategies', nargs='+', default=sorted(fg.BALANCING_STRATEGIES),
+        choices=sorted(fg.BALANCING_STRATEGIES))
+    parser.add_argument(
+        '--max-pairwise-size', type=int, default=16,
+        help='skip the original pairwise balancing above this city size')
+    args = parser.parse_args()
+    print_results(run_benchmark(
+        args.city_sizes, args.strategies, args.max_pairwise_size))
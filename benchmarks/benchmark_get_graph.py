@@ -0,0 +1,145 @@
+'''
+Scaling benchmark for the graph builders in utilities.get_graph.
+
+Compares the endpoint-indexed builders against the original
+every-ordered-pair construction on random cities of a given size.
+Run from the repository root:
+    python -m benchmarks.benchmark_get_graph --n-segments 1000 10000 100000
+'''
+import argparse
+import math
+import time
+
+import networkx as nx
+
+from utilities import get_random_city as grc
+from utilities import get_graph as gg
+
+
+# PAIRWISE (ORIGINAL) BUILDERS ================================================
+def get_inverted_graph_pairwise(
+        edges: list) -> nx.DiGraph:
+    g = nx.DiGraph()
+    for edge_i in edges:
+        for edge_j in edges:
+            e_data = gg.get_inverted_edge(edge_i, edge_j)
+            if e_data is not None:
+                g.add_edge(
+                    e_data['tail'],
+                    e_data['head'],
+                    weight=e_data['weight'],
+                    geometry=e_data['geometry'],
+                    coordinates=e_data['coordinates'],
+                    coordinates_offset=e_data['coordinates_offset'],
+                    manoeuvre=e_data['manoeuvre'],
+                    type='segment',
+                    )
+                attributes = {
+                    e_data['head']: {'coordinates': e_data['coordinates'][1]},
+                    e_data['tail']: {'coordinates': e_data['coordinates'][0]},
+                    }
+                nx.set_node_attributes(g, attributes)
+    connected_nodes = sorted(
+        nx.strongly_connected_components(g),
+        key=len,
+        reverse=True)[0]
+    g.remove_nodes_from(
+        [n for n in list(g.nodes()) if n not in connected_nodes])
+    return g
+
+
+def get_manoeuvre_graph_pairwise(
+        edges: list) -> nx.DiGraph:
+    g = nx.DiGraph()
+    for e in edges:
+        g.add_edge(
+            str(e['segment_id']) + '_t',
+            str(e['segment_id']) + '_h',
+            manoeuvre='go_straight',
+            type='segment')
+    for e_in in edges:
+        for e_out in edges:
+            e_data = gg.get_manoeuvre_data(e_in, e_out)
+            if e_data is not None:
+                g.add_edge(
+                    e_data['tail'],
+                    e_data['head'],
+                    manoeuvre=e_data['manoeuvre'],
+                    type='manoeuvre')
+    return g
+
+
+# BENCHMARK ===================================================================
+def get_city_with_n_segments(
+        n_segments: int) -> list:
+    '''
+    INPUT
+    n_segments  approximate number of segments (int)
+    ------------
+    OUTPUT
+    city    segments data (list of dicts)
+    NB! with the default frequencies every grid slot holds
+    1.3 segments on average, and a square city has ~2 slots per point.
+    '''
+    frequencies = grc.ug.FREQUENCIES
+    segments_per_slot = (
+        frequencies[1] + frequencies[2] + 2 * frequencies[3])
+    side = max(2, math.ceil(math.sqrt(n_segments / (2 * segments_per_slot))))
+    return grc.get_random_city(city_size=(side, side))
+
+
+def time_call(
+        function,
+        *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def run_benchmark(
+        n_segments: list,
+        max_pairwise_segments: int) -> list:
+    results = []
+    for n in n_segments:
+        city = get_city_with_n_segments(n)
+        result = {
+            'n_segments': len(city),
+            'inverted_indexed': time_call(gg.get_inverted_graph, city),
+            'manoeuvre_indexed': time_call(gg.get_manoeuvre_graph, city),
+            'inverted_pairwise': None,
+            'manoeuvre_pairwise': None,
+            }
+        if len(city) <= max_pairwise_segments:
+            result['inverted_pairwise'] = time_call(
+                get_inverted_graph_pairwise, city)
+            result['manoeuvre_pairwise'] = time_call(
+                get_manoeuvre_graph_pairwise, city)
+        results.append(result)
+    return results
+
+
+def print_results(
+        results: list):
+    def format_time(t):
+        return 'skipped' if t is None else f"{t:.3f}s"
+    print(
+        f"{'segments':>10} | {'inverted':>10} {'pairwise':>10} | "
+        f"{'manoeuvre':>10} {'pairwise':>10}")
+    for r in results:
+        print(
+            f"{r['n_segments']:>10} | "
+            f"{format_time(r['inverted_indexed']):>10} "
+            f"{format_time(r['inverted_pairwise']):>10} | "
+            f"{format_time(r['manoeuvre_indexed']):>10} "
+            f"{format_time(r['manoeuvre_pairwise']):>10}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--n-segments', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument(
+        '--max-pairwise-segments', type=int, default=10000,
+        help='skip the quadratic builders above this many segments')
+    args = parser.parse_args()
+    print_results(run_benchmark(args.n_segments, args.max_pairwise_segments))
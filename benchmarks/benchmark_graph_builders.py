@@ -0,0 +1,118 @@
+'''
+Micro-benchmark of the graph builders in utilities.get_graph, per edge.
+
+Times every builder end to end, and the insertion of prebuilt edge data
+alone, either in bulk (add_nodes_from / add_edges_from) or per edge with
+nx.set_node_attributes, as the builders used to.
+Run from the repository root:
+    python -m benchmarks.benchmark_graph_builders --city-sizes 10 30 --repeats 3
+'''
+import argparse
+import time
+
+import networkx as nx
+
+from utilities import get_random_city as grc
+from utilities import get_graph as gg
+
+BUILDERS = {
+    'naive': gg.get_naive_graph,
+    'manoeuvre': gg.get_manoeuvre_graph,
+    'inverted': gg.get_inverted_graph,
+    }
+
+
+# INSERTION ===================================================================
+def insert_per_edge(
+        nodes: list,
+        edges: list) -> nx.DiGraph:
+    g = nx.DiGraph()
+    for (tail, tail_data), (head, head_data), (_, _, data) in zip(
+            nodes[::2], nodes[1::2], edges):
+        g.add_edge(tail, head, **data)
+        nx.set_node_attributes(g, {tail: tail_data, head: head_data})
+    return g
+
+
+def insert_in_bulk(
+        nodes: list,
+        edges: list) -> nx.DiGraph:
+    g = nx.DiGraph()
+    g.add_nodes_from(nodes)
+    g.add_edges_from(edges)
+    return g
+
+
+def get_inverted_batches(
+        city: list) -> tuple:
+    '''
+    OUTPUT
+    nodes & edges of the inverted graph, as collected by get_inverted_graph
+    '''
+    g = gg.get_inverted_graph(city)
+    nodes = []
+    for tail, head in g.edges():
+        nodes.append((tail, g.nodes[tail]))
+        nodes.append((head, g.nodes[head]))
+    return nodes, list(g.edges(data=True))
+
+
+# BENCHMARK ===================================================================
+def get_best_time(
+        repeats: int,
+        function,
+        *args) -> float:
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmark(
+        city_sizes: list,
+        repeats: int) -> list:
+    results = []
+    for size in city_sizes:
+        city = grc.get_random_city((size, size), vectorised=True, seed=0)
+        for name, builder in BUILDERS.items():
+            n_edges = builder(city).number_of_edges()
+            results.append({
+                'city_size': size,
+                'stage': f"get_{name}_graph",
+                'n_edges': n_edges,
+                'seconds_per_edge': (
+                    get_best_time(repeats, builder, city) / n_edges),
+                })
+        nodes, edges = get_inverted_batches(city)
+        for name, insert in (
+                ('insert_per_edge', insert_per_edge),
+                ('insert_in_bulk', insert_in_bulk)):
+            results.append({
+                'city_size': size,
+                'stage': name,
+                'n_edges': len(edges),
+                'seconds_per_edge': (
+                    get_best_time(repeats, insert, nodes, edges)
+                    / len(edges)),
+                })
+    return results
+
+
+def print_results(
+        results: list):
+    print(f"{'city':>6} {'stage':>22} {'edges':>8} {'per edge':>10}")
+    for r in results:
+        print(
+            f"{r['city_size']:>6} {r['stage']:>22} {r['n_edges']:>8} "
+            f"{r['seconds_per_edge'] * 1e6:>8.2f}us")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--city-sizes', type=int, nargs='+', default=[10, 30])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    print_results(run_benchmark(args.city_sizes, args.repeats))
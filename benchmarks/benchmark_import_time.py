@@ -0,0 +1,78 @@
+'''
+Benchmark of the cold-start cost of importing the routing modules.
+
+Every import runs in a fresh interpreter, so nothing is cached in
+sys.modules; wall time covers the module and everything it pulls in.
+Also lists the plotting & geometry libraries loaded along the way,
+which the routing code should not need.
+Run from the repository root:
+    python -m benchmarks.benchmark_import_time --repeats 5
+'''
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+HEAVY_MODULES = ('matplotlib', 'matplotlib.pyplot', 'shapely', 'scipy')
+
+IMPORT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+wall_time = time.perf_counter() - start
+print(json.dumps({{
+    'wall_time': wall_time,
+    'heavy_modules': [m for m in {heavy_modules!r} if m in sys.modules],
+    }}))
+'''
+
+
+# BENCHMARK ===================================================================
+def time_cold_import(
+        module: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_SCRIPT.format(
+            module=module, heavy_modules=HEAVY_MODULES)],
+        check=True,
+        capture_output=True,
+        text=True,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_benchmark(
+        modules: list,
+        repeats: int = 5) -> list:
+    results = []
+    for module in modules:
+        runs = [time_cold_import(module) for _ in range(repeats)]
+        wall_times = [r['wall_time'] for r in runs]
+        results.append({
+            'module': module,
+            'min_time': min(wall_times),
+            'median_time': statistics.median(wall_times),
+            'heavy_modules': runs[-1]['heavy_modules'],
+            })
+    return results
+
+
+def print_results(
+        results: list):
+    print(f"{'module':>28} {'min':>9} {'median':>9}  heavy modules loaded")
+    for r in results:
+        print(
+            f"{r['module']:>28} {r['min_time']:>8.3f}s "
+            f"{r['median_time']:>8.3f}s  "
+            f"{', '.join(r['heavy_modules']) or '-'}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--modules', nargs='+',
+        default=['utilities.get_route', 'utilities.forge_graph'])
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+    print_results(run_benchmark(args.modules, args.repeats))
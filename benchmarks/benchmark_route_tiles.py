@@ -0,0 +1,64 @@
+'''
+Benchmark of the tiled route inspection in utilities.route_tiles.
+
+For a random city, compares the cost and wall time of the circuit
+stitched from tiles of every given size with a monolithic solve.
+Run from the repository root:
+    python -m benchmarks.benchmark_route_tiles --city-size 24 --tile-sizes 6 12
+'''
+import argparse
+
+from utilities import get_random_city as grc
+from utilities import route_tiles as rt
+
+
+def run_benchmark(
+        city_size: int,
+        tile_sizes: list,
+        n_workers: int = None,
+        seed: int = 0) -> list:
+    city = grc.get_random_city(
+        (city_size, city_size), vectorised=True, seed=seed)
+    results = []
+    for tile_size in tile_sizes:
+        comparison = rt.compare_with_monolithic(
+            city, (city_size, city_size), (tile_size, tile_size), n_workers)
+        wall_times = {s['stage']: s['wall_time'] for s in comparison['stages']}
+        results.append({
+            'tile_size': tile_size,
+            'n_tiles': comparison['tiled']['n_tiles'],
+            'n_grafts': comparison['tiled']['n_grafts'],
+            'tiled_time': wall_times['route_city_by_tiles'],
+            'monolithic_time': (
+                wall_times['balance_graph_min_cost']
+                + wall_times['get_virtual_path']
+                + wall_times['get_real_path']),
+            'tiled_cost': comparison['tiled_cost'],
+            'monolithic_cost': comparison['monolithic_cost'],
+            'cost_ratio': comparison['cost_ratio'],
+            })
+    return results
+
+
+def print_results(
+        results: list):
+    print(
+        f"{'tile':>6} {'tiles':>6} {'grafts':>7} {'tiled':>9} "
+        f"{'monolith':>9} {'tiled':>9} {'monolith':>9} {'ratio':>6}")
+    for r in results:
+        print(
+            f"{r['tile_size']:>6} {r['n_tiles']:>6} {r['n_grafts']:>7} "
+            f"{r['tiled_time']:>8.3f}s {r['monolithic_time']:>8.3f}s "
+            f"{r['tiled_cost']:>9} {r['monolithic_cost']:>9} "
+            f"{r['cost_ratio']:>6.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--city-size', type=int, default=24)
+    parser.add_argument('--tile-sizes', type=int, nargs='+', default=[6, 12])
+    parser.add_argument('--n-workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print_results(run_benchmark(
+        args.city_size, args.tile_sizes, args.n_workers, args.seed))
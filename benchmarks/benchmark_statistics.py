@@ -0,0 +1,101 @@
+'''
+Regression benchmark for get_random_city.get_area_statistics
+and get_graph.get_points_dictionary.
+
+Times both on a large random city and, on a prefix of its segments,
+against the original list-based implementations.
+Run from the repository root:
+    python -m benchmarks.benchmark_statistics --city-size 500 500
+'''
+import argparse
+import time
+
+from utilities import get_random_city as grc
+from utilities import get_graph as gg
+
+
+# LIST-BASED (ORIGINAL) IMPLEMENTATIONS =======================================
+def get_area_statistics_list_based(
+        city: list) -> dict:
+    segment_ids = [s['segment_id'] for s in city]
+    return {
+        'n_segments': len(segment_ids),
+        'n_one_way_segments': len([
+            s['segment_id'] for s in city
+            if -s['segment_id'] not in segment_ids]),
+        'n_two_way_segments': len([
+            s['segment_id'] for s in city
+            if s['segment_id'] < 0]),
+        }
+
+
+def get_points_dictionary_list_based(
+        segments: list) -> dict:
+    points_coordinates = {}
+    sorted_points_coordinates = sorted(
+        list(set([n for s in segments for n in s['coordinates']])))
+    for n in sorted_points_coordinates:
+        points_coordinates[n] = sorted_points_coordinates.index(n)
+    return points_coordinates
+
+
+# BENCHMARK ===================================================================
+def time_call(
+        function,
+        *args) -> dict:
+    start = time.perf_counter()
+    result = function(*args)
+    return {
+        'result': result,
+        'wall_time': time.perf_counter() - start}
+
+
+def run_benchmark(
+        city_size: tuple,
+        n_reference_segments: int) -> list:
+    city = grc.get_random_city(city_size, vectorised=True, seed=0)
+    prefix = city[:n_reference_segments]
+    results = []
+    for name, function, reference_function in [
+            ('get_area_statistics',
+             grc.get_area_statistics,
+             get_area_statistics_list_based),
+            ('get_points_dictionary',
+             gg.get_points_dictionary,
+             get_points_dictionary_list_based)]:
+        full = time_call(function, city)
+        current = time_call(function, prefix)
+        reference = time_call(reference_function, prefix)
+        assert current['result'] == reference['result']
+        results.append({
+            'function': name,
+            'n_segments': len(city),
+            'wall_time': full['wall_time'],
+            'n_prefix_segments': len(prefix),
+            'prefix_wall_time': current['wall_time'],
+            'reference_prefix_wall_time': reference['wall_time'],
+            })
+    return results
+
+
+def print_results(
+        results: list):
+    for r in results:
+        print(
+            f"{r['function']:>22}: {r['n_segments']} segments "
+            f"in {r['wall_time']:.3f}s | "
+            f"{r['n_prefix_segments']} segments "
+            f"in {r['prefix_wall_time']:.4f}s "
+            f"(list-based {r['reference_prefix_wall_time']:.4f}s)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--city-size', type=int, nargs=2, default=[500, 500])
+    parser.add_argument(
+        '--n-reference-segments', type=int, default=20000,
+        help='segments given to the quadratic list-based implementations')
+    args = parser.parse_args()
+    print_results(run_benchmark(
+        tuple(args.city_size), args.n_reference_segments))
@@ -1,4 +1,7 @@
 import os, sys, inspect
+import json
+import random
+import subprocess
 
 import numpy as np
 
@@ -21,6 +24,16 @@ from utilities import get_graph as gg
 from utilities import forge_graph as fg
 from utilities import visualise_graph as vg
 from utilities import get_route as gr
+from utilities import csr_graph as cg
+from utilities import pipeline as pl
+from utilities import profiler as up
+from utilities import graph_cache as gca
+from utilities import route_districts as rd
+from utilities import spatial_index as usi
+from utilities import repair_route as rr
+from utilities import route_tiles as rt
+from utilities import random_walk as rw
+from utilities import __main__ as um
 
 import logging
 logging.basicConfig(
@@ -104,12 +117,12 @@ class TestGraphAndRoute:
             'n_nodes': len(inverted_g.nodes()),
             'n_edges': len(inverted_g.edges()),
             'strongly_connected': nx.is_strongly_connected(inverted_g),
-            'n_disconnected_nodes': len(graph_statistics['disconnected_nodes']),
-            'n_straight_drives': len(graph_statistics['straight_drives']),
-            'n_right_turns': len(graph_statistics['right_turns']),
-            'n_left_turns': len(graph_statistics['left_turns']),
-            'n_u_turns': len(graph_statistics['u_turns']),
-            'n_dead_ends': len(graph_statistics['dead_ends']),
+            'n_disconnected_nodes': graph_statistics['n_disconnected_nodes'],
+            'n_straight_drives': graph_statistics['n_straight_drives'],
+            'n_right_turns': graph_statistics['n_right_turns'],
+            'n_left_turns': graph_statistics['n_left_turns'],
+            'n_u_turns': graph_statistics['n_u_turns'],
+            'n_dead_ends': graph_statistics['n_dead_ends'],
             'eulerian_circuit_len': eulerian_circuit_len
             }
 
@@ -187,4 +200,648 @@ class TestGraphAndRoute:
             'n_dead_ends': 0,
             'eulerian_circuit_len': 24}
         for k in test_statistics.keys():
-            assert graph_and_route_statistics[k] == test_statistics[k]
\ No newline at end of file
+            assert graph_and_route_statistics[k] == test_statistics[k]
+
+def test_get_inverted_graph_matches_pairwise_construction():
+    '''
+    Test the endpoint-indexed builder against testing every ordered pair.
+    '''
+    random_city = grc.get_random_city(city_size=[4, 3])
+    inverted_g = gg.get_inverted_graph(random_city)
+
+    pairwise_g = nx.DiGraph()
+    for edge_i in random_city:
+        for edge_j in random_city:
+            e_data = gg.get_inverted_edge(edge_i, edge_j)
+            if e_data is not None:
+                pairwise_g.add_edge(
+                    e_data['tail'],
+                    e_data['head'],
+                    manoeuvre=e_data['manoeuvre'],
+                    coordinates_offset=e_data['coordinates_offset'])
+    pairwise_g = pairwise_g.subgraph(inverted_g.nodes())
+
+    assert list(inverted_g.nodes()) == list(pairwise_g.nodes())
+    assert (list(inverted_g.edges(data='manoeuvre'))
+        == list(pairwise_g.edges(data='manoeuvre')))
+    assert np.allclose(
+        [c for _, _, c in inverted_g.edges(data='coordinates_offset')],
+        [c for _, _, c in pairwise_g.edges(data='coordinates_offset')])
+
+    zero_length_segment = {'segment_id': -1, 'coordinates': [(1, 1), (1, 1)]}
+    segment = {'segment_id': -2, 'coordinates': [(1, 1), (2, 1)]}
+    e_data = gg.get_inverted_edge(zero_length_segment, segment, 'go_straight')
+    assert e_data['coordinates_offset'] == [(1., 1.), (1.5, .9)]
+
+
+def test_get_manoeuvres_matches_get_manoeuvre():
+    '''
+    Test batch manoeuvre classification against the per-pair one.
+    '''
+    random_city = grc.get_random_city(city_size=[5, 4])
+    pairs = gg.get_adjacent_pairs(random_city)
+
+    assert gg.get_pairs_manoeuvres(pairs) == [
+        uc.get_manoeuvre(s_in, s_out) for s_in, s_out in pairs]
+
+
+def test_add_connecting_grafts():
+    '''
+    Test the two biggest components are joined along the super graph,
+    with paths both ways, without changing the super graph.
+    '''
+    super_g = nx.DiGraph()
+    for n in range(6):
+        super_g.add_node(n, coordinates=(n, 0))
+    super_g.add_edges_from(
+        [(0, 1), (1, 0), (1, 2), (2, 3), (3, 4), (4, 3), (4, 5), (5, 0)],
+        coordinates=[(0, 0), (0, 0)])
+    super_g.add_edge(2, 0, coordinates=[(0, 0), (0, 0)], weight=10)
+    g = super_g.subgraph([0, 1, 3, 4]).copy()
+
+    grafted_g = fg.add_connecting_grafts(g, super_g)
+
+    assert nx.is_strongly_connected(grafted_g)
+    assert sorted(grafted_g.nodes()) == list(range(6))
+    assert set(grafted_g.edges()) == set(super_g.edges()) - {(2, 0)}
+    assert grafted_g.nodes[2]['coordinates'] == (2, 0)
+    assert len(super_g) == 6 and len(g) == 4
+
+    condensed_g = fg.condense_nodes(grafted_g, {0, 1}, 'a', (0.5, 0))
+    assert set(condensed_g.edges()) == {
+        ('a', 2), (2, 3), (3, 4), (4, 3), (4, 5), (5, 'a')}
+
+
+def test_join_split_edges():
+    '''
+    Test a straight two-way corridor is joined into one edge per direction,
+    in one pass and in place.
+    '''
+    points = [(0, 0), (1, 0), (2, 0), (3, 0)]
+    corridor = []
+    for i in range(len(points) - 1):
+        for segment_id, coordinates in (
+                (i + 1, [points[i], points[i + 1]]),
+                (-(i + 1), [points[i + 1], points[i]])):
+            corridor.append({
+                'segment_id': segment_id,
+                'direction': 0,
+                'coordinates': coordinates,
+                'geometry': sh.geometry.LineString(coordinates),
+                })
+    manoeuvre_g = gg.get_manoeuvre_graph(corridor)
+
+    joined_g = fg.join_split_edges(manoeuvre_g)
+
+    assert joined_g is manoeuvre_g
+    assert sorted(joined_g.nodes()) == sorted(['1_t', '3_h', '-3_t', '-1_h'])
+    edge_data = joined_g.edges['1_t', '3_h']
+    assert list(edge_data['geometry'].coords) == points
+    assert edge_data['coordinates'] == [(0, 0), (3, 0)]
+    assert edge_data['weight'] == 3
+    assert edge_data['edge_id'] == '1'
+    assert list(joined_g.edges['-3_t', '-1_h']['geometry'].coords) == (
+        points[::-1])
+    assert joined_g.edges['3_h', '-3_t']['manoeuvre'] == 'make_u_turn'
+
+
+def test_balance_graph_min_cost():
+    '''
+    Test minimum-cost balancing never does worse than the greedy loop.
+    '''
+    random_city = grc.get_random_city(city_size=[6, 6])
+    inverted_g = gg.get_inverted_graph(random_city)
+    inverted_g = fg.prune_u_turns(inverted_g)
+    inverted_g = fg.prune_left_turns(inverted_g)
+
+    greedy_g = fg.balance_graph(inverted_g, 'iterative')
+    min_cost_g = fg.balance_graph(inverted_g, 'min_cost')
+
+    assert nx.is_eulerian(min_cost_g)
+    assert (min_cost_g.graph['deadhead_cost']
+        == fg.get_deadhead_cost(inverted_g, min_cost_g))
+    assert (min_cost_g.graph['deadhead_cost']
+        <= fg.get_deadhead_cost(inverted_g, greedy_g))
+    real_circuit = gr.get_real_path(
+        gr.get_virtual_path(min_cost_g), inverted_g, min_cost_g)
+    assert set(real_circuit['circuit_by_edge']) == set(inverted_g.edges())
+
+    eulerian_g = nx.cycle_graph(4, create_using=nx.DiGraph)
+    balanced_g = fg.balance_graph(eulerian_g, 'min_cost')
+    assert balanced_g.graph['deadhead_cost'] == 0
+    assert sorted(balanced_g.edges()) == sorted(eulerian_g.edges())
+
+
+def test_balance_graph_assignment():
+    '''
+    Test assignment balancing matches the minimum-cost transport,
+    and keeps its distance matrix.
+    '''
+    random_city = grc.get_random_city([6, 6], vectorised=True, seed=1)
+    inverted_g = gg.get_inverted_graph(random_city)
+    inverted_g = fg.prune_u_turns(inverted_g)
+    inverted_g = fg.prune_left_turns(inverted_g)
+
+    assignment_g = fg.balance_graph_assignment(inverted_g, n_workers=2)
+    min_cost_g = fg.balance_graph(inverted_g, 'min_cost')
+
+    assert nx.is_eulerian(assignment_g)
+    assert (assignment_g.graph['deadhead_cost']
+        == min_cost_g.graph['deadhead_cost']
+        == fg.get_deadhead_cost(inverted_g, assignment_g))
+    distance_matrix = assignment_g.graph['distance_matrix']
+    n, m = (distance_matrix['excess_ins'][0],
+        distance_matrix['excess_outs'][0])
+    assert distance_matrix['distances'][0, 0] == nx.dijkstra_path_length(
+        inverted_g, n, m, weight=fg.get_deadhead_weight)
+    assert (distance_matrix['distances'].shape == (
+        len(distance_matrix['excess_ins']),
+        len(distance_matrix['excess_outs'])))
+    assert np.array_equal(
+        distance_matrix['distances'],
+        fg.get_distance_matrix(
+            inverted_g,
+            distance_matrix['excess_ins'],
+            distance_matrix['excess_outs'],
+            weighted=True))
+
+
+def test_get_real_path_weighted_and_pooled():
+    '''
+    Test weighted expansion never costs more than the unweighted one
+    and pooled expansion gives the same circuit as the sequential one.
+    '''
+    random_city = grc.get_random_city(city_size=[6, 6])
+    inverted_g = gg.get_inverted_graph(random_city)
+    inverted_g = fg.prune_u_turns(inverted_g)
+    virtual_g = fg.balance_graph(inverted_g, 'iterative')
+    virtual_circuit = gr.get_virtual_path(virtual_g)
+
+    def get_penalty(circuit):
+        return sum(
+            inverted_g.get_edge_data(*e)['weight']
+            for e in circuit['circuit_by_edge'])
+
+    real_circuit = gr.get_real_path(virtual_circuit, inverted_g, virtual_g)
+    weighted_circuit = gr.get_real_path(
+        virtual_circuit, inverted_g, virtual_g, weighted=True)
+    pooled_circuit = gr.get_real_path(
+        virtual_circuit, inverted_g, virtual_g, weighted=True, n_workers=4)
+
+    assert get_penalty(weighted_circuit) <= get_penalty(real_circuit)
+    assert pooled_circuit == weighted_circuit
+
+
+def test_prune_matches_copy_and_check():
+    '''
+    Test in-place pruning against copying the graph for every candidate.
+    '''
+    random_city = grc.get_random_city(city_size=[6, 5])
+    inverted_g = gg.get_inverted_graph(random_city)
+
+    reference_g = inverted_g.copy()
+    for e in list(reference_g.edges()):
+        if reference_g.get_edge_data(*e)['manoeuvre'] == 'turn_left':
+            test_g = reference_g.copy()
+            test_g.remove_edge(*e)
+            if nx.is_strongly_connected(test_g):
+                reference_g.remove_edge(*e)
+
+    pruned_g = fg.prune_left_turns(inverted_g)
+    assert list(pruned_g.edges()) == list(reference_g.edges())
+
+
+def test_prune_right_turns():
+    '''
+    Test right turns are pruned as long as the graph stays strongly connected.
+    '''
+    random_city = grc.get_random_city(city_size=[4, 4], frequencies=[0, 0, 0, 1])
+    inverted_g = gg.get_inverted_graph(random_city)
+    n_right_turns = vg.get_graph_statistics(inverted_g)['n_right_turns']
+
+    pruned_g = fg.prune_right_turns(inverted_g)
+    assert nx.is_strongly_connected(pruned_g)
+    assert vg.get_graph_statistics(pruned_g)['n_right_turns'] < n_right_turns
+    for e in pruned_g.edges():
+        if pruned_g.edges[e]['manoeuvre'] == 'turn_right':
+            test_g = pruned_g.copy()
+            test_g.remove_edge(*e)
+            assert not nx.is_strongly_connected(test_g)
+
+
+def test_csr_graph_pipeline():
+    '''
+    Test pruning, balancing and routing on the compact graph
+    against the nx.DiGraph pipeline.
+    '''
+    random_city = grc.get_random_city(city_size=[6, 6])
+    inverted_g = gg.get_inverted_graph(random_city)
+
+    csr = cg.get_csr_graph(inverted_g)
+    csr = cg.prune_u_turns(csr)
+    csr = cg.prune_left_turns(csr)
+    inverted_g = fg.prune_u_turns(inverted_g)
+    inverted_g = fg.prune_left_turns(inverted_g)
+    assert (list(cg.get_nx_graph(csr).edges(data='manoeuvre'))
+        == list(inverted_g.edges(data='manoeuvre')))
+
+    virtual_csr = cg.balance_graph(csr)
+    virtual_g = fg.balance_graph(inverted_g, 'min_cost')
+    assert virtual_csr['deadhead_cost'] == virtual_g.graph['deadhead_cost']
+
+    real_circuit = cg.get_real_path(
+        virtual_csr, cg.get_eulerian_circuit(virtual_csr))
+    circuit = real_circuit['circuit_by_edge']
+    assert all(
+        circuit[i][1] == circuit[(i + 1) % len(circuit)][0]
+        for i in range(len(circuit)))
+    assert set(circuit) == set(inverted_g.edges())
+
+    eulerian_g = gg.get_inverted_graph(
+        grc.get_random_city([2, 1], [0., 0., 0., 1.]))
+    eulerian_csr = cg.get_csr_graph(eulerian_g)
+    virtual_csr = cg.balance_graph(eulerian_csr)
+    assert virtual_csr['deadhead_cost'] == 0
+    assert len(virtual_csr['tails']) == len(eulerian_csr['tails'])
+
+
+def test_get_random_city_vectorised():
+    '''
+    Test the vectorised generator yields the same segments, ignoring
+    randomness, and builds geometry only on access.
+    '''
+    city_size = [5, 4]
+    frequencies = [0., 0., 0., 1.]
+    random_city = grc.get_random_city(city_size, frequencies)
+    vectorised_city = grc.get_random_city(
+        city_size, frequencies, vectorised=True, seed=0)
+
+    assert ([(s['segment_id'], s['coordinates']) for s in random_city]
+        == [(s['segment_id'], s['coordinates']) for s in vectorised_city])
+    assert 'geometry' not in vectorised_city[0]
+    assert vectorised_city[0]['geometry'].equals(random_city[0]['geometry'])
+
+
+def test_render_to_png(tmp_path):
+    '''
+    Test offsets keep the direction of segments, and plots render headless
+    to png files.
+    '''
+    offset_coordinates = grc.get_offset_coordinates_batch(
+        [((0, 0), (1, 0)), ((2, 2), (2, 2))])
+    assert np.allclose(
+        offset_coordinates, [((.1, -.1), (.9, -.1)), ((2, 2), (2, 2))])
+    assert np.allclose(
+        grc.get_offset_coordinates({'coordinates': ((0, 0), (1, 0))}), offset_coordinates[0])
+
+    random_city = grc.get_random_city([4, 4], vectorised=True, seed=0)
+    manoeuvre_g = gg.get_manoeuvre_graph(random_city)
+    inverted_g = gg.get_inverted_graph(random_city)
+    paths = [
+        tmp_path / f'{name}.png' for name in ('area', 'manoeuvre', 'inverted')]
+    grc.plot_area(random_city, path=paths[0])
+    vg.visualise_manoeuvre_graph(manoeuvre_g, path=paths[1])
+    vg.visualise_inverted_graph(
+        inverted_g, manoeuvre_g, path=paths[2], label_nodes=False)
+    for path in paths:
+        with open(path, 'rb') as f:
+            assert f.read(4) == b'\x89PNG'
+
+
+def test_import_without_side_effects():
+    '''
+    Test the routing modules import without plotting & geometry libraries,
+    and without configuring logging.
+    '''
+    script = (
+        "import sys, logging\n"
+        "import utilities.get_route, utilities.pipeline\n"
+        "assert not logging.getLogger().handlers\n"
+        "print(' '.join(m for m in ('matplotlib', 'shapely', 'scipy')"
+        " if m in sys.modules))\n")
+    output = subprocess.run(
+        [sys.executable, '-c', script],
+        cwd=parent_dir,
+        check=True,
+        capture_output=True,
+        text=True).stdout
+    assert output.strip() == ''
+
+
+def test_iterate_random_city():
+    '''
+    Test streaming a city gives the same segments and statistics
+    as generating it at once.
+    '''
+    city_size = [7, 5]
+    random_city = grc.get_random_city(city_size, vectorised=True, seed=1)
+    city_stream = grc.iterate_random_city(city_size, seed=1, rows_per_chunk=2)
+
+    assert (grc.get_area_statistics(city_stream)
+        == grc.get_area_statistics(random_city))
+    unpaired_segments = [
+        {'segment_id': -5}, {'segment_id': 7},
+        {'segment_id': 3}, {'segment_id': -3}]
+    assert grc.get_area_statistics(unpaired_segments) == {
+        'n_segments': 4,
+        'n_one_way_segments': 2,
+        'n_two_way_segments': 2}
+    paired_segments = (
+        {'segment_id': sign * i}
+        for i in range(1, 100001) for sign in (1, -1))
+    assert grc.get_area_statistics(paired_segments) == {
+        'n_segments': 200000,
+        'n_one_way_segments': 0,
+        'n_two_way_segments': 100000}
+    district_bbox = [(1, 1), (4, 3)]
+    assert (list(grc.iterate_district(
+        grc.iterate_random_city(city_size, seed=1), district_bbox))
+        == [s for s in random_city
+            if grc.check_segment_within_district(s, district_bbox)])
+
+
+def test_get_points_dictionary():
+    '''
+    Test points are numbered in sorted order of their coordinates.
+    '''
+    random_city = grc.get_random_city(city_size=[3, 2])
+    points_dictionary = gg.get_points_dictionary(random_city)
+
+    sorted_points = sorted(points_dictionary)
+    assert [points_dictionary[p] for p in sorted_points] == list(
+        range(len(sorted_points)))
+
+
+def test_run_random_city_pipeline_report(tmp_path):
+    '''
+    Test the profile report lists every stage in order.
+    '''
+    report_path = tmp_path / 'report.json'
+    route = pl.run_random_city_pipeline(
+        city_size=[4, 4],
+        seed=0,
+        report_path=str(report_path))
+
+    with open(report_path) as f:
+        report = json.load(f)
+    assert report == route['report']
+    assert [s['stage'] for s in report['stages']] == [
+        'get_random_city',
+        'get_inverted_graph',
+        'prune_u_turns',
+        'prune_left_turns',
+        'balance_graph_iteratively',
+        'get_virtual_path',
+        'get_real_path']
+    assert report['stages'][-1]['n_edges'] == len(
+        route['real_circuit']['circuit_by_edge'])
+
+    # a failed write leaves the previous report whole, and no temporary file
+    try:
+        up.write_profile_report({'stages': object()}, str(report_path))
+    except TypeError:
+        pass
+    with open(report_path) as f:
+        assert json.load(f) == report
+    assert os.listdir(tmp_path) == ['report.json']
+
+
+def test_command_line(tmp_path):
+    '''
+    Test the command line routes a segment file like run_pipeline,
+    and writes the route & its timing summary.
+    '''
+    random_city = grc.get_random_city([5, 5], vectorised=True, seed=0)
+    segments_path = str(tmp_path / 'city.json')
+    output_path = str(tmp_path / 'route.json')
+    pl.write_segments(random_city, segments_path)
+    route = pl.run_pipeline(random_city, balancing_strategy='min_cost')
+
+    for options in (
+            ['--balancing-strategy', 'min_cost'],
+            ['--balancing-strategy', 'min_cost',
+             '--cache-dir', str(tmp_path / 'cache')],
+            ['--balancing-strategy', 'assignment', '--n-workers', '2']):
+        argv = ['--segments', segments_path, '--output', output_path] + options
+        assert um.main(argv) == 0
+        with open(output_path) as f:
+            route_data = json.load(f)
+        with open(str(tmp_path / 'route_report.json')) as f:
+            report = json.load(f)
+        assert route_data['n_segments'] == len(route['inverted_g'])
+        assert (set(tuple(e) for e in route_data['circuit_by_edge'])
+            == set(route['inverted_g'].edges()))
+        assert report['stages'][0]['stage'] == 'read_segments'
+        assert report['stages'][-1]['stage'] == 'get_real_path'
+
+    pl.write_segments(random_city[:1], segments_path)
+    assert um.main(['--segments', segments_path, '--output', output_path]) == 1
+
+
+def test_get_cached_inverted_graph(tmp_path):
+    '''
+    Test a cached graph loads back as the graph it was built from
+    and the cache stays within its size bound.
+    '''
+    cache_dir = str(tmp_path)
+    random_city = grc.get_random_city(city_size=[5, 5])
+    inverted_g = gca.get_cached_inverted_graph(random_city, cache_dir)
+    cached_g = gca.get_cached_inverted_graph(random_city, cache_dir)
+
+    assert (list(cached_g.nodes(data=True))
+        == list(inverted_g.nodes(data=True)))
+    assert (list(cached_g.edges(data=True))
+        == list(inverted_g.edges(data=True)))
+
+    gca.get_cached_inverted_graph(
+        random_city[:-1], cache_dir, max_cache_bytes=0)
+    assert os.listdir(cache_dir) == [gca.get_cache_key(random_city[:-1])]
+
+    # an empty city is cached too, the pipeline then fails at balancing
+    empty_cache_dir = str(tmp_path / 'empty')
+    for _ in range(2):
+        try:
+            pl.run_pipeline([], cache_dir=empty_cache_dir)
+        except nx.NetworkXPointlessConcept:
+            pass
+        assert os.listdir(empty_cache_dir) == [gca.get_cache_key([])]
+
+
+def test_route_districts():
+    '''
+    Test districts routed in a process pool match routing them one by one.
+    '''
+    random_city = grc.get_random_city(city_size=[8, 8])
+    district_bboxes = [[(0, 0), (4, 4)], [(3, 3), (7, 7)], [(0, 4), (4, 7)]]
+
+    results = sorted(
+        rd.route_districts(random_city, district_bboxes, n_workers=2),
+        key=lambda r: r['district_index'])
+
+    assert [r['district_bbox'] for r in results] == district_bboxes
+    for r in results:
+        district = list(grc.iterate_district(random_city, r['district_bbox']))
+        route = pl.run_pipeline(district)
+        assert r['error'] is None
+        assert r['circuit_by_edge'] == route['real_circuit']['circuit_by_edge']
+
+
+def test_spatial_index_districts():
+    '''
+    Test district extraction through the spatial index
+    against checking every node and segment.
+    '''
+    random_city = grc.get_random_city(city_size=[8, 6])
+    inverted_g = gg.get_inverted_graph(random_city)
+    district_bbox = [(2, 1), (5, 4)]
+
+    segment_index = usi.get_segment_spatial_index(random_city, cell_size=2)
+    assert usi.get_district_segments(segment_index, district_bbox) == [
+        s for s in random_city
+        if grc.check_segment_within_district(s, district_bbox)]
+
+    graph_index = usi.get_graph_spatial_index(inverted_g)
+    district_g = usi.get_district_subgraph(
+        inverted_g, graph_index, district_bbox)
+    assert set(district_g.nodes()) == set(
+        n for n, c in inverted_g.nodes(data='coordinates')
+        if gg.check_node_within_district(district_bbox, c))
+
+    manoeuvre_g = gg.get_manoeuvre_graph(random_city)
+    manoeuvre_index = usi.get_graph_spatial_index(manoeuvre_g)
+    assert manoeuvre_index['city_size'] == gg.get_city_size(manoeuvre_g)
+    random.seed(2)
+    indexed_district_g = gg.get_random_district_graph(
+        manoeuvre_g, spatial_index=manoeuvre_index)
+    random.seed(2)
+    district_g = gg.get_random_district_graph(manoeuvre_g)
+    assert set(indexed_district_g.nodes()) == set(district_g.nodes())
+
+
+def test_get_tile_nodes():
+    '''
+    Test every node falls in exactly one tile, within its bounding box.
+    '''
+    assert rt.get_tile_bboxes([8, 6], [4, 4]) == [
+        [(0, 0), (4, 4)], [(4, 0), (8, 4)],
+        [(0, 4), (4, 8)], [(4, 4), (8, 8)]]
+    random_city = grc.get_random_city([9, 8], vectorised=True, seed=0)
+    inverted_g = gg.get_inverted_graph(random_city)
+    tile_bboxes = rt.get_tile_bboxes([9, 8], [4, 4])
+    tile_nodes = rt.get_tile_nodes(inverted_g, [9, 8], [4, 4])
+
+    assert len(tile_nodes) == len(tile_bboxes) == 6
+    assert sorted(n for nodes in tile_nodes for n in nodes) == sorted(
+        inverted_g.nodes())
+    for ((west, south), (east, north)), nodes in zip(
+            tile_bboxes, tile_nodes):
+        for n in nodes:
+            x, y = inverted_g.nodes[n]['coordinates']
+            assert west <= x < east and south <= y < north
+
+
+def test_route_city_by_tiles():
+    '''
+    Test the circuit stitched from tiles covers every edge of the graph,
+    and costs no less than the monolithic minimum-cost circuit.
+    '''
+    random_city = grc.get_random_city([8, 8], vectorised=True, seed=0)
+    comparison = rt.compare_with_monolithic(
+        random_city, [8, 8], [4, 4], n_workers=2)
+    inverted_g = comparison['monolithic']['inverted_g']
+    circuit = comparison['tiled']['circuit_by_edge']
+
+    assert comparison['tiled']['n_tiles'] == 4
+    assert all(
+        circuit[i][1] == circuit[(i + 1) % len(circuit)][0]
+        for i in range(len(circuit)))
+    assert set(circuit) == set(inverted_g.edges())
+    assert comparison['cost_ratio'] >= 1
+    assert (comparison['tiled_cost']
+        == rt.get_circuit_cost(inverted_g, circuit))
+
+    trails = [
+        [(0, 1), (1, 0)], [(1, 2), (2, 1)], [(3, 4), (4, 3)]]
+    g = nx.DiGraph([(0, 1), (1, 0), (1, 2), (2, 1), (2, 3), (3, 2),
+        (3, 4), (4, 3)])
+    stitched = rt.stitch_trails(g, trails)
+    assert stitched['n_grafts'] == 1
+    assert sorted(stitched['circuit_by_edge']) == sorted(
+        [e for trail in trails for e in trail] + [(2, 3), (3, 2)])
+
+
+def test_random_walks():
+    '''
+    Test random walks cover the graph along its edges, reproducibly
+    whatever the number of workers.
+    '''
+    random_city = grc.get_random_city([6, 6], vectorised=True, seed=0)
+    inverted_g = gg.get_inverted_graph(random_city)
+    inverted_g = fg.prune_u_turns(inverted_g)
+
+    for get_path in (gr.get_random_path,
+            gr.get_random_path_with_min_repetitions):
+        path = get_path(inverted_g)
+        assert set(path) == set(inverted_g.nodes())
+        assert all(inverted_g.has_edge(*e) for e in zip(path, path[1:]))
+
+    walks = rw.run_random_walks(inverted_g, 4, seed=1, n_workers=2)
+    assert ([w['path'] for w in walks]
+        == [w['path'] for w in rw.run_random_walks(inverted_g, 4, seed=1)])
+    curves = rw.get_coverage_curves(walks, len(inverted_g))
+    assert curves.shape == (4, max(len(w['path']) for w in walks))
+    assert np.all(np.diff(curves, axis=1) >= 0)
+    assert np.all(curves[:, -1] == 1)
+
+    walk = rw.walk_until_covered(
+        rw.get_walk_graph(inverted_g), seed=1, max_steps=5)
+    assert len(walk['path']) == 5 and not walk['is_covered']
+
+
+def test_repair_route():
+    '''
+    Test a repaired route is still an eulerian circuit covering the graph,
+    after segments close and after they open again.
+    '''
+    random_city = grc.get_random_city([8, 8], vectorised=True, seed=0)
+    route = pl.run_pipeline(random_city, balancing_strategy='min_cost')
+    inverted_g = route['inverted_g']
+    closed_ids = []
+    for n in list(inverted_g.nodes()):
+        test_g = inverted_g.copy()
+        test_g.remove_nodes_from(closed_ids + [n])
+        if nx.is_strongly_connected(test_g):
+            closed_ids.append(n)
+        if len(closed_ids) == 2:
+            break
+    closed_segments = [
+        s for s in random_city if s['segment_id'] in closed_ids]
+
+    def check_route(repaired_route):
+        circuit = repaired_route['virtual_circuit']
+        assert all(
+            circuit[i][1] == circuit[(i + 1) % len(circuit)][0]
+            for i in range(len(circuit)))
+        assert (sorted(circuit, key=str) == sorted(
+            repaired_route['virtual_g'].edges(keys=True), key=str))
+        real_circuit = gr.get_real_path(
+            circuit, repaired_route['g'], repaired_route['virtual_g'])
+        assert (set(real_circuit['circuit_by_edge'])
+            == set(repaired_route['g'].edges()))
+
+    repaired_route = rr.repair_route(
+        inverted_g,
+        route['virtual_g'],
+        route['virtual_circuit'],
+        removed_segment_ids=closed_ids)
+    assert not any(n in repaired_route['g'] for n in closed_ids)
+    check_route(repaired_route)
+
+    repaired_route = rr.repair_route(
+        repaired_route['g'],
+        repaired_route['virtual_g'],
+        repaired_route['virtual_circuit'],
+        segments=random_city,
+        added_segments=closed_segments)
+    assert all(n in repaired_route['g'] for n in closed_ids)
+    check_route(repaired_route)
@@ -0,0 +1,155 @@
+'''
+Route inspection from the command line:
+get_inverted_graph -> prune -> balance -> circuit -> real path.
+
+Routes the segments of a JSON file (see pipeline.read_segments),
+or of a random city, then writes the route (see pipeline.get_route_data)
+and a timing summary (see profiler.get_profile_report).
+Run from the repository root:
+    python -m utilities --segments city.json --output route.json
+    python -m utilities --city-size 24 16 --seed 0 --output route.json \
+        --balancing-strategy min_cost --n-workers 4 --cache-dir .cache
+'''
+import argparse
+import os
+import sys
+
+import networkx as nx
+
+import utilities.global_parameters as ug
+import utilities.common as uc
+import utilities.get_random_city as grc
+import utilities.forge_graph as fg
+import utilities.pipeline as pl
+import utilities.profiler as up
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='python -m utilities',
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    city = parser.add_mutually_exclusive_group()
+    city.add_argument(
+        '--segments',
+        help='JSON file of the segments to route')
+    city.add_argument(
+        '--city-size', type=int, nargs=2, default=list(ug.CITY_SIZE),
+        help='west-to-east & south-to-north sizes of a random city')
+    parser.add_argument(
+        '--frequencies', type=float, nargs=4, default=list(ug.FREQUENCIES),
+        help='no_way, one_way_direct, one_way_reverse & two_way '
+             'frequencies of a random city')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='seed of a random city')
+    parser.add_argument(
+        '--output', required=True,
+        help='where to write the route (JSON)')
+    parser.add_argument(
+        '--report',
+        help='where to write the timing summary (JSON); '
+             'defaults to <output>_report.json')
+    parser.add_argument(
+        '--balancing-strategy', default='iterative',
+        choices=sorted(fg.BALANCING_STRATEGIES))
+    parser.add_argument(
+        '--weighted', action='store_true',
+        help='drive deadhead legs along manoeuvre penalties')
+    parser.add_argument(
+        '--n-workers', type=int, default=1,
+        help='processes computing the distance matrix of the assignment '
+             'strategy and expanding the real path')
+    parser.add_argument(
+        '--cache-dir',
+        help='cache pruned inverted graphs in this directory')
+    parser.add_argument(
+        '--trace-memory', action='store_true',
+        help='trace peak memory of every stage, at a cost in wall time')
+    parser.add_argument(
+        '--log-level', default='INFO',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    return parser
+
+
+def print_report(
+        report: dict):
+    print(f"{'stage':>28} {'time':>9} {'peak':>10}")
+    for s in report['stages']:
+        peak = (
+            f"{s['peak_memory'] / 2**20:>6.1f} MiB"
+            if s['peak_memory'] is not None else f"{'-':>10}")
+        print(f"{s['stage']:>28} {s['wall_time']:>8.3f}s {peak}")
+    print(f"{'total':>28} {report['total_wall_time']:>8.3f}s")
+
+
+def main(
+        argv: list = None) -> int:
+    '''
+    INPUT
+    argv    command-line arguments; None to use sys.argv (list of str)
+    ------------
+    OUTPUT
+    exit status, 0 on success, 1 if the segments cannot be routed (int)
+    '''
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(
+        level=getattr(logging, args.log_level),
+        format="%(levelname)s: %(asctime)s: %(filename)s: %(lineno)s:\n%(message)s")
+    report_path = args.report
+    if report_path is None:
+        report_path = os.path.splitext(args.output)[0] + '_report.json'
+
+    parameters = {
+        'balancing_strategy': args.balancing_strategy,
+        'weighted': args.weighted,
+        'n_workers': args.n_workers,
+        'cache_dir': args.cache_dir,
+        }
+    stages = []
+    try:
+        if args.segments is not None:
+            parameters['segments'] = args.segments
+            segments = up.profile_stage(
+                stages, 'read_segments', pl.read_segments, args.segments,
+                trace_memory=args.trace_memory)
+        else:
+            parameters.update({
+                'city_size': args.city_size,
+                'frequencies': args.frequencies,
+                'seed': args.seed,
+                })
+            segments = up.profile_stage(
+                stages, 'get_random_city', grc.get_random_city,
+                tuple(args.city_size), tuple(args.frequencies),
+                vectorised=True, seed=args.seed,
+                trace_memory=args.trace_memory)
+        route = pl.run_pipeline(
+            segments,
+            balancing_strategy=args.balancing_strategy,
+            weighted=args.weighted,
+            n_workers=args.n_workers,
+            stages=stages,
+            trace_memory=args.trace_memory,
+            cache_dir=args.cache_dir)
+    except (ValueError, nx.NetworkXException) as e:
+        logger.error(f"\tsegments cannot be routed: {e}")
+        return 1
+
+    route_data = pl.get_route_data(route)
+    route_data['parameters'] = parameters
+    uc.write_json(route_data, args.output)
+    report = up.get_profile_report(stages, parameters)
+    up.write_profile_report(report, report_path)
+    logger.info(
+        f"\troute of {route_data['n_segments']} segments, "
+        f"{route_data['circuit_len']} edges, written to {args.output}\n")
+    print_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
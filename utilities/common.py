@@ -1,17 +1,10 @@
-import os, sys, inspect
-import numpy as np
+import json
+import os
+import tempfile
 
-working_dir = os.path.dirname(
-    os.path.abspath(inspect.getfile(inspect.currentframe())))
-parent_dir = os.path.dirname(working_dir)
-sys.path.insert(0, parent_dir)
+import numpy as np
 
 from utilities import global_parameters as gp
-from utilities import get_random_city as grc
-from utilities import get_graph as gg
-from utilities import forge_graph as fg
-from utilities import visualise_graph as vg
-from utilities import get_route as gr
 
 
 def get_angle_between_two_edges(
@@ -46,4 +39,80 @@ def get_manoeuvre(
     elif 185 < angle <= 330:
         return 'turn_left'
     elif (330 < angle) or (angle <= 30):
-        return 'go_straight'
\ No newline at end of file
+        return 'go_straight'
+
+
+def get_angles_between_edges(
+        coordinates_in: np.ndarray,
+        coordinates_out: np.ndarray,
+        ) -> np.ndarray:
+    '''
+    Vectorised get_angle_between_two_edges.
+    INPUT
+    coordinates_in  start and end points of in-coming edges (N, 2, 2)
+    coordinates_out start and end points of out-going edges (N, 2, 2)
+    ------------
+    OUTPUT
+    angles  clockwise angle from in-coming to out-going edge (N,)
+    '''
+    coordinates_in = np.asarray(
+        coordinates_in, dtype=float).reshape(-1, 2, 2)
+    coordinates_out = np.asarray(
+        coordinates_out, dtype=float).reshape(-1, 2, 2)
+    v_i = coordinates_in[:, 1] - coordinates_in[:, 0]
+    v_j = coordinates_out[:, 1] - coordinates_out[:, 0]
+
+    cosine = np.einsum('ij,ij->i', v_i, v_j) / (
+        np.linalg.norm(v_i, axis=1) * np.linalg.norm(v_j, axis=1))
+    determinant = v_i[:, 0] * v_j[:, 1] - v_i[:, 1] * v_j[:, 0]
+    angle = 180 * np.arccos(np.clip(cosine, -1, 1)) / np.pi
+    return np.where(determinant < 0, angle, 360 - angle)
+
+
+def get_manoeuvres(
+        coordinates_in: np.ndarray,
+        coordinates_out: np.ndarray,
+        ) -> dict:
+    '''
+    Vectorised get_manoeuvre.
+    INPUT
+    coordinates_in  start and end points of in-coming edges (N, 2, 2)
+    coordinates_out start and end points of out-going edges (N, 2, 2)
+    ------------
+    OUTPUT
+    angles          clockwise angles between the edges (N,)
+    manoeuvre_codes indices into global_parameters.MANOEUVRES (N,)
+    '''
+    angles = get_angles_between_edges(coordinates_in, coordinates_out)
+    manoeuvre_codes = np.select(
+        [(30 < angles) & (angles <= 175),
+         (175 < angles) & (angles <= 185),
+         (185 < angles) & (angles <= 330)],
+        [gp.MANOEUVRES.index('turn_right'),
+         gp.MANOEUVRES.index('make_u_turn'),
+         gp.MANOEUVRES.index('turn_left')],
+        default=gp.MANOEUVRES.index('go_straight'))
+    return {
+        'angles': angles,
+        'manoeuvre_codes': manoeuvre_codes}
+
+
+# WRITE FILES =================================================================
+def write_json(
+        data,
+        path: str,
+        indent: int = None):
+    '''
+    Write data through a temporary file, so that readers never see
+    a partly written file, even if the run is killed.
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temporary_path = tempfile.mkstemp(
+        dir=directory, prefix='.tmp_', suffix='.json')
+    try:
+        with os.fdopen(file_descriptor, 'w') as f:
+            json.dump(data, f, indent=indent)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
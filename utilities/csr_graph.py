@@ -0,0 +1,607 @@
+import heapq
+
+import numpy as np
+import networkx as nx
+
+import utilities.global_parameters as ug
+import utilities.forge_graph as fg
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Edge codes are indices into these tuples (-1 for none).
+MANOEUVRES = ug.MANOEUVRES + ('quasi_manoeuvre',)
+EDGE_TYPES = ('segment', 'manoeuvre', 'virtual_edge')
+
+# Edge attributes stored as arrays rather than in the side table.
+ARRAY_ATTRIBUTES = ('weight', 'manoeuvre', 'type')
+
+
+# A. CONVERT GRAPHS ===========================================================
+def get_csr_indptr(
+        n_nodes: int,
+        tails: np.ndarray) -> np.ndarray:
+    '''
+    INPUT
+    n_nodes number of nodes (int)
+    tails   tail index of every edge, sorted (np.ndarray)
+    ------------
+    OUTPUT
+    indptr  edges of node i are indptr[i]:indptr[i+1] (np.ndarray)
+    '''
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tails, minlength=n_nodes), out=indptr[1:])
+    return indptr
+
+
+def get_csr_graph(
+        g: nx.DiGraph,
+        keep_attributes: bool = True) -> dict:
+    '''
+    INPUT
+    g               graph (nx.DiGraph or nx.MultiDiGraph)
+    keep_attributes whether to keep geometry & other edge data (bool)
+    ------------
+    OUTPUT
+    csr graph (dict)
+        nodes               node names (list)
+        node_index          node name -> node index (dict)
+        node_coordinates    (V, 2) array, nan where unknown
+        indptr              edges of node i are indptr[i]:indptr[i+1]
+        tails, heads        node indices of every edge (E,)
+        weights             edge weights (E,)
+        manoeuvre_codes     indices into MANOEUVRES, -1 for none (E,)
+        type_codes          indices into EDGE_TYPES, -1 for none (E,)
+        active              whether the edge is still in the graph (E,)
+        edge_attributes     side table of remaining edge data (list of dicts)
+                            or None
+    '''
+    nodes = list(g.nodes())
+    node_index = {n: i for i, n in enumerate(nodes)}
+    node_coordinates = np.full((len(nodes), 2), np.nan)
+    for n, coordinates in g.nodes(data='coordinates'):
+        if coordinates is not None:
+            node_coordinates[node_index[n]] = coordinates
+
+    # NB! g.edges() visits edges node by node, i.e. already in CSR order.
+    edges = list(g.edges(data=True))
+    tails = np.array([node_index[e[0]] for e in edges], dtype=np.int64)
+    heads = np.array([node_index[e[1]] for e in edges], dtype=np.int64)
+    weights = np.array(
+        [e[2].get('weight', 0) for e in edges], dtype=float)
+    manoeuvre_codes = np.array(
+        [MANOEUVRES.index(e[2]['manoeuvre'])
+         if e[2].get('manoeuvre') in MANOEUVRES else -1
+         for e in edges], dtype=np.int8)
+    type_codes = np.array(
+        [EDGE_TYPES.index(e[2]['type'])
+         if e[2].get('type') in EDGE_TYPES else -1
+         for e in edges], dtype=np.int8)
+    edge_attributes = None
+    if keep_attributes:
+        edge_attributes = [
+            {k: v for k, v in e[2].items() if k not in ARRAY_ATTRIBUTES}
+            for e in edges]
+
+    return {
+        'nodes': nodes,
+        'node_index': node_index,
+        'node_coordinates': node_coordinates,
+        'indptr': get_csr_indptr(len(nodes), tails),
+        'tails': tails,
+        'heads': heads,
+        'weights': weights,
+        'manoeuvre_codes': manoeuvre_codes,
+        'type_codes': type_codes,
+        'active': np.ones(len(edges), dtype=bool),
+        'edge_attributes': edge_attributes,
+        }
+
+
+def get_nx_graph(
+        csr: dict) -> nx.DiGraph:
+    '''
+    INPUT
+    csr graph, see get_csr_graph (dict)
+    ------------
+    OUTPUT
+    g   active edges of the graph; nx.MultiDiGraph if it holds
+        virtual edges, nx.DiGraph otherwise
+    '''
+    is_multigraph = bool(np.any(
+        csr['type_codes'][csr['active']]
+        == EDGE_TYPES.index('virtual_edge')))
+    g = nx.MultiDiGraph() if is_multigraph else nx.DiGraph()
+    nodes = csr['nodes']
+    for i, n in enumerate(nodes):
+        if np.isnan(csr['node_coordinates'][i, 0]):
+            g.add_node(n)
+        else:
+            g.add_node(n, coordinates=tuple(csr['node_coordinates'][i]))
+    for i in np.flatnonzero(csr['active']):
+        data = {}
+        if csr['edge_attributes'] is not None:
+            data.update(csr['edge_attributes'][i])
+        if csr['type_codes'][i] != EDGE_TYPES.index('virtual_edge'):
+            data['weight'] = csr['weights'][i].item()
+        if csr['manoeuvre_codes'][i] >= 0:
+            data['manoeuvre'] = MANOEUVRES[csr['manoeuvre_codes'][i]]
+        if csr['type_codes'][i] >= 0:
+            data['type'] = EDGE_TYPES[csr['type_codes'][i]]
+        g.add_edge(nodes[csr['tails'][i]], nodes[csr['heads'][i]], **data)
+    return g
+
+
+def get_edge_names(
+        csr: dict,
+        edge_indices: list) -> list:
+    '''
+    INPUT
+    csr graph, see get_csr_graph (dict)
+    edge_indices    (list of int)
+    ------------
+    OUTPUT
+    edges   tail & head node names (list of tuples)
+    '''
+    nodes = csr['nodes']
+    tails = csr['tails']
+    heads = csr['heads']
+    return [(nodes[tails[i]], nodes[heads[i]]) for i in edge_indices]
+
+
+# B. TRAVERSE GRAPH ===========================================================
+def get_adjacency_lists(
+        csr: dict,
+        reverse: bool = False) -> dict:
+    '''
+    Plain-list view of the graph for traversals, which are much faster
+    on Python lists than on element-wise numpy indexing.
+    INPUT
+    csr graph, see get_csr_graph (dict)
+    reverse whether to index edges by head instead of tail (bool)
+    ------------
+    OUTPUT
+    adjacency (dict)
+        indptr      edges of node i are order[indptr[i]:indptr[i+1]] (list)
+        order       edge indices (list)
+        ends        the other end of every edge (list)
+        active      whether the edge is still in the graph (list)
+    '''
+    if reverse:
+        order = np.argsort(csr['heads'], kind='stable')
+        indptr = get_csr_indptr(len(csr['nodes']), csr['heads'][order])
+        ends = csr['tails']
+    else:
+        order = np.arange(len(csr['tails']))
+        indptr = csr['indptr']
+        ends = csr['heads']
+    return {
+        'indptr': indptr.tolist(),
+        'order': order.tolist(),
+        'ends': ends.tolist(),
+        'active': csr['active'].tolist(),
+        }
+
+
+def get_reachable_nodes(
+        adjacency: dict,
+        source: int) -> set:
+    '''
+    INPUT
+    adjacency   see get_adjacency_lists (dict)
+    source      node index (int)
+    ------------
+    OUTPUT
+    nodes reachable from source (set of int)
+    '''
+    indptr, order = adjacency['indptr'], adjacency['order']
+    ends, active = adjacency['ends'], adjacency['active']
+    visited = {source}
+    frontier = [source]
+    while frontier:
+        n = frontier.pop()
+        for k in range(indptr[n], indptr[n + 1]):
+            i = order[k]
+            if active[i] and ends[i] not in visited:
+                visited.add(ends[i])
+                frontier.append(ends[i])
+    return visited
+
+
+def is_strongly_connected(
+        csr: dict) -> bool:
+    n_nodes = len(csr['nodes'])
+    if n_nodes == 0:
+        return False
+    return (
+        len(get_reachable_nodes(get_adjacency_lists(csr), 0)) == n_nodes
+        and len(get_reachable_nodes(
+            get_adjacency_lists(csr, reverse=True), 0)) == n_nodes)
+
+
+def is_edge_removable(
+        adjacency: dict,
+        tail: int,
+        head: int,
+        edge: int) -> bool:
+    '''
+    CSR counterpart of forge_graph.is_edge_removable.
+    INPUT
+    adjacency   see get_adjacency_lists (dict)
+    tail, head  node indices of the edge (int)
+    edge        edge index (int)
+    ------------
+    OUTPUT
+    whether head is reachable from tail without the edge (bool)
+    '''
+    if tail == head:
+        return True
+    indptr, order = adjacency['indptr'], adjacency['order']
+    ends, active = adjacency['ends'], adjacency['active']
+    visited = {tail}
+    frontier = [tail]
+    while frontier:
+        n = frontier.pop()
+        for k in range(indptr[n], indptr[n + 1]):
+            i = order[k]
+            if not active[i] or i == edge:
+                continue
+            if ends[i] == head:
+                return True
+            if ends[i] not in visited:
+                visited.add(ends[i])
+                frontier.append(ends[i])
+    return False
+
+
+def get_shortest_path_tree(
+        adjacency: dict,
+        weights: list,
+        source: int,
+        targets: set,
+        weighted: bool = False) -> dict:
+    '''
+    CSR counterpart of get_route.get_shortest_path_tree.
+    INPUT
+    adjacency   see get_adjacency_lists (dict)
+    weights     deadhead weight of every edge (list)
+    source      node index (int)
+    targets     node indices to reach (set)
+    weighted    whether to use weights instead of edge counts (bool)
+    ------------
+    OUTPUT
+    predecessor edges (dict)
+        node index  index of the last edge of a shortest path to it
+    '''
+    indptr, order = adjacency['indptr'], adjacency['order']
+    ends, active = adjacency['ends'], adjacency['active']
+    predecessors = {source: None}
+    targets_left = set(targets) - {source}
+    if weighted is False:
+        frontier = [source]
+        while frontier and targets_left:
+            next_frontier = []
+            for n in frontier:
+                for k in range(indptr[n], indptr[n + 1]):
+                    i = order[k]
+                    if active[i] and ends[i] not in predecessors:
+                        predecessors[ends[i]] = i
+                        targets_left.discard(ends[i])
+                        next_frontier.append(ends[i])
+            frontier = next_frontier
+        return predecessors
+
+    distances = {source: 0}
+    settled = set()
+    heap = [(0, source)]
+    while heap and targets_left:
+        distance, n = heapq.heappop(heap)
+        if n in settled:
+            continue
+        settled.add(n)
+        targets_left.discard(n)
+        for k in range(indptr[n], indptr[n + 1]):
+            i = order[k]
+            if not active[i]:
+                continue
+            m_distance = distance + weights[i]
+            if m_distance < distances.get(ends[i], float('inf')):
+                distances[ends[i]] = m_distance
+                predecessors[ends[i]] = i
+                heapq.heappush(heap, (m_distance, ends[i]))
+    return predecessors
+
+
+def get_shortest_path_lengths(
+        adjacency: dict,
+        weights: list,
+        source: int) -> dict:
+    '''
+    INPUT
+    adjacency   see get_adjacency_lists (dict)
+    weights     weight of every edge (list)
+    source      node index (int)
+    ------------
+    OUTPUT
+    distances (dict)
+        node index  shortest-path length from source
+    '''
+    indptr, order = adjacency['indptr'], adjacency['order']
+    ends, active = adjacency['ends'], adjacency['active']
+    distances = {source: 0}
+    settled = set()
+    heap = [(0, source)]
+    while heap:
+        distance, n = heapq.heappop(heap)
+        if n in settled:
+            continue
+        settled.add(n)
+        for k in range(indptr[n], indptr[n + 1]):
+            i = order[k]
+            if not active[i]:
+                continue
+            m_distance = distance + weights[i]
+            if m_distance < distances.get(ends[i], float('inf')):
+                distances[ends[i]] = m_distance
+                heapq.heappush(heap, (m_distance, ends[i]))
+    return distances
+
+
+# C. PRUNE GRAPH ==============================================================
+def prune_manoeuvres(
+        csr: dict,
+        manoeuvre: str,
+        edges: list = None) -> dict:
+    '''
+    CSR counterpart of forge_graph.prune_manoeuvres;
+    pruned edges are deactivated in place.
+    INPUT
+    csr graph, see get_csr_graph (dict)
+    manoeuvre   manoeuvre to prune (str)
+    edges       order in which to try the edges, by index (list of int)
+    ------------
+    OUTPUT
+    csr graph (dict)
+    '''
+    if not is_strongly_connected(csr):
+        return csr
+    if edges is None:
+        edges = np.flatnonzero(csr['active']).tolist()
+    manoeuvre_code = MANOEUVRES.index(manoeuvre)
+    adjacency = get_adjacency_lists(csr)
+    manoeuvre_codes = csr['manoeuvre_codes'].tolist()
+    tails = csr['tails'].tolist()
+    heads = csr['heads'].tolist()
+    for i in edges:
+        if (adjacency['active'][i]
+            and manoeuvre_codes[i] == manoeuvre_code
+            and is_edge_removable(adjacency, tails[i], heads[i], i)):
+            adjacency['active'][i] = False
+    csr['active'] = np.array(adjacency['active'], dtype=bool)
+    return csr
+
+
+def prune_u_turns(
+        csr: dict) -> dict:
+    edges = np.flatnonzero(csr['active']).tolist()
+    edge_names = get_edge_names(csr, edges)
+    edge_by_name = dict(zip(edge_names, edges))
+    # NB! Same order as forge_graph.prune_u_turns.
+    edges_sorted = [
+        edge_by_name[e] for e in fg.sort_edges_by_pairs(edge_names)]
+    return prune_manoeuvres(csr, 'make_u_turn', edges_sorted)
+
+
+def prune_left_turns(
+        csr: dict) -> dict:
+    return prune_manoeuvres(csr, 'turn_left')
+
+
+def prune_right_turns(
+        csr: dict) -> dict:
+    return prune_manoeuvres(csr, 'turn_right')
+
+
+# D. BALANCE GRAPH ============================================================
+def get_deadhead_weights(
+        csr: dict) -> list:
+    '''
+    CSR counterpart of forge_graph.get_deadhead_weight.
+    '''
+    return (1 + csr['weights']).tolist()
+
+
+def add_edges(
+        csr: dict,
+        tails: np.ndarray,
+        heads: np.ndarray,
+        edge_type: str) -> dict:
+    '''
+    INPUT
+    csr graph, see get_csr_graph (dict)
+    tails, heads    node indices of the new edges (np.ndarray)
+    edge_type       one of EDGE_TYPES (str)
+    ------------
+    OUTPUT
+    new csr graph, with edges re-sorted into CSR order (dict)
+    '''
+    n_new = len(tails)
+    all_tails = np.concatenate([csr['tails'], tails])
+    order = np.argsort(all_tails, kind='stable')
+    new_csr = dict(csr)
+    new_csr['tails'] = all_tails[order]
+    new_csr['heads'] = np.concatenate([csr['heads'], heads])[order]
+    new_csr['weights'] = np.concatenate(
+        [csr['weights'], np.zeros(n_new)])[order]
+    new_csr['manoeuvre_codes'] = np.concatenate(
+        [csr['manoeuvre_codes'], np.full(n_new, -1, dtype=np.int8)])[order]
+    new_csr['type_codes'] = np.concatenate(
+        [csr['type_codes'],
+         np.full(n_new, EDGE_TYPES.index(edge_type), dtype=np.int8)])[order]
+    new_csr['active'] = np.concatenate(
+        [csr['active'], np.ones(n_new, dtype=bool)])[order]
+    if csr['edge_attributes'] is not None:
+        edge_attributes = csr['edge_attributes'] + [{}] * n_new
+        new_csr['edge_attributes'] = [edge_attributes[i] for i in order]
+    new_csr['indptr'] = get_csr_indptr(len(csr['nodes']), new_csr['tails'])
+    return new_csr
+
+
+def balance_graph(
+        csr: dict) -> dict:
+    '''
+    CSR counterpart of forge_graph.balance_graph_min_cost.
+    INPUT
+    csr graph, strongly connected (dict)
+    ------------
+    OUTPUT
+    eulerian csr graph, with virtual edges of type 'virtual_edge' (dict)
+        deadhead_cost   total deadhead cost of the virtual edges
+    '''
+    active = csr['active']
+    n_nodes = len(csr['nodes'])
+    imbalance = (
+        np.bincount(csr['heads'][active], minlength=n_nodes)
+        - np.bincount(csr['tails'][active], minlength=n_nodes))
+    excess_ins = np.flatnonzero(imbalance > 0).tolist()
+    excess_outs = set(np.flatnonzero(imbalance < 0).tolist())
+    logger.info(
+        f"\tnodes # {n_nodes}\n"
+        f"\tedges # {int(active.sum())}\n"
+        f"\tIMBALANCED NODES:\n"
+        f"\texcess ins # {len(excess_ins)}\n"
+        f"\texcess outs # {len(excess_outs)}\n")
+
+    transport_g = nx.DiGraph()
+    for n in excess_ins:
+        transport_g.add_node(('in', n), demand=-int(imbalance[n]))
+    for m in excess_outs:
+        transport_g.add_node(('out', m), demand=-int(imbalance[m]))
+    adjacency = get_adjacency_lists(csr)
+    weights = get_deadhead_weights(csr)
+    for n in excess_ins:
+        distances = get_shortest_path_lengths(adjacency, weights, n)
+        for m, distance in distances.items():
+            if m in excess_outs:
+                transport_g.add_edge(('in', n), ('out', m), weight=distance)
+    deadhead_cost, flows = 0, {}
+    if len(transport_g) > 0:
+        deadhead_cost, flows = nx.network_simplex(transport_g)
+
+    virtual_tails = []
+    virtual_heads = []
+    for (_, n), n_flows in flows.items():
+        for (_, m), flow in n_flows.items():
+            virtual_tails += [n] * flow
+            virtual_heads += [m] * flow
+    virtual_csr = add_edges(
+        csr,
+        np.array(virtual_tails, dtype=np.int64),
+        np.array(virtual_heads, dtype=np.int64),
+        'virtual_edge')
+    virtual_csr['deadhead_cost'] = deadhead_cost
+    logger.info(
+        f"\tadded {len(virtual_tails)} edges\n"
+        f"\tdeadhead cost {deadhead_cost}\n")
+    return virtual_csr
+
+
+# E. GET ROUTE ================================================================
+def get_eulerian_circuit(
+        csr: dict,
+        source: int = None) -> list:
+    '''
+    Hierholzer's algorithm over the active edges.
+    INPUT
+    csr graph, eulerian (dict)
+    source  node index to start from, defaults to the first tail (int)
+    ------------
+    OUTPUT
+    virtual circuit (list of edge indices)
+    '''
+    adjacency = get_adjacency_lists(csr)
+    indptr, ends, active = (
+        adjacency['indptr'], adjacency['ends'], adjacency['active'])
+    active_edges = np.flatnonzero(csr['active'])
+    if len(active_edges) == 0:
+        return []
+    if source is None:
+        source = int(csr['tails'][active_edges[0]])
+    next_edge = indptr[:-1]
+    node_stack = [source]
+    edge_stack = []
+    circuit = []
+    while node_stack:
+        n = node_stack[-1]
+        while next_edge[n] < indptr[n + 1] and not active[next_edge[n]]:
+            next_edge[n] += 1
+        if next_edge[n] < indptr[n + 1]:
+            i = next_edge[n]
+            next_edge[n] += 1
+            node_stack.append(ends[i])
+            edge_stack.append(i)
+        else:
+            node_stack.pop()
+            if edge_stack:
+                circuit.append(edge_stack.pop())
+    return circuit[::-1]
+
+
+def get_real_path(
+        csr: dict,
+        virtual_circuit: list,
+        weighted: bool = False) -> dict:
+    '''
+    CSR counterpart of get_route.get_real_path.
+    INPUT
+    csr graph, balanced (dict)
+    virtual_circuit see get_eulerian_circuit (list of edge indices)
+    weighted        whether deadhead legs follow MANOEUVRE_PENALTY
+                    weights or edge counts (bool)
+    ------------
+    OUTPUT
+    edge_indices    real circuit (list of edge indices)
+    circuit_by_edge real circuit (list of tuples)
+    circuit_by_node real circuit (list of nodes)
+    '''
+    virtual_code = EDGE_TYPES.index('virtual_edge')
+    type_codes = csr['type_codes'].tolist()
+    tails = csr['tails'].tolist()
+    heads = csr['heads'].tolist()
+
+    virtual_targets = {}
+    for i in virtual_circuit:
+        if type_codes[i] == virtual_code:
+            virtual_targets.setdefault(tails[i], set()).add(heads[i])
+    real_csr = dict(csr)
+    real_csr['active'] = csr['active'] & (csr['type_codes'] != virtual_code)
+    adjacency = get_adjacency_lists(real_csr)
+    weights = get_deadhead_weights(csr)
+    trees = {
+        n: get_shortest_path_tree(
+            adjacency, weights, n, targets, weighted)
+        for n, targets in virtual_targets.items()}
+
+    real_circuit = []
+    for i in virtual_circuit:
+        if type_codes[i] != virtual_code:
+            real_circuit.append(i)
+        else:
+            tree = trees[tails[i]]
+            if heads[i] not in tree:
+                raise nx.NetworkXNoPath(
+                    f"node {csr['nodes'][heads[i]]} is not reachable")
+            path = []
+            n = heads[i]
+            while tree[n] is not None:
+                path.append(tree[n])
+                n = tails[tree[n]]
+            real_circuit += path[::-1]
+
+    circuit_by_edge = get_edge_names(csr, real_circuit)
+    logger.info(
+        f"\teulerian circuit length {len(circuit_by_edge)}\n")
+    return {
+        'edge_indices': real_circuit,
+        'circuit_by_edge': circuit_by_edge,
+        'circuit_by_node': [e[0] for e in circuit_by_edge]}
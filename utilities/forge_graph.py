@@ -1,25 +1,17 @@
-import os, sys, inspect
+import concurrent.futures
+import heapq
 
 import numpy as np
-
-import matplotlib
-import matplotlib.pyplot as plt
-plt.style.use('fivethirtyeight')
-
 import networkx as nx
-import shapely as sh
-
-import utilities.global_parameters as ug
-import utilities.common as uc
-
-import utilities.visualise_graph as vg
 
 import logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(levelname)s: %(asctime)s: %(filename)s: %(lineno)s:\n%(message)s")
 logger = logging.getLogger(__name__)
 
+# Graph & distance-matrix columns of the worker, set once per worker
+# by init_worker.
+WORKER_GRAPH = None
+WORKER_TARGETS = None
+
 
 # CONDENSE NODES ==============================================================
 def condense_nodes(
@@ -32,144 +24,148 @@ def condense_nodes(
     Condense (merge) multiple nodes into one:
     for all edges going to or coming from one of the 'old nodes',
     make an edge going to or coming from the 'new node'.
+    Only edges of the condensed nodes are visited.
     INPUT
     g                       graph (nx.DiGraph)
-    nodes_to_condense       node names to condense (list)
+    nodes_to_condense       node names to condense (list or set)
     new_node_name           condensation-node name (str)
     new_node_coordinates    condensation-node coordinates (str)
     ------------
     OUTPUT
     g   graph (nx.DiGraph)
     '''
-    
+    nodes_to_condense = set(nodes_to_condense)
     g.add_node(
         new_node_name,
         coordinates=new_node_coordinates) # add condensation node
-    
-    g_edges = list(g.edges(data=True))
-    for tail, head, data in g_edges:
-        if tail in nodes_to_condense:
-            g.add_edge(
+
+    condensed_edges = []
+    for tail, head, data in g.out_edges(nodes_to_condense, data=True):
+        if head not in nodes_to_condense:
+            condensed_edges.append((
                 new_node_name,
                 head,
-                coordinates=[new_node_coordinates, data['coordinates'][1]],
-                manoeuvre='quasi_manoeuvre',
-                type='segment')
-        elif head in nodes_to_condense:
-            g.add_edge(
+                {'coordinates': [new_node_coordinates, data['coordinates'][1]],
+                 'manoeuvre': 'quasi_manoeuvre',
+                 'type': 'segment'}))
+    for tail, head, data in g.in_edges(nodes_to_condense, data=True):
+        if tail not in nodes_to_condense:
+            condensed_edges.append((
                 tail,
                 new_node_name,
-                coordinates=[data['coordinates'][0], new_node_coordinates],
-                manoeuvre='quasi_manoeuvre',
-                type='segment')
-    
-    for n in nodes_to_condense: # remove the condensed nodes
-        g.remove_node(n)
+                {'coordinates': [data['coordinates'][0], new_node_coordinates],
+                 'manoeuvre': 'quasi_manoeuvre',
+                 'type': 'segment'}))
+    g.add_edges_from(condensed_edges)
+
+    g.remove_nodes_from(nodes_to_condense) # remove the condensed nodes
     return g
 
 
 # add grafts to graph =========================================================
 def get_grafting_nodes_and_edges(
-    g: nx.DiGraph,
-    super_g: nx.DiGraph,
-    condensed_g: nx.DiGraph,
-    source_node: str = None,
-    target_node: str = None):
-    
-    nodes_to_add = nx.shortest_path(
-        condensed_g,
-        source_node,
-        target_node)[1:-1]
-    edges_to_add = [(nodes_to_add[i], nodes_to_add[i+1])
-        for i in range(len(nodes_to_add)-1)]
-
-    for tail, head in super_g.in_edges(nodes_to_add[0]):
-        if tail in g.nodes:
-            edges_to_add.append((tail, head))
-            nodes_to_add.append(head)
-
-    for tail, head in super_g.in_edges(nodes_to_add[-1]):
-        if head in g.nodes:
-            edges_to_add.append((tail, head))
-            nodes_to_add.append(tail)
-
-    return {'nodes_to_add': nodes_to_add,
-            'edges_to_add': edges_to_add}
+        g: nx.DiGraph,
+        super_g: nx.DiGraph,
+        source_nodes: set,
+        target_nodes: set):
+    '''
+    Shortest path along super_g from any source node to any target node,
+    see get_shortest_path_between_node_sets.
+    INPUT
+    g               graph (nx.DiGraph)
+    super_g         graph g is part of (nx.DiGraph)
+    source_nodes    nodes of g (set)
+    target_nodes    nodes of g (set)
+    ------------
+    OUTPUT
+    nodes_to_add    path nodes missing from g (list)
+    edges_to_add    path edges missing from g (list of tuples)
+    '''
+    path = get_shortest_path_between_node_sets(
+        super_g, source_nodes, target_nodes)
+    return {
+        'nodes_to_add': [n for n in path if n not in g],
+        'edges_to_add': [
+            (tail, head) for tail, head in zip(path[:-1], path[1:])
+            if not g.has_edge(tail, head)]}
 
 
-def add_connecting_grafts(
-    g: nx.DiGraph,
-    super_g: nx.DiGraph):
+def get_shortest_path_between_node_sets(
+        g: nx.DiGraph,
+        sources: set,
+        targets: set) -> list:
+    '''
+    Shortest deadhead path from any source to the nearest target,
+    grown from all sources at once (see get_deadhead_weight).
+    INPUT
+    g       graph (nx.DiGraph)
+    sources source nodes (set)
+    targets target nodes (set)
+    ------------
+    OUTPUT
+    path    nodes from a source to a target (list)
+    '''
+    predecessors = {n: None for n in sources}
+    distances = {n: 0 for n in sources}
+    settled = set()
+    heap = [(0, i, n) for i, n in enumerate(sources)]
+    heapq.heapify(heap)
+    counter = len(heap)
+    while heap:
+        distance, _, tail = heapq.heappop(heap)
+        if tail in settled:
+            continue
+        settled.add(tail)
+        if tail in targets:
+            path = [tail]
+            while predecessors[path[-1]] is not None:
+                path.append(predecessors[path[-1]])
+            return path[::-1]
+        for head, data in g[tail].items():
+            head_distance = distance + get_deadhead_weight(tail, head, data)
+            if head_distance < distances.get(head, float('inf')):
+                distances[head] = head_distance
+                predecessors[head] = tail
+                heapq.heappush(heap, (head_distance, counter, head))
+                counter += 1
+    raise nx.NetworkXNoPath("no target is reachable from the sources")
+
 
-    # Get strongly connected components.
+def add_connecting_grafts(
+        g: nx.DiGraph,
+        super_g: nx.DiGraph) -> nx.DiGraph:
+    '''
+    Connect the two biggest strongly connected components (scc) of g
+    with the shortest paths along super_g between them, both ways.
+    INPUT
+    g       graph (nx.DiGraph)
+    super_g graph g is part of (nx.DiGraph)
+    ------------
+    OUTPUT
+    working_g   copy of g with the grafts (nx.DiGraph)
+    '''
+    # Select two biggest strongly connected components (scc).
     g_scc = sorted(
-        list(nx.strongly_connected_components(g)),
+        nx.strongly_connected_components(g),
         key=len,
-        reverse=True)
-    condensed_g = super_g.copy()
-    # Select two biggest strongly connected components (scc).
-    for i, scc in enumerate(g_scc[:2]):
-        scc_coordinates = list(
-            zip(*[super_g.nodes(data=True)[n]['coordinates']
-            for n in scc]))
-        condensation_coordinates = tuple(
-            [np.mean(c)
-            for c in scc_coordinates])
-        condensed_g = condense_nodes(
-            condensed_g,
-            scc,
-            i,
-            condensation_coordinates)
-        # print(condensed_g.nodes())
-    # vg.visualise_manoeuvre_graph(condensed_g)
-    nodes_to_add = []
-    edges_to_add = []
-    grafting_n_e_0_to_1 = get_grafting_nodes_and_edges(
-        g, super_g, condensed_g, 0, 1)
-    for n in grafting_n_e_0_to_1['nodes_to_add']:
-        nodes_to_add.append(n)
-    for e in grafting_n_e_0_to_1['edges_to_add']:
-        edges_to_add.append(e)
-    grafting_n_e_1_to_0 = get_grafting_nodes_and_edges(
-        g, super_g, condensed_g, 1, 0)
-    for n in grafting_n_e_1_to_0['nodes_to_add']:
-        nodes_to_add.append(n)
-    for e in grafting_n_e_1_to_0['edges_to_add']:
-        edges_to_add.append(e)
-
-    # logger.info(
-    #     f"added edges: {edges_to_add}\n"
-    #     f"added nodes: {nodes_to_add}")
-
+        reverse=True)[:2]
     working_g = g.copy()
-    for tail, head in edges_to_add:
-        edge_data=super_g.get_edge_data(tail, head)
-        working_g.add_edge(
-                tail,
-                head,
-                weight=edge_data['weight'],
-                geometry=edge_data['geometry'],
-                coordinates=edge_data['coordinates'],
-                manoeuvre=edge_data['manoeuvre'],
-                type=edge_data['type'])
-    nodes_coordinates = nx.get_node_attributes(super_g, 'coordinates')
-    for n in nodes_to_add:
-        nx.set_node_attributes(
-            working_g,
-            {'coordinates': nodes_coordinates[n]})
-
-    # an ugly way to remove disconnected nodes;
-    # in fact, they should not be included into the graph from the very start.
-    # connected_nodes = sorted(
-    #     nx.strongly_connected_components(working_g),
-    #     key=len,
-    #     reverse=True)[0]
-    # disconnected_nodes = []
-    # for n in working_g.nodes():
-    #     if n not in connected_nodes:
-    #         disconnected_nodes.append(n)
-    # working_g.remove_nodes_from(disconnected_nodes)
+    if len(g_scc) < 2:
+        return working_g
 
+    nodes_to_add = []
+    edges_to_add = []
+    for source_nodes, target_nodes in (g_scc, g_scc[::-1]):
+        grafting_n_e = get_grafting_nodes_and_edges(
+            g, super_g, source_nodes, target_nodes)
+        nodes_to_add += grafting_n_e['nodes_to_add']
+        edges_to_add += grafting_n_e['edges_to_add']
+
+    working_g.add_nodes_from(
+        (n, super_g.nodes[n]) for n in nodes_to_add)
+    working_g.add_edges_from(
+        (tail, head, super_g.edges[tail, head])
+        for tail, head in edges_to_add)
     return working_g
 
 
@@ -188,42 +184,22 @@ def remove_single_nodes(
 
 
 # join edges in graph =========================================================
-def join_two_linestrings(
-        linestring_i,
-        linestring_j,
-        ):
-    '''
-    Takes two linestrings.
-    NB! assumes linestring_i has correct geometry,
-    therefore linestring_i geometry is never inverted
-    '''
-    coords_i = list(linestring_i.coords)
-    coords_j = list(linestring_j.coords)
-    if coords_i[0] == coords_j[0]:
-        new_coords = coords_j[::-1][:-1] + coords_i
-        return sh.geometry.LineString(new_coords)
-    elif coords_i[0] == coords_j[-1]:
-        new_coords = coords_j[:-1] + coords_i
-        return sh.geometry.LineString(new_coords)
-    elif coords_i[-1] == coords_j[0]:
-        new_coords = coords_i + coords_j[1:]
-        return sh.geometry.LineString(new_coords)
-    elif coords_i[-1] == coords_j[-1]:
-        new_coords = coords_i + coords_j[::-1][1:]
-        return sh.geometry.LineString(new_coords)
+def get_straight_successor(
+        g: nx.DiGraph,
+        n: str) -> str:
+    return [
+        head for head, data in g[n].items()
+        if data['manoeuvre'] == 'go_straight'][0]
 
 
 def is_joinable(
         g: nx.DiGraph,
         n: str) -> bool:
 
-    adjacent_edge_tail = [
-        e for e in g.out_edges(n)
-        if g.get_edge_data(*e)['manoeuvre'] == 'go_straight'][0][1]
-    in_edges = g.in_edges(adjacent_edge_tail)
+    adjacent_edge_tail = get_straight_successor(g, n)
     ways_in = [
-        g.get_edge_data(*e)['manoeuvre']
-        for e in in_edges]
+        data['manoeuvre']
+        for data in g.pred[adjacent_edge_tail].values()]
     # Check whether 'turn_right' or 'turn_left' are possible ways_in.
     if 'turn_right' in ways_in or 'turn_left' in ways_in:
         return False
@@ -243,22 +219,17 @@ def get_splitting_nodes(
     can be reconnected, thus simplifying the graph)
     '''
     splitting_nodes = []
-    for n in g.nodes():
-        if g.out_degree[n] == 1:
-            out_edge = list(g.out_edges(n))[0]
-            escape = g.get_edge_data(*out_edge)['manoeuvre']
-            escape_coordinates = g.get_edge_data(*out_edge)['coordinates']
+    for n, successors in g.adjacency():
+        if len(successors) == 1:
+            escape_data = next(iter(successors.values()))
             # Check whether it is a manoeuvre edge and whether it reads 'go_straight'.
             if (
-                len(escape_coordinates) == 1 and
-                escape == 'go_straight' and
+                len(escape_data['coordinates']) == 1 and
+                escape_data['manoeuvre'] == 'go_straight' and
                 is_joinable(g, n)):
                 splitting_nodes.append(n)
-        if g.out_degree[n] == 2:
-            out_edges = g.out_edges(n)
-            ways_out = [
-                g.get_edge_data(*e)['manoeuvre']
-                for e in out_edges]
+        if len(successors) == 2:
+            ways_out = [data['manoeuvre'] for data in successors.values()]
             # Check whether 'go_straight' and 'make_u_turn' are the only two ways_out.
             if (
                 'go_straight' in ways_out and
@@ -267,70 +238,144 @@ def get_splitting_nodes(
                 splitting_nodes.append(n)
     return splitting_nodes
 
+
 def join_split_edges(
         g: nx.DiGraph
         ):
-    splitting_nodes = get_splitting_nodes(g)
-    n_nodes_to_remove = len(splitting_nodes)
-    while len(splitting_nodes) > 0:
-        g = join_edges(g, splitting_nodes)
-        splitting_nodes = get_splitting_nodes(g)
-    logger.info(f"\tremoved {n_nodes_to_remove} nodes")
-    return g
+    '''
+    Join every maximal chain of segments linked through splitting nodes
+    (see get_splitting_nodes) into one segment edge, in a single pass.
+    NB! g is rewritten in place; chains closing on themselves are kept.
+    INPUT
+    g   manoeuvre graph (nx.DiGraph)
+    ------------
+    OUTPUT
+    g   graph with joined chains (nx.DiGraph)
+    '''
+    import shapely.geometry
 
+    splitting_nodes = get_splitting_nodes(g)
+    # splitting node -> its segment & the next segment of its chain
+    segments = {}
+    next_segments = {}
+    for n in splitting_nodes:
+        segments[n] = (next(iter(g.pred[n])), n)
+        next_tail = get_straight_successor(g, n)
+        next_segments[n] = (next_tail, get_straight_successor(g, next_tail))
+    next_tails = set(tail for tail, _ in next_segments.values())
 
-def join_edges(
-        g: nx.DiGraph,
-        splitting_nodes: list,
-        ):
-    working_g = g.copy()
+    n_nodes_removed = 0
     for n in splitting_nodes:
-        edge_in = list(working_g.in_edges(n))[0]
-        edge_in_data = working_g.get_edge_data(*edge_in)
-        go_straight_manoeuvre = [
-            e for e in working_g.out_edges(n)
-            if working_g.get_edge_data(*e)['manoeuvre'] == 'go_straight'][0]
-        edge_out = [
-            e for e in working_g.out_edges(go_straight_manoeuvre[1])
-            if working_g.get_edge_data(*e)['manoeuvre'] == 'go_straight'][0]
-        edge_out_data = working_g.get_edge_data(*edge_out)
-        combined_geometry = join_two_linestrings(
-            edge_in_data['geometry'],
-            edge_out_data['geometry'])
-        combined_coordinates = [
-            edge_in_data['coordinates'][0],
-            edge_out_data['coordinates'][1]]
-        tail = edge_in[0]
-        head = edge_out[1]
-        working_g.add_edge(
+        tail = segments[n][0]
+        if tail in next_tails:
+            continue  # not the first segment of a chain
+        chain = [(tail, n)]
+        while chain[-1][1] in next_segments:
+            chain.append(next_segments[chain[-1][1]])
+        chain_coordinates = list(g.edges[chain[0]]['geometry'].coords)
+        for segment in chain[1:]:
+            chain_coordinates += list(g.edges[segment]['geometry'].coords)[1:]
+        chain_geometry = shapely.geometry.LineString(chain_coordinates)
+        head = chain[-1][1]
+        g.add_edge(
             tail,
-            head, 
-            weight=combined_geometry.length,
-            edge_id=str(edge_in_data['edge_id']),
-            geometry=combined_geometry,
+            head,
+            weight=chain_geometry.length,
+            edge_id=str(g.edges[chain[0]]['edge_id']),
+            geometry=chain_geometry,
             manoeuvre='go_straight',
-            coordinates=combined_coordinates,
+            coordinates=[
+                g.edges[chain[0]]['coordinates'][0],
+                g.edges[chain[-1]]['coordinates'][1]],
             type='segment',
             )
-        working_g.remove_node(edge_in[1])
-        working_g.remove_node(edge_out[0])
-    return working_g
+        g.remove_nodes_from(
+            [segment[1] for segment in chain[:-1]]
+            + [segment[0] for segment in chain[1:]])
+        n_nodes_removed += 2 * (len(chain) - 1)
+    logger.info(f"\tremoved {n_nodes_removed} nodes")
+    return g
 
 # PRUNE GRAPH =================================================================
 def sort_edges_by_pairs(
         edges: list,
         ) -> list:
+    edges_set = set(edges)
     edges_sorted = []
+    edges_seen = set()
     for e in edges:
-        if e not in edges_sorted:
+        if e not in edges_seen:
             edges_sorted.append(e)
+            edges_seen.add(e)
+            twin = (-e[0], -e[1])
             if (((e[0] * e[1]) < 0) and
-                ((-e[0], -e[1]) in edges) and
-                ((-e[0], -e[1]) not in edges_sorted)):
-                edges_sorted.append((-e[0], -e[1]))
+                (twin in edges_set) and
+                (twin not in edges_seen)):
+                edges_sorted.append(twin)
+                edges_seen.add(twin)
     return edges_sorted
 
 
+def is_edge_removable(
+        g: nx.DiGraph,
+        edge: tuple) -> bool:
+    '''
+    Whether a strongly connected graph stays strongly connected
+    without the edge, i.e. whether its head is still reachable from its tail.
+    The search skips the edge instead of removing it, so the graph
+    (including its edge order) is left untouched, and stops at the head.
+    INPUT
+    g       strongly connected graph (nx.DiGraph)
+    edge    tail, head (tuple)
+    ------------
+    OUTPUT
+    whether the edge can be removed (bool)
+    '''
+    tail, head = edge
+    if tail == head:
+        return True
+    visited = {tail}
+    frontier = [tail]
+    while frontier:
+        n = frontier.pop()
+        for m in g.successors(n):
+            if m == head:
+                if n != tail:
+                    return True
+                continue
+            if m not in visited:
+                visited.add(m)
+                frontier.append(m)
+    return False
+
+
+def prune_manoeuvres(
+        g: nx.DiGraph,
+        manoeuvre: str,
+        edges: list = None) -> nx.DiGraph:
+    '''
+    Remove, in place, every edge with the given manoeuvre,
+    as long as the graph stays strongly connected.
+    INPUT
+    g           graph (nx.DiGraph)
+    manoeuvre   manoeuvre to prune (str)
+    edges       order in which to try the edges, defaults to g.edges() (list)
+    ------------
+    OUTPUT
+    g   pruned graph (nx.DiGraph)
+    '''
+    if edges is None:
+        edges = list(g.edges())
+    # NB! No removal can make a graph strongly connected.
+    if len(g) == 0 or not nx.is_strongly_connected(g):
+        return g
+    for e in edges:
+        if (g.get_edge_data(*e)['manoeuvre'] == manoeuvre
+            and is_edge_removable(g, e)):
+            g.remove_edge(*e)
+    return g
+
+
 def prune_u_turns(
         g: nx.DiGraph):
     edges = list(g.edges())
@@ -339,39 +384,17 @@ def prune_u_turns(
     # For big graphs doesn't make any difference.
     edges_sorted = sort_edges_by_pairs(edges)
     # edges_sorted = edges
-    for e in edges_sorted:
-        manoeuvre = g.get_edge_data(*e)['manoeuvre']
-        if manoeuvre == 'make_u_turn':
-            test_g = g.copy()
-            test_g.remove_edge(*e)
-            if nx.is_strongly_connected(test_g):
-                g.remove_edge(*e)
-    return g
-                
+    return prune_manoeuvres(g, 'make_u_turn', edges_sorted)
+
+
 def prune_left_turns(
         g: nx.DiGraph):
-    edges = list(g.edges())
-    for e in edges:
-        manoeuvre = g.get_edge_data(*e)['manoeuvre']
-        if manoeuvre == 'turn_left':
-            test_g = g.copy()
-            test_g.remove_edge(*e)
-            if nx.is_strongly_connected(test_g):
-                g.remove_edge(*e)
-    return g
+    return prune_manoeuvres(g, 'turn_left')
 
 
 def prune_right_turns(
         g: nx.DiGraph):
-    edges = list(g.edges())
-    for e in edges:
-        manoeuvre = g.get_edge_data(*e)['manoeuvre']
-        if manoeuvre == 'right_left':
-            test_g = g.copy()
-            test_g.remove_edge(*e)
-            if nx.is_strongly_connected(test_g):
-                g.remove_edge(*e)
-    return g
+    return prune_manoeuvres(g, 'turn_right')
 
 # BALLANCE NODES ==============================================================
 def get_imbalanced_nodes(
@@ -407,31 +430,103 @@ def get_imbalanced_nodes(
         'excess_outs': excess_outs}
 
 
+def get_distances_from(
+        g: nx.DiGraph,
+        source,
+        targets: list,
+        weighted: bool = False) -> list:
+    '''
+    One row of the distance matrix, see get_distance_matrix.
+    '''
+    if weighted:
+        distances = nx.single_source_dijkstra_path_length(
+            g, source, weight=get_deadhead_weight)
+    else:
+        distances = nx.single_source_shortest_path_length(g, source)
+    return [distances.get(m, np.inf) for m in targets]
+
+
+def init_worker(
+        g: nx.DiGraph,
+        targets: list):
+    '''
+    Share the graph & the columns with a worker once,
+    rather than with every task.
+    '''
+    global WORKER_GRAPH, WORKER_TARGETS
+    WORKER_GRAPH = g
+    WORKER_TARGETS = targets
+
+
+def get_worker_distances_from(
+        source,
+        weighted: bool) -> list:
+    return get_distances_from(
+        WORKER_GRAPH, source, WORKER_TARGETS, weighted)
+
+
+def get_distance_matrix(
+        g: nx.DiGraph,
+        sources: list,
+        targets: list,
+        weighted: bool = False,
+        n_workers: int = 1) -> np.ndarray:
+    '''
+    Distances from every source to every target,
+    with one shortest-path search per source.
+    INPUT
+    g           graph (nx.DiGraph)
+    sources     rows (list)
+    targets     columns (list)
+    weighted    whether to use deadhead weights, see get_deadhead_weight,
+                instead of edge counts (bool)
+    n_workers   number of processes running the searches;
+                1 to search in this process (int)
+    ------------
+    OUTPUT
+    distances, np.inf where a target is not reachable
+    (len(sources) x len(targets) np.ndarray)
+    '''
+    if n_workers > 1 and len(sources) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=n_workers,
+                initializer=init_worker,
+                initargs=(g, targets)) as executor:
+            rows = list(executor.map(
+                get_worker_distances_from,
+                sources,
+                [weighted] * len(sources),
+                chunksize=max(1, len(sources) // (4 * n_workers))))
+    else:
+        rows = [get_distances_from(g, n, targets, weighted) for n in sources]
+    return np.array(rows, dtype=float).reshape(len(sources), len(targets))
+
+
 def get_virtual_edges(
         g: nx.DiGraph,
         ):
     imbalanced_nodes = get_imbalanced_nodes(g)
     excess_ins = imbalanced_nodes['excess_ins']
     excess_outs = imbalanced_nodes['excess_outs']
+    distance_matrix = get_distance_matrix(g, excess_ins, excess_outs)
+    is_available = np.ones(len(excess_outs), dtype=bool)
     virtual_edges = []
-    for n in excess_ins:
+    for i, n in enumerate(excess_ins):
         shortest_path = len(g.edges())
-        nearest_node = None
-        for m in excess_outs:
-            path = nx.shortest_path_length(
-                g,
-                source=n,
-                target=m)
+        nearest_j = None
+        for j, m in enumerate(excess_outs):
+            path = distance_matrix[i, j]
             if (
+                is_available[j] and
                 path < shortest_path and
                 (n, m) not in g.edges()):
                 shortest_path = path
-                nearest_node = m
-        if nearest_node is None:
+                nearest_j = j
+        if nearest_j is None:
             break
         else:
-            virtual_edges.append((n, nearest_node))
-            excess_outs.remove(nearest_node)
+            virtual_edges.append((n, excess_outs[nearest_j]))
+            is_available[nearest_j] = False
     logger.info(
         f"\tvirtual edges # {len(virtual_edges)}\n")
     return virtual_edges
@@ -452,4 +547,173 @@ def balance_graph_iteratively(
             type='virtual_edge')
     logger.info(
         f"\tadded {n_edges_added} edges over {n_cycles} cycles\n")
-    return virtual_g
\ No newline at end of file
+    return virtual_g
+
+
+def get_deadhead_weight(
+        tail,
+        head,
+        data: dict) -> float:
+    '''
+    Cost of driving an edge without inspecting it:
+    one edge plus its manoeuvre penalty (see MANOEUVRE_PENALTY).
+    '''
+    return 1 + data.get('weight', 0)
+
+
+def get_deadhead_cost(
+        g: nx.DiGraph,
+        virtual_g: nx.DiGraph) -> float:
+    '''
+    INPUT
+    g           graph (nx.DiGraph)
+    virtual_g   g balanced with virtual edges (nx.DiGraph or nx.MultiDiGraph)
+    ------------
+    OUTPUT
+    total deadhead cost of the virtual edges, when driven along g (float)
+    '''
+    deadhead_cost = 0
+    for tail, head, edge_type in virtual_g.edges(data='type'):
+        if edge_type == 'virtual_edge':
+            deadhead_cost += nx.dijkstra_path_length(
+                g, tail, head, weight=get_deadhead_weight)
+    return deadhead_cost
+
+
+def balance_graph_min_cost(
+        g: nx.DiGraph) -> nx.MultiDiGraph:
+    '''
+    Balance the graph with the minimum-cost set of virtual edges
+    (directed Chinese Postman), solved as a transportation problem:
+    excess-in nodes supply, excess-out nodes demand,
+    shipping costs are deadhead distances along g.
+    INPUT
+    g   strongly connected graph (nx.DiGraph)
+    ------------
+    OUTPUT
+    virtual_g   eulerian graph (nx.MultiDiGraph)
+        edges   g edges and virtual edges (type 'virtual_edge')
+        graph['deadhead_cost']  total deadhead cost of the virtual edges
+    '''
+    imbalanced_nodes = get_imbalanced_nodes(g)
+    if not imbalanced_nodes['excess_ins']:
+        virtual_g = nx.MultiDiGraph(g)
+        virtual_g.graph['deadhead_cost'] = 0
+        return virtual_g
+    transport_g = nx.DiGraph()
+    for n in imbalanced_nodes['excess_ins']:
+        transport_g.add_node(
+            ('in', n),
+            demand=g.out_degree(n) - g.in_degree(n))
+    for m in imbalanced_nodes['excess_outs']:
+        transport_g.add_node(
+            ('out', m),
+            demand=g.out_degree(m) - g.in_degree(m))
+    excess_outs = set(imbalanced_nodes['excess_outs'])
+    for n in imbalanced_nodes['excess_ins']:
+        distances = nx.single_source_dijkstra_path_length(
+            g, n, weight=get_deadhead_weight)
+        for m, distance in distances.items():
+            if m in excess_outs:
+                transport_g.add_edge(('in', n), ('out', m), weight=distance)
+
+    deadhead_cost, flows = nx.network_simplex(transport_g)
+
+    virtual_g = nx.MultiDiGraph(g)
+    n_edges_added = 0
+    for (_, n), n_flows in flows.items():
+        for (_, m), flow in n_flows.items():
+            for _ in range(flow):
+                virtual_g.add_edge(n, m, type='virtual_edge')
+            n_edges_added += flow
+    virtual_g.graph['deadhead_cost'] = deadhead_cost
+    logger.info(
+        f"\tadded {n_edges_added} edges\n"
+        f"\tdeadhead cost {deadhead_cost}\n")
+    return virtual_g
+
+
+def balance_graph_assignment(
+        g: nx.DiGraph,
+        n_workers: int = 1) -> nx.MultiDiGraph:
+    '''
+    Balance the graph by pairing every missing out-going edge with
+    a missing in-coming edge at minimum total deadhead cost, solved as
+    an assignment problem over a matrix of deadhead distances
+    (see get_distance_matrix), one row & column per unit of imbalance.
+    INPUT
+    g           strongly connected graph (nx.DiGraph)
+    n_workers   number of workers computing the distance matrix (int)
+    ------------
+    OUTPUT
+    virtual_g   eulerian graph (nx.MultiDiGraph)
+        edges   g edges and virtual edges (type 'virtual_edge')
+        graph['deadhead_cost']      total deadhead cost of the virtual edges
+        graph['distance_matrix']    distances between imbalanced nodes (dict)
+            excess_ins      rows (list)
+            excess_outs     columns (list)
+            distances       see get_distance_matrix (np.ndarray)
+    '''
+    import scipy.optimize
+
+    imbalanced_nodes = get_imbalanced_nodes(g)
+    excess_ins = imbalanced_nodes['excess_ins']
+    excess_outs = imbalanced_nodes['excess_outs']
+    distances = get_distance_matrix(
+        g, excess_ins, excess_outs, weighted=True, n_workers=n_workers)
+
+    rows = np.repeat(
+        np.arange(len(excess_ins), dtype=int),
+        [g.in_degree(n) - g.out_degree(n) for n in excess_ins])
+    columns = np.repeat(
+        np.arange(len(excess_outs), dtype=int),
+        [g.out_degree(m) - g.in_degree(m) for m in excess_outs])
+    assigned_rows, assigned_columns = scipy.optimize.linear_sum_assignment(
+        distances[np.ix_(rows, columns)])
+    pairs = list(zip(
+        rows[assigned_rows].tolist(), columns[assigned_columns].tolist()))
+
+    virtual_g = nx.MultiDiGraph(g)
+    virtual_g.add_edges_from(
+        [(excess_ins[i], excess_outs[j]) for i, j in pairs],
+        type='virtual_edge')
+    virtual_g.graph['deadhead_cost'] = sum(distances[i, j] for i, j in pairs)
+    virtual_g.graph['distance_matrix'] = {
+        'excess_ins': excess_ins,
+        'excess_outs': excess_outs,
+        'distances': distances,
+        }
+    logger.info(
+        f"\tadded {len(pairs)} edges\n"
+        f"\tdeadhead cost {virtual_g.graph['deadhead_cost']}\n")
+    return virtual_g
+
+
+BALANCING_STRATEGIES = {
+    'iterative': balance_graph_iteratively,
+    'min_cost': balance_graph_min_cost,
+    'assignment': balance_graph_assignment,
+    }
+
+
+def balance_graph(
+        g: nx.DiGraph,
+        strategy: str = 'iterative',
+        n_workers: int = 1):
+    '''
+    INPUT
+    g           strongly connected graph (nx.DiGraph)
+    strategy    one of BALANCING_STRATEGIES (str)
+    n_workers   number of processes computing the distance matrix
+                of the 'assignment' strategy, see get_distance_matrix (int)
+    ------------
+    OUTPUT
+    virtual_g   eulerian graph (nx.DiGraph or nx.MultiDiGraph)
+    '''
+    if strategy not in BALANCING_STRATEGIES:
+        raise ValueError(
+            f"unknown balancing strategy {strategy!r}, "
+            f"expected one of {sorted(BALANCING_STRATEGIES)}")
+    if strategy == 'assignment':
+        return balance_graph_assignment(g, n_workers)
+    return BALANCING_STRATEGIES[strategy](g)
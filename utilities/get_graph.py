@@ -1,22 +1,14 @@
-import os, sys, inspect
+import random
 
 import numpy as np
-import shapely as sh
 import networkx as nx
-import matplotlib
-import matplotlib.pyplot as plt
-plt.style.use('fivethirtyeight')
-import random
 
 import utilities.global_parameters as ug
 import utilities.common as uc
-
 import utilities.get_random_city as grc
+import utilities.spatial_index as usi
 
 import logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(levelname)s: %(asctime)s: %(filename)s: %(lineno)s:\n%(message)s")
 logger = logging.getLogger(__name__)
 
 
@@ -35,12 +27,74 @@ def get_points_dictionary(
     points ids (dict)
         point coordinates (tuple)   point id (int)
     '''
-    points_coordinates = {}
     sorted_points_coordinates = sorted(
-        list(set([n for s in segments for n in s['coordinates']])))
-    for n in sorted_points_coordinates:
-        points_coordinates[n] = sorted_points_coordinates.index(n)
-    return points_coordinates
+        set([n for s in segments for n in s['coordinates']]))
+    return {n: i for i, n in enumerate(sorted_points_coordinates)}
+
+
+def get_segments_by_tail(
+        segments: list
+        ) -> dict:
+    '''
+    INPUT
+    segments data (list of dicts)
+        ...
+        coordinates start and end point of a segment (list of tuples)
+        ...
+    ------------
+    OUTPUT
+    segments by tail (dict)
+        tail coordinates (tuple)    segments starting there (list of dicts)
+    NB! segments keep their input order within every bucket,
+    so iterating over the buckets visits adjacent pairs in the same order
+    as testing every ordered pair of segments.
+    '''
+    segments_by_tail = {}
+    for s in segments:
+        segments_by_tail.setdefault(s['coordinates'][0], []).append(s)
+    return segments_by_tail
+
+
+def get_adjacent_pairs(
+        segments: list
+        ) -> list:
+    '''
+    INPUT
+    segments data (list of dicts)
+        ...
+        coordinates start and end point of a segment (list of tuples)
+        ...
+    ------------
+    OUTPUT
+    adjacent pairs (list of tuples)
+        in-coming segment, out-going segment starting at its head
+    '''
+    segments_by_tail = get_segments_by_tail(segments)
+    return [
+        (s_in, s_out)
+        for s_in in segments
+        for s_out in segments_by_tail.get(s_in['coordinates'][1], [])]
+
+
+def get_pairs_manoeuvres(
+        pairs: list
+        ) -> list:
+    '''
+    Classify manoeuvres of all adjacent pairs in one vectorised pass.
+    INPUT
+    adjacent pairs (list of tuples)
+        in-coming segment, out-going segment (dicts)
+    ------------
+    OUTPUT
+    manoeuvres (list of str)
+    '''
+    if len(pairs) == 0:
+        return []
+    manoeuvre_codes = uc.get_manoeuvres(
+        [s_in['coordinates'] for s_in, _ in pairs],
+        [s_out['coordinates'] for _, s_out in pairs],
+        )['manoeuvre_codes']
+    return [ug.MANOEUVRES[c] for c in manoeuvre_codes]
 
 
 def get_naive_graph(
@@ -65,23 +119,23 @@ def get_naive_graph(
             coordinates start and end node of a edge (list of tuples)
     '''
     g = nx.DiGraph()
-    
+
+    nodes = []
+    graph_edges = []
     for e in edges:
         tail = e['coordinates'][0]
         head = e['coordinates'][1]
-        g.add_edge(
+        nodes.append((tail, {'coordinates': tail}))
+        nodes.append((head, {'coordinates': head}))
+        graph_edges.append((
             tail,
             head,
-            weight=0,
-            edge_id=e['segment_id'],
-            geometry=e['geometry'],
-            coordinates=e['coordinates']
-            )
-        attributes = {
-            head: {'coordinates': head}, 
-            tail: {'coordinates': tail},
-            }
-        nx.set_node_attributes(g, attributes)
+            {'weight': 0,
+             'edge_id': e['segment_id'],
+             'geometry': e['geometry'],
+             'coordinates': e['coordinates']}))
+    g.add_nodes_from(nodes)
+    g.add_edges_from(graph_edges)
 
     connected_nodes = sorted(
         nx.strongly_connected_components(g),
@@ -98,21 +152,29 @@ def get_naive_graph(
 # B. GET MANOEUVRE GRAPH ======================================================
 def get_manoeuvre_data(
         edge_in: dict,
-        edge_out: dict):
+        edge_out: dict,
+        manoeuvre: str = None):
     '''
     INPUT
+    edge_in     in-coming segment (dict)
+    edge_out    out-going segment (dict)
+    manoeuvre   precomputed manoeuvre, see get_pairs_manoeuvres (str)
     ------------
     OUTPUT
+    manoeuvre-edge data (dict) or None if the segments are not adjacent
     '''
+    import shapely.geometry
+
     if edge_in['coordinates'][1] == edge_out['coordinates'][0]:
-        manoeuvre = uc.get_manoeuvre(edge_in, edge_out)
+        if manoeuvre is None:
+            manoeuvre = uc.get_manoeuvre(edge_in, edge_out)
         coordinates = [edge_in['coordinates'][1], edge_out['coordinates'][0]]
         return {
             'head': f"{edge_out['segment_id']}_t",
             'tail': f"{edge_in['segment_id']}_h",
             'coordinates': coordinates,
             'weight': ug.MANOEUVRE_PENALTY[manoeuvre],
-            'geometry': sh.geometry.Point(coordinates),
+            'geometry': shapely.geometry.Point(coordinates[0]),
             'manoeuvre': manoeuvre,
                 }
     else:
@@ -123,38 +185,37 @@ def get_manoeuvre_graph(
         edges: list):
     g = nx.DiGraph()
 
+    nodes = []
+    graph_edges = []
     for e in edges:
         tail = str(e['segment_id']) + '_t'
         head = str(e['segment_id']) + '_h'
-        
-        g.add_edge(
+        nodes.append((tail, {'coordinates': e['coordinates'][0]}))
+        nodes.append((head, {'coordinates': e['coordinates'][1]}))
+        graph_edges.append((
             tail,
             head,
-            weight=0,
-            edge_id=e['segment_id'],
-            geometry=e['geometry'],
-            coordinates=e['coordinates'],
-            manoeuvre='go_straight',
-            type='segment'
-            )
-        attributes = {
-            head: {'coordinates': e['coordinates'][1]}, 
-            tail: {'coordinates': e['coordinates'][0]},
-            }
-        nx.set_node_attributes(g, attributes)
-    
-    for e_in in edges:
-        for e_out in edges:
-            e_data = get_manoeuvre_data(e_in, e_out)
-            if e_data is not None:
-                g.add_edge(
-                    e_data['tail'],
-                    e_data['head'],
-                    weight=e_data['weight'],
-                    geometry=e_data['geometry'],
-                    coordinates=e_data['coordinates'],
-                    manoeuvre=e_data['manoeuvre'],
-                    type='manoeuvre')
+            {'weight': 0,
+             'edge_id': e['segment_id'],
+             'geometry': e['geometry'],
+             'coordinates': e['coordinates'],
+             'manoeuvre': 'go_straight',
+             'type': 'segment'}))
+
+    pairs = get_adjacent_pairs(edges)
+    manoeuvres = get_pairs_manoeuvres(pairs)
+    for (e_in, e_out), manoeuvre in zip(pairs, manoeuvres):
+        e_data = get_manoeuvre_data(e_in, e_out, manoeuvre)
+        graph_edges.append((
+            e_data['tail'],
+            e_data['head'],
+            {'weight': e_data['weight'],
+             'geometry': e_data['geometry'],
+             'coordinates': e_data['coordinates'],
+             'manoeuvre': e_data['manoeuvre'],
+             'type': 'manoeuvre'}))
+    g.add_nodes_from(nodes)
+    g.add_edges_from(graph_edges)
 
     connected_nodes = sorted(
         nx.strongly_connected_components(g),
@@ -168,30 +229,71 @@ def get_manoeuvre_graph(
 
 
 # D. GET INVERTED GRAPH =======================================================
+def get_segments_midpoints(
+        segments: list) -> dict:
+    '''
+    Midpoints of the segments and of their offset coordinates,
+    see get_random_city.get_offset_coordinates_batch,
+    computed once per segment rather than once per adjacent pair.
+    INPUT
+    segments data (list of dicts)
+        ...
+        segment_id  (int)
+        coordinates start and end point of a segment (list of tuples)
+        ...
+    ------------
+    OUTPUT
+    midpoints (dict)
+        segment_id: (midpoint, offset midpoint) (tuple of tuples)
+    '''
+    if len(segments) == 0:
+        return {}
+    coordinates = np.array(
+        [s['coordinates'] for s in segments], dtype=float).reshape(-1, 2, 2)
+    offset_coordinates = grc.get_offset_coordinates_batch(coordinates)
+    midpoints = coordinates[:, 0] + (
+        coordinates[:, 1] - coordinates[:, 0]) / 2
+    offset_midpoints = offset_coordinates[:, 0] + (
+        offset_coordinates[:, 1] - offset_coordinates[:, 0]) / 2
+    return {
+        s['segment_id']: (tuple(midpoint), tuple(offset_midpoint))
+        for s, midpoint, offset_midpoint in zip(
+            segments, midpoints.tolist(), offset_midpoints.tolist())}
+
+
 def get_inverted_edge(
         edge_i: dict,
-        edge_j: dict):
+        edge_j: dict,
+        manoeuvre: str = None,
+        midpoints: dict = None):
+    '''
+    INPUT
+    edge_i      in-coming segment (dict)
+    edge_j      out-going segment (dict)
+    manoeuvre   precomputed manoeuvre, see get_pairs_manoeuvres (str)
+    midpoints   precomputed midpoints of both segments,
+                see get_segments_midpoints (dict)
+    ------------
+    OUTPUT
+    inverted-edge data (dict) or None if the segments are not adjacent
+    '''
+    import shapely.geometry
+
     if edge_i['coordinates'][1] == edge_j['coordinates'][0]:
-        manoeuvre = uc.get_manoeuvre(edge_i, edge_j)
-        coordinates = [
-            tuple([tail + (head - tail) / 2
-            for tail, head in zip(*edge_i['coordinates'])]),
-            tuple([tail + (head - tail) / 2
-            for tail, head in zip(*edge_j['coordinates'])])]
-        offset_i = grc.get_offset_coordinates(edge_i)
-        offset_j = grc.get_offset_coordinates(edge_j)
-        coordinates_offset = [
-            tuple([tail + (head - tail) / 2
-            for tail, head in zip(*offset_i)]),
-            tuple([tail + (head - tail) / 2
-            for tail, head in zip(*offset_j)])]
+        if manoeuvre is None:
+            manoeuvre = uc.get_manoeuvre(edge_i, edge_j)
+        if midpoints is None:
+            midpoints = get_segments_midpoints([edge_i, edge_j])
+        midpoint_i, offset_midpoint_i = midpoints[edge_i['segment_id']]
+        midpoint_j, offset_midpoint_j = midpoints[edge_j['segment_id']]
+        coordinates = [midpoint_i, midpoint_j]
 
         return {'head': edge_j['segment_id'],
                 'tail': edge_i['segment_id'],
                 'coordinates': coordinates,
-                'coordinates_offset': coordinates_offset,
+                'coordinates_offset': [offset_midpoint_i, offset_midpoint_j],
                 'weight': ug.MANOEUVRE_PENALTY[manoeuvre],
-                'geometry': sh.geometry.LineString(coordinates),
+                'geometry': shapely.geometry.LineString(coordinates),
                 'manoeuvre': manoeuvre}
     else:
         return None
@@ -200,27 +302,30 @@ def get_inverted_edge(
 def get_inverted_graph(
         edges: list):
     g = nx.DiGraph()
-    
-    for edge_i in edges:
-        for edge_j in edges:
-            e_data = get_inverted_edge(edge_i, edge_j)
-            if e_data is not None:
-                g.add_edge(
-                    e_data['tail'],
-                    e_data['head'],
-                    weight=e_data['weight'],
-                    geometry=e_data['geometry'],
-                    coordinates=e_data['coordinates'],
-                    coordinates_offset=e_data['coordinates_offset'],
-                    manoeuvre=e_data['manoeuvre'],
-                    type='segment',
-                    )
-                attributes = {
-                    e_data['head']: {'coordinates': e_data['coordinates'][1]}, 
-                    e_data['tail']: {'coordinates': e_data['coordinates'][0]},
-                    }
-                nx.set_node_attributes(g, attributes)
-    
+
+    nodes = []
+    graph_edges = []
+    pairs = get_adjacent_pairs(edges)
+    manoeuvres = get_pairs_manoeuvres(pairs)
+    midpoints = get_segments_midpoints(edges)
+    for (edge_i, edge_j), manoeuvre in zip(pairs, manoeuvres):
+        e_data = get_inverted_edge(edge_i, edge_j, manoeuvre, midpoints)
+        nodes.append((e_data['tail'], {'coordinates': e_data['coordinates'][0]}))
+        nodes.append((e_data['head'], {'coordinates': e_data['coordinates'][1]}))
+        graph_edges.append((
+            e_data['tail'],
+            e_data['head'],
+            {'weight': e_data['weight'],
+             'geometry': e_data['geometry'],
+             'coordinates': e_data['coordinates'],
+             'coordinates_offset': e_data['coordinates_offset'],
+             'manoeuvre': e_data['manoeuvre'],
+             'type': 'segment'}))
+    g.add_nodes_from(nodes)
+    g.add_edges_from(graph_edges)
+    if len(g) == 0:
+        return g
+
     connected_nodes = sorted(
         nx.strongly_connected_components(g),
         key=len,
@@ -235,9 +340,19 @@ def get_inverted_graph(
 # D. GET RANDOM-DISTRICT GRAPH ================================================
 def get_random_district_borders(
         g: nx.DiGraph,
-        district_size: list = ug.DISTRICT_SIZE):
-
-    city_size = get_city_size(g)
+        district_size: list = ug.DISTRICT_SIZE,
+        city_size: tuple = None):
+    '''
+    INPUT
+    g               graph (nx.DiGraph)
+    district_size   west-to-east & south-to-north shares of the city (tuple)
+    city_size       precomputed city size, see get_city_size (tuple)
+    ------------
+    OUTPUT
+    south-west & north-east corners of a random district (list of tuples)
+    '''
+    if city_size is None:
+        city_size = get_city_size(g)
     district_size = (
         round(city_size[0] * district_size[0]),
         round(city_size[1] * district_size[1]))
@@ -280,19 +395,36 @@ def get_city_size(
 def get_random_district_graph(
         g: nx.DiGraph,
         district_size: list = ug.DISTRICT_SIZE,
+        spatial_index: dict = None,
         ) -> list:
-    
-    district_borders = get_random_district_borders(g, district_size)
-    nodes_coordinates = nx.get_node_attributes(g, 'coordinates')
-    district_g = g.copy()
-
-    city_nodes = list(district_g.nodes())
-    for n in city_nodes:
-        node_coordinates = nodes_coordinates[n]
-        if check_node_within_district(
-            district_borders,
-            node_coordinates) is False:
-            district_g.remove_node(n)
+    '''
+    INPUT
+    g               graph (nx.DiGraph)
+    district_size   west-to-east & south-to-north shares of the city (tuple)
+    spatial_index   index over g node coordinates, reused across districts,
+                    see spatial_index.get_graph_spatial_index (dict)
+    ------------
+    OUTPUT
+    district_g  nodes of g within a random district (nx.DiGraph);
+                a read-only view of g if spatial_index is given
+    '''
+    if spatial_index is not None:
+        district_borders = get_random_district_borders(
+            g, district_size, spatial_index['city_size'])
+        district_g = usi.get_district_subgraph(
+            g, spatial_index, district_borders)
+    else:
+        district_borders = get_random_district_borders(g, district_size)
+        nodes_coordinates = nx.get_node_attributes(g, 'coordinates')
+        district_g = g.copy()
+
+        city_nodes = list(district_g.nodes())
+        for n in city_nodes:
+            node_coordinates = nodes_coordinates[n]
+            if check_node_within_district(
+                district_borders,
+                node_coordinates) is False:
+                district_g.remove_node(n)
 
     logging.info(
         f"\tdistrict borders:\n"
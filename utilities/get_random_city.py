@@ -1,22 +1,14 @@
-import os, sys, inspect
+import functools
+import gc
 import random
 import numpy as np
 
-import matplotlib
-import matplotlib.pyplot as plt
-plt.style.use('fivethirtyeight')
-
-import shapely as sh
-from shapely import geometry
-
 import utilities.global_parameters as ug
+import utilities.spatial_index as usi
 
 random.seed(0)
 
 import logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(levelname)s: %(asctime)s: %(filename)s: %(lineno)s:\n%(message)s")
 logger = logging.getLogger(__name__)
 
 
@@ -35,79 +27,199 @@ def get_offset_coordinates(
     OUTPUT
     offset coordinates (list of tuples)
     '''
-    # NB! parallel_offset does not work with segments,
-    # which are essentially a single point (e.g. [(0, 0), (0, 0)]).
-    s_linestring = sh.geometry.LineString(
-        segment['coordinates'])
-    # NB! parallel_offset reverses the coordinates.
-    s_offset = s_linestring.parallel_offset(
-        distance=offset,
-        side='right')
+    return [
+        tuple(c) for c in
+        get_offset_coordinates_batch(segment['coordinates'], offset)[0].tolist()]
+
+
+def get_offset_coordinates_batch(
+        coordinates,
+        offset: float = .1) -> np.ndarray:
+    '''
+    get_offset_coordinates for many segments at once:
+    shift every segment to its right by offset,
+    then shrink it by 2 * offset around its centre.
+    Zero-length segments are left where they are.
+    INPUT
+    coordinates start and end points of the segments
+                (N x 2 x 2 array-like)
+    offset      value by which to offset the segments (float)
+    ------------
+    OUTPUT
+    offset coordinates (N x 2 x 2 np.ndarray)
+    '''
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2, 2)
+    directions = coordinates[:, 1] - coordinates[:, 0]
+    lengths = np.hypot(directions[:, 0], directions[:, 1])[:, np.newaxis]
+    right_normals = np.divide(
+        np.stack([directions[:, 1], -directions[:, 0]], axis=1),
+        lengths,
+        out=np.zeros_like(directions),
+        where=lengths > 0)
+    centres = coordinates.mean(axis=1, keepdims=True)
     scaling_factor = 1 - 2 * offset
-    s_scaled = sh.affinity.scale(
-        s_offset,
-        xfact=scaling_factor,
-        yfact=scaling_factor,
-        origin='center')
-    # Reverse back the coordinates.
-    coordinates_offset = list(s_scaled.coords)[::-1]
-    return coordinates_offset
+    return (
+        centres
+        + scaling_factor * (coordinates - centres)
+        + offset * right_normals[:, np.newaxis, :])
+
+
+def with_plot_style(
+        plot_function):
+    '''
+    Draw under ug.PLOT_STYLE, rather than setting the style globally
+    when the module is imported.
+    '''
+    @functools.wraps(plot_function)
+    def plot_with_style(*args, **kwargs):
+        import matplotlib.style
+        with matplotlib.style.context(ug.PLOT_STYLE):
+            return plot_function(*args, **kwargs)
+    return plot_with_style
+
+
+def get_axes(
+        path: str = None):
+    '''
+    INPUT
+    path    where the figure goes; None to show it with pyplot (str)
+    ------------
+    OUTPUT
+    figure & axes, drawn on an Agg canvas without pyplot if path is given,
+    so that batch jobs render headless (tuple)
+    '''
+    if path is None:
+        import matplotlib.pyplot as plt
+        return plt.subplots(1, 1, figsize=ug.FIGURE_SIZE)
+    import matplotlib.backends.backend_agg
+    import matplotlib.figure
+    fig = matplotlib.figure.Figure(figsize=ug.FIGURE_SIZE)
+    matplotlib.backends.backend_agg.FigureCanvasAgg(fig)
+    return fig, fig.add_subplot(1, 1, 1)
+
+
+def format_axes(
+        ax,
+        bbox: list,
+        margin: float = 1):
+    '''
+    Unit ticks over the bbox, without spines.
+    INPUT
+    ax      axes
+    bbox    south-west & north-east coordinates (list of tuples)
+    margin  space around the bbox (float)
+    '''
+    [(x_min, y_min), (x_max, y_max)] = bbox
+    ax.set_xticks(np.arange(x_min, x_max + 1.0, 1))
+    ax.set_yticks(np.arange(y_min, y_max + 1.0, 1))
+    ax.tick_params(labelsize=14)
+    ax.set_xlim(x_min - margin, x_max + margin)
+    ax.set_ylim(y_min - margin, y_max + margin)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+
+
+def show_or_save(
+        fig,
+        path: str = None):
+    '''
+    Show the figure with pyplot, or write it to path (e.g. a .png file).
+    '''
+    if path is None:
+        import matplotlib.pyplot as plt
+        plt.show()
+    else:
+        fig.savefig(path)
 
 
+@with_plot_style
 def plot_area(
-        segments: list):
+        segments: list,
+        path: str = None):
     '''
     INPUT
     segments (list of tuples)
+    path    where to write the figure, e.g. a .png file;
+            None to show it (str)
     ------------
     OUTPUT
     plots the area, no output is produced
     '''
-    points = list(set([p for s in segments for p in s['coordinates']]))
-
-    x_min = min([p[0] for p in points])
-    x_max = max([p[0] for p in points])
-    y_min = min([p[1] for p in points])
-    y_max = max([p[1] for p in points])
-    
-    fig, ax = plt.subplots(1, 1, figsize=ug.FIGURE_SIZE)
-    for s in segments:
-        s_coordinates = get_offset_coordinates(s)
-        x, y = zip(*s_coordinates)
-        plt.plot(x, y, c='gray', linewidth=3)
-    plt.xticks(np.arange(x_min, x_max + 1.0, 1), fontsize=14)
-    plt.yticks(np.arange(y_min, y_max + 1.0, 1), fontsize=14)
-    ax.set_xlim(x_min - 1, x_max + 1)
-    ax.set_ylim(y_min - 1, y_max + 1)
-    ax.spines['top'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['left'].set_visible(False)
-    # plt.axis('off')
-    plt.show
+    import matplotlib.collections
+
+    coordinates = np.array(
+        [s['coordinates'] for s in segments], dtype=float).reshape(-1, 2, 2)
+    points = coordinates.reshape(-1, 2)
+
+    fig, ax = get_axes(path)
+    ax.add_collection(matplotlib.collections.LineCollection(
+        get_offset_coordinates_batch(coordinates),
+        colors='gray',
+        linewidths=3))
+    format_axes(ax, [tuple(points.min(axis=0)), tuple(points.max(axis=0))])
+    show_or_save(fig, path)
 
 def get_area_statistics(
-        city: list):
-
-    segment_ids = [s['segment_id'] for s in city]
-    n_segments = len(segment_ids)
-    n_two_way_segments = len([s['segment_id']
-        for s in city
-        if s['segment_id']<0])
-    n_one_way_segments = len([s['segment_id']
-        for s in city
-        if -s['segment_id'] not in segment_ids])
-    
-    logger.info(
-        f"\t{n_segments} segments\n"
-        f"\t{n_one_way_segments} one-way\n"
-        f"\t{n_two_way_segments} two-way")
-    
-    return {
+        city):
+    '''
+    INPUT
+    city    segments data (list or iterator of dicts)
+    ------------
+    OUTPUT
+    area statistics (dict)
+        n_segments          number of segments (int)
+        n_one_way_segments  number of one-way segments (int)
+        n_two_way_segments  number of two-way segments (int)
+    NB! the segments are consumed in a single pass;
+    the reverse of a two-way segment carries the negative segment id,
+    a segment is one-way if its reverse is missing.
+    Only segments still waiting for their reverse are kept in memory,
+    i.e. one at a time for cities, which yield the reverse right after.
+    '''
+    n_segments = 0
+    n_two_way_segments = 0
+    unpaired_ids = set()
+    for s in city:
+        segment_id = s['segment_id']
+        n_segments += 1
+        if segment_id < 0:
+            n_two_way_segments += 1
+        if -segment_id in unpaired_ids:
+            unpaired_ids.remove(-segment_id)
+        else:
+            unpaired_ids.add(segment_id)
+    n_one_way_segments = len(unpaired_ids)
+
+    area_statistics = {
         'n_segments': n_segments,
         'n_one_way_segments': n_one_way_segments,
         'n_two_way_segments': n_two_way_segments,
     }
+    log_area_statistics(area_statistics)
+    return area_statistics
+
+
+def get_table_statistics(
+        table: dict) -> dict:
+    '''
+    get_area_statistics for a segment table, see get_random_city_table.
+    '''
+    n_two_way_segments = int(np.sum(table['segment_id'] < 0))
+    area_statistics = {
+        'n_segments': len(table['segment_id']),
+        'n_one_way_segments': int(np.sum(table['direction'] != 3)),
+        'n_two_way_segments': n_two_way_segments,
+    }
+    log_area_statistics(area_statistics)
+    return area_statistics
+
+
+def log_area_statistics(
+        area_statistics: dict):
+    logger.info(
+        f"\t{area_statistics['n_segments']} segments\n"
+        f"\t{area_statistics['n_one_way_segments']} one-way\n"
+        f"\t{area_statistics['n_two_way_segments']} two-way")
 
 
 # GET RANDOM CITY =============================================================
@@ -152,6 +264,8 @@ def get_segments(
         2 — one_way_reverse
         3 — two_way
     '''
+    import shapely.geometry
+
     direction = get_random_direction(frequencies)
 
     if ((direction == 0)
@@ -162,21 +276,21 @@ def get_segments(
         return ({'segment_id': segment_id,
                  'direction': direction,
                  'coordinates': coordinates,
-                 'geometry': sh.geometry.LineString(coordinates)},)
+                 'geometry': shapely.geometry.LineString(coordinates)},)
     if direction == 2:
         return ({'segment_id': segment_id,
                  'direction': direction,
                  'coordinates': coordinates[::-1],
-                 'geometry': sh.geometry.LineString(coordinates[::-1])},)
+                 'geometry': shapely.geometry.LineString(coordinates[::-1])},)
     if direction == 3:
         return ({'segment_id': segment_id,
                  'direction': direction,
                  'coordinates': coordinates,
-                 'geometry': sh.geometry.LineString(coordinates)},
+                 'geometry': shapely.geometry.LineString(coordinates)},
                 {'segment_id': -segment_id,
                  'direction': direction,
                  'coordinates': coordinates[::-1],
-                 'geometry': sh.geometry.LineString(coordinates[::-1])})
+                 'geometry': shapely.geometry.LineString(coordinates[::-1])})
 
     # if ((direction == 0)
     #     or (coordinates[1][0] >= city_size[0])
@@ -211,14 +325,207 @@ def get_segments(
     #              'geometry': geometry_j})
 
 
+class Segment(dict):
+    '''
+    Segment data (dict), which builds its geometry on first access.
+    '''
+    def __missing__(self, key):
+        if key == 'geometry':
+            import shapely.geometry
+            self['geometry'] = shapely.geometry.LineString(self['coordinates'])
+            return self['geometry']
+        raise KeyError(key)
+
+
+def get_random_city_table(
+        city_size: tuple = ug.CITY_SIZE,
+        frequencies: tuple = ug.FREQUENCIES,
+        seed: int = None,
+        ) -> dict:
+    '''
+    Vectorised get_random_city: all directions are drawn in one call.
+    Segments come in the same order, and with the same ids, as in
+    get_random_city, but directions are drawn from a numpy generator.
+    INPUT
+    city_size   west-to-east & south-to-north sizes (tuple)
+    frequencies no_way, one_way_direct, one_way_reverse, two_way (tuple)
+    seed        seed of the numpy random generator (int)
+    ------------
+    OUTPUT
+    segment table (dict of arrays)
+        segment_id  unique id (N,)
+        direction   see get_random_direction (N,)
+        tails       start point of a segment (N, 2)
+        heads       end point of a segment (N, 2)
+    '''
+    return get_random_rows_table(
+        np.random.default_rng(seed),
+        0,
+        city_size[0],
+        city_size,
+        frequencies)
+
+
+def get_random_rows_table(
+        rng: np.random.Generator,
+        row_start: int,
+        row_stop: int,
+        city_size: tuple = ug.CITY_SIZE,
+        frequencies: tuple = ug.FREQUENCIES,
+        ) -> dict:
+    '''
+    get_random_city_table for the west-to-east rows row_start:row_stop.
+    NB! drawing consecutive rows from the same generator gives
+    the same directions as drawing the whole city at once.
+    INPUT
+    rng         numpy random generator (np.random.Generator)
+    row_start   first row (int)
+    row_stop    row after the last one (int)
+    city_size   west-to-east & south-to-north sizes (tuple)
+    frequencies no_way, one_way_direct, one_way_reverse, two_way (tuple)
+    ------------
+    OUTPUT
+    segment table, see get_random_city_table (dict of arrays)
+    '''
+    x_size, y_size = city_size
+    probabilities = np.asarray(frequencies, dtype=float)
+    directions = rng.choice(
+        4,
+        size=(row_stop - row_start, y_size, 2),
+        p=probabilities / probabilities.sum())
+
+    # Slot (i, j, 0) joins (i, j) and (i+1, j); slot (i, j, 1) joins
+    # (i, j) and (i, j+1); slots are numbered from 1 in row-major order.
+    i, j, k = np.indices(directions.shape)
+    i += row_start
+    slot_tails = np.stack([i, j], axis=-1)
+    slot_heads = slot_tails + np.stack([k == 0, k == 1], axis=-1)
+    slot_ids = 2 * (i * y_size + j) + k + 1
+    valid = ((directions != 0)
+        & (slot_heads[..., 0] < x_size)
+        & (slot_heads[..., 1] < y_size))
+
+    directions = directions[valid]
+    slot_tails = slot_tails[valid]
+    slot_heads = slot_heads[valid]
+    slot_ids = slot_ids[valid]
+
+    # Two-way slots yield a second, reversed segment with a negative id.
+    n_repeats = np.where(directions == 3, 2, 1)
+    slot_index = np.repeat(np.arange(len(directions)), n_repeats)
+    is_second = np.zeros(len(slot_index), dtype=bool)
+    is_second[1:] = slot_index[1:] == slot_index[:-1]
+    is_reversed = (directions[slot_index] == 2) | is_second
+
+    tails = np.where(
+        is_reversed[:, None],
+        slot_heads[slot_index],
+        slot_tails[slot_index])
+    heads = np.where(
+        is_reversed[:, None],
+        slot_tails[slot_index],
+        slot_heads[slot_index])
+    return {
+        'segment_id': np.where(
+            is_second, -slot_ids[slot_index], slot_ids[slot_index]),
+        'direction': directions[slot_index],
+        'tails': tails,
+        'heads': heads,
+        }
+
+
+def get_segments_from_table(
+        table: dict) -> list:
+    '''
+    INPUT
+    segment table, see get_random_city_table (dict of arrays)
+    ------------
+    OUTPUT
+    segments data (list of Segments), geometry is built on access
+    '''
+    # NB! Millions of new lists & dicts trigger the cyclic garbage
+    # collector over and over again, which then dominates the run time.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        tails = map(tuple, table['tails'].tolist())
+        heads = map(tuple, table['heads'].tolist())
+        return [
+            Segment(
+                segment_id=segment_id,
+                direction=direction,
+                coordinates=[tail, head])
+            for segment_id, direction, tail, head in zip(
+                table['segment_id'].tolist(),
+                table['direction'].tolist(),
+                tails,
+                heads)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def get_table_from_segments(
+        segments: list) -> dict:
+    '''
+    Inverse of get_segments_from_table.
+    INPUT
+    segments data (list of dicts)
+    ------------
+    OUTPUT
+    segment table, see get_random_city_table (dict of arrays)
+    '''
+    coordinates = np.array(
+        [s['coordinates'] for s in segments]).reshape(-1, 2, 2)
+    return {
+        'segment_id': np.array(
+            [s['segment_id'] for s in segments], dtype=np.int64),
+        'direction': np.array(
+            [s.get('direction', 0) for s in segments], dtype=np.int64),
+        'tails': coordinates[:, 0],
+        'heads': coordinates[:, 1],
+        }
+
+
+def iterate_random_city(
+        city_size: tuple = ug.CITY_SIZE,
+        frequencies: tuple = ug.FREQUENCIES,
+        seed: int = None,
+        rows_per_chunk: int = 16,
+        ):
+    '''
+    Streaming get_random_city(vectorised=True): segments are generated
+    in chunks of west-to-east rows, so only one chunk is held in memory.
+    INPUT
+    city_size       west-to-east & south-to-north sizes (tuple)
+    frequencies     no_way, one_way_direct, one_way_reverse, two_way (tuple)
+    seed            seed of the numpy random generator (int)
+    rows_per_chunk  number of rows generated at once (int)
+    ------------
+    OUTPUT
+    generator of segments data (Segments), in get_random_city order
+    '''
+    rng = np.random.default_rng(seed)
+    for row_start in range(0, city_size[0], rows_per_chunk):
+        row_stop = min(row_start + rows_per_chunk, city_size[0])
+        table = get_random_rows_table(
+            rng, row_start, row_stop, city_size, frequencies)
+        yield from get_segments_from_table(table)
+
+
 def get_random_city(
         city_size: tuple = ug.CITY_SIZE,
         frequencies: tuple = ug.FREQUENCIES,
+        vectorised: bool = False,
+        seed: int = None,
         ) -> list:
     '''
     INPUT
     city_size   west-to-east & south-to-north sizes (tuple)
     frequencies no_way, one_way_direct, one_way_reverse, two_way (tuple)
+    vectorised  whether to draw all directions in one numpy call
+                and build geometry lazily, see get_random_city_table (bool)
+    seed        seed of the numpy random generator, if vectorised (int)
     ------------
     OUTPUT
     city    segments data (list of dicts)
@@ -231,6 +538,11 @@ def get_random_city(
         coordinates start and end point of a segment (list of tuples)
         geometry    (shapely linestring)
     '''
+    if vectorised:
+        table = get_random_city_table(city_size, frequencies, seed)
+        get_table_statistics(table)
+        return get_segments_from_table(table)
+
     city = []
     segment_id = 1
     for i in range(city_size[0]):
@@ -353,10 +665,11 @@ def get_random_district(
         city: list,
         city_size: tuple = ug.CITY_SIZE,
         district_size: tuple = ug.DISTRICT_SIZE,
+        spatial_index: dict = None,
         ) -> list:
     '''
     INPUT
-    city    segments data (list of dicts)
+    city    segments data (list or iterator of dicts)
         segment_id  unique id (int)
         direction (int)
             0 — no_way
@@ -366,7 +679,9 @@ def get_random_district(
         coordinates start and end point of a segment (list of tuples)
         geometry    segment geometry (shapely linestring)
     city_size   west-to-east & south-to-north sizes (tuple)
-    district_size   west-to-east & south-to-north sizes (tuple)     
+    district_size   west-to-east & south-to-north sizes (tuple)
+    spatial_index   index over city segments, reused across districts,
+                    see spatial_index.get_segment_spatial_index (dict)
     ------------
     OUTPUT
     district    subset of a city, segments data (list of dicts)
@@ -381,8 +696,44 @@ def get_random_district(
     '''
     district_bbox = get_random_district_bbox(city_size, district_size)
     logger.info(f"district borders: {district_bbox}")
-    random_district = []
+    if spatial_index is not None:
+        return usi.get_district_segments(spatial_index, district_bbox)
+    return list(iterate_district(city, district_bbox))
+
+
+def iterate_district(
+        city,
+        district_bbox: list,
+        ):
+    '''
+    INPUT
+    city            segments data (list or iterator of dicts)
+    district_bbox   south-west & north-east coordinates (list of tuples)
+    ------------
+    OUTPUT
+    generator of segments data within the district (dicts)
+    '''
     for segment in city:
         if check_segment_within_district(segment, district_bbox) is True:
-            random_district.append(segment)
-    return random_district
\ No newline at end of file
+            yield segment
+
+
+def get_district_table(
+        table: dict,
+        district_bbox: list,
+        ) -> dict:
+    '''
+    Vectorised check_segment_within_district over a segment table.
+    INPUT
+    table           segment table, see get_random_city_table (dict of arrays)
+    district_bbox   south-west & north-east coordinates (list of tuples)
+    ------------
+    OUTPUT
+    segment table of the segments within the district (dict of arrays)
+    '''
+    [(x_min, y_min), (x_max, y_max)] = district_bbox
+    within = np.ones(len(table['segment_id']), dtype=bool)
+    for points in (table['tails'], table['heads']):
+        within &= ((x_min <= points[:, 0]) & (points[:, 0] <= x_max)
+            & (y_min <= points[:, 1]) & (points[:, 1] <= y_max))
+    return {k: v[within] for k, v in table.items()}
@@ -1,42 +1,170 @@
-import os, sys, inspect
-
-import numpy as np
-
-import matplotlib
-import matplotlib.pyplot as plt
-plt.style.use('fivethirtyeight')
+import concurrent.futures
+import heapq
 
 import networkx as nx
-import shapely as sh
-
-import utilities.global_parameters as ug
-import utilities.common as uc
 
-import utilities.visualise_graph as vg
+import utilities.forge_graph as fg
+import utilities.random_walk as rw
 
 import logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(levelname)s: %(asctime)s: %(filename)s: %(lineno)s:\n%(message)s")
 logger = logging.getLogger(__name__)
 
+# Graph of the worker, set once per worker by init_worker.
+WORKER_GRAPH = None
+
 
 def get_virtual_path(
         g: nx.DiGraph,):
-    virtual_circuit = list(nx.algorithms.euler.eulerian_circuit(g))
+    '''
+    NB! for multigraphs (e.g. balanced by balance_graph_min_cost)
+    edges of the circuit carry their keys, (tail, head, key).
+    '''
+    virtual_circuit = list(nx.algorithms.euler.eulerian_circuit(
+        g, keys=g.is_multigraph()))
     return virtual_circuit
 
 
+def get_shortest_path_tree(
+        g: nx.DiGraph,
+        source,
+        targets: set,
+        weighted: bool = False,
+        ) -> dict:
+    '''
+    Shortest-path tree from source, grown until every target is reached.
+    INPUT
+    g           graph (nx.DiGraph)
+    source      source node
+    targets     nodes to reach (set)
+    weighted    whether to use deadhead weights instead of edge counts (bool)
+    ------------
+    OUTPUT
+    predecessors (dict)
+        node    predecessor on a shortest path from source
+    '''
+    predecessors = {source: None}
+    targets_left = set(targets) - {source}
+    if weighted is False:
+        frontier = [source]
+        while frontier and targets_left:
+            next_frontier = []
+            for tail in frontier:
+                for head in g.successors(tail):
+                    if head not in predecessors:
+                        predecessors[head] = tail
+                        targets_left.discard(head)
+                        next_frontier.append(head)
+            frontier = next_frontier
+        return predecessors
+
+    distances = {source: 0}
+    settled = set()
+    heap = [(0, 0, source)]
+    counter = 1
+    while heap and targets_left:
+        distance, _, tail = heapq.heappop(heap)
+        if tail in settled:
+            continue
+        settled.add(tail)
+        targets_left.discard(tail)
+        for head, data in g[tail].items():
+            head_distance = distance + fg.get_deadhead_weight(
+                tail, head, data)
+            if head_distance < distances.get(head, float('inf')):
+                distances[head] = head_distance
+                predecessors[head] = tail
+                heapq.heappush(heap, (head_distance, counter, head))
+                counter += 1
+    return predecessors
+
+
+def get_path_from_tree(
+        predecessors: dict,
+        target) -> list:
+    '''
+    INPUT
+    predecessors    shortest-path tree, see get_shortest_path_tree (dict)
+    target          node in the tree
+    ------------
+    OUTPUT
+    path    nodes from the tree source to target (list)
+    '''
+    if target not in predecessors:
+        raise nx.NetworkXNoPath(f"node {target} is not reachable")
+    path = [target]
+    while predecessors[path[-1]] is not None:
+        path.append(predecessors[path[-1]])
+    return path[::-1]
+
+
+def init_worker(
+        g: nx.DiGraph):
+    '''
+    Share the graph with a worker once, rather than with every task.
+    '''
+    global WORKER_GRAPH
+    WORKER_GRAPH = g
+
+
+def get_worker_shortest_path_tree(
+        source,
+        targets: set,
+        weighted: bool) -> dict:
+    return get_shortest_path_tree(WORKER_GRAPH, source, targets, weighted)
+
+
 def get_real_path(
         virtual_circuit: list,
         g: nx.DiGraph,
-        virtual_g: nx.DiGraph):
+        virtual_g: nx.DiGraph,
+        weighted: bool = False,
+        n_workers: int = 1):
+    '''
+    Expand virtual edges of the circuit into shortest paths along g.
+    A shortest-path tree is grown once per distinct virtual-edge tail
+    and reused for every virtual edge leaving that node.
+    INPUT
+    virtual_circuit eulerian circuit of virtual_g (list of tuples)
+    g               graph (nx.DiGraph)
+    virtual_g       g balanced with virtual edges
+    weighted        whether deadhead legs follow MANOEUVRE_PENALTY
+                    weights (avoiding left and u-turns) or edge counts (bool)
+    n_workers       number of processes growing the trees;
+                    1 to grow them in this process (int)
+    ------------
+    OUTPUT
+    circuit_by_edge real circuit (list of tuples)
+    circuit_by_node real circuit (list of nodes)
+    '''
+    virtual_targets = {}
+    for e in virtual_circuit:
+        if virtual_g.edges[e]['type'] != 'segment':
+            virtual_targets.setdefault(e[0], set()).add(e[1])
+
+    tails = list(virtual_targets)
+    if n_workers > 1 and len(tails) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=n_workers,
+                initializer=init_worker,
+                initargs=(g,)) as executor:
+            trees = list(executor.map(
+                get_worker_shortest_path_tree,
+                tails,
+                [virtual_targets[t] for t in tails],
+                [weighted] * len(tails),
+                chunksize=max(1, len(tails) // (4 * n_workers))))
+    else:
+        trees = [
+            get_shortest_path_tree(g, t, virtual_targets[t], weighted)
+            for t in tails]
+    trees = dict(zip(tails, trees))
+
     real_circuit = []
     for e in virtual_circuit:
-        if virtual_g.get_edge_data(*e)['type'] == 'segment':
-            real_circuit.append(e)
+        if virtual_g.edges[e]['type'] == 'segment':
+            real_circuit.append(e[:2])
         else:
-            shortest_path = nx.shortest_path(g, *e)
+            shortest_path = get_path_from_tree(trees[e[0]], e[1])
             shortest_path_edges = [
                 (shortest_path[i], shortest_path[i+1])
                 for i in range(len(shortest_path) - 1)]
@@ -52,14 +180,15 @@ def get_real_path(
 
 def get_random_path(
         g: nx.DiGraph,
-):
-    np.random.seed(0)
-    visited_nodes = []
-    next_node = np.random.choice(g.nodes())
-    while len(set(visited_nodes)) < len(g.nodes):
-        visited_nodes.append(next_node)
-        possible_steps = [e[1] for e in g.out_edges(next_node)]
-        next_node = np.random.choice(possible_steps)
+        seed: int = 0,
+        ):
+    '''
+    Random walk until every node is visited, see
+    random_walk.walk_until_covered; a baseline for the eulerian route.
+    '''
+    walk_g = rw.get_walk_graph(g)
+    walk = rw.walk_until_covered(walk_g, seed)
+    visited_nodes = [walk_g['nodes'][i] for i in walk['path']]
     logger.info(
         f"\tUSING RANDOM WALK\n"
         f"\tvisited all nodes in {len(visited_nodes)}"
@@ -68,22 +197,17 @@ def get_random_path(
 
 def get_random_path_with_min_repetitions(
         g: nx.DiGraph,
+        seed: int = 0,
         ):
-    np.random.seed(0)
-    visited_nodes = []
-    next_node = np.random.choice(g.nodes())
-    while len(set(visited_nodes)) < len(g.nodes):
-        visited_nodes.append(next_node)
-        possible_steps = [e[1] for e in g.out_edges(next_node)]
-        n_unseen_nodes = sum([1 for s in possible_steps if s not in visited_nodes])
-        if n_unseen_nodes == 0 or n_unseen_nodes == len(possible_steps):
-            step_probabilities = [1 / len(possible_steps) for s in possible_steps]
-        else:
-            step_probabilities = [(1 / n_unseen_nodes) if s not in visited_nodes else 0 for s in possible_steps]
-        next_node = np.random.choice(possible_steps, p=step_probabilities)
-
+    '''
+    Random walk until every node is visited, stepping to unvisited
+    successors whenever there are some.
+    '''
+    walk_g = rw.get_walk_graph(g)
+    walk = rw.walk_until_covered(walk_g, seed, min_repetitions=True)
+    visited_nodes = [walk_g['nodes'][i] for i in walk['path']]
     logger.info(
         f"\tUSING RANDOM WALK\n"
         f"\tvisited all nodes in {len(visited_nodes)}"
     )
-    return visited_nodes
\ No newline at end of file
+    return visited_nodes
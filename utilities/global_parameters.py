@@ -9,10 +9,14 @@ FREQUENCIES = (.2, .15, .15, .5)
 
 # ROUTE PARAMETERS =============================================================
 
+# Manoeuvre codes are indices into MANOEUVRES.
+MANOEUVRES = ('go_straight', 'turn_right', 'make_u_turn', 'turn_left')
+
 MANOEUVRE_PENALTY = {
     'make_u_turn': 10,
     'turn_left': 3,
     'turn_right': 0,
     'go_straight': 0}
 
-FIGURE_SIZE = (12, 8)
\ No newline at end of file
+FIGURE_SIZE = (12, 8)
+PLOT_STYLE = 'fivethirtyeight'
\ No newline at end of file
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import networkx as nx
+
+import utilities.global_parameters as ug
+import utilities.get_graph as gg
+import utilities.forge_graph as fg
+import utilities.csr_graph as cg
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Bump whenever the stored arrays change meaning.
+CACHE_FORMAT_VERSION = 1
+MAX_CACHE_BYTES = 2 ** 30
+
+PRUNING_FUNCTIONS = {
+    'u_turns': fg.prune_u_turns,
+    'left_turns': fg.prune_left_turns,
+    'right_turns': fg.prune_right_turns,
+    }
+PRUNING = ('u_turns', 'left_turns')
+
+CACHED_ARRAYS = (
+    'nodes',
+    'node_coordinates',
+    'indptr',
+    'tails',
+    'heads',
+    'weights',
+    'manoeuvre_codes',
+    'type_codes',
+    'edge_coordinates',
+    'edge_coordinates_offset',
+    )
+
+
+# A. CACHE KEYS ===============================================================
+def get_cache_key(
+        segments: list,
+        pruning: tuple = PRUNING) -> str:
+    '''
+    INPUT
+    segments    segments data (list of dicts)
+    pruning     prunings applied in order, see PRUNING_FUNCTIONS (tuple)
+    ------------
+    OUTPUT
+    content hash of the segments, MANOEUVRE_PENALTY & pruning (str)
+    '''
+    segment_ids = np.array(
+        [s['segment_id'] for s in segments], dtype=np.int64)
+    coordinates = np.array(
+        [s['coordinates'] for s in segments], dtype=float)
+    settings = json.dumps({
+        'version': CACHE_FORMAT_VERSION,
+        'manoeuvre_penalty': ug.MANOEUVRE_PENALTY,
+        'pruning': list(pruning),
+        }, sort_keys=True)
+    key = hashlib.sha256()
+    key.update(settings.encode())
+    key.update(segment_ids.tobytes())
+    key.update(coordinates.tobytes())
+    return key.hexdigest()
+
+
+# B. STORE & LOAD =============================================================
+def get_cache_arrays(
+        g: nx.DiGraph) -> dict:
+    '''
+    INPUT
+    g   inverted graph, with integer node names (nx.DiGraph)
+    ------------
+    OUTPUT
+    arrays to store, see CACHED_ARRAYS (dict of np.ndarray)
+    '''
+    csr = cg.get_csr_graph(g)
+    # An empty node list would default to float.
+    nodes = np.asarray(
+        csr['nodes'], dtype=np.int64 if len(g) == 0 else None)
+    if nodes.dtype.kind not in 'iu':
+        raise ValueError("only graphs with integer node names can be cached")
+    arrays = {k: csr[k] for k in CACHED_ARRAYS if k in csr}
+    arrays['nodes'] = nodes
+    arrays['edge_coordinates'] = np.array(
+        [a['coordinates'] for a in csr['edge_attributes']],
+        dtype=float).reshape(-1, 2, 2)
+    arrays['edge_coordinates_offset'] = np.array(
+        [a['coordinates_offset'] for a in csr['edge_attributes']],
+        dtype=float).reshape(-1, 2, 2)
+    return arrays
+
+
+def store_graph(
+        g: nx.DiGraph,
+        cache_dir: str,
+        key: str):
+    '''
+    Store the graph as .npy files in cache_dir/key;
+    the entry is written aside and renamed into place,
+    so readers never see a partial entry.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_dir = os.path.join(cache_dir, key)
+    working_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp_')
+    try:
+        for name, array in get_cache_arrays(g).items():
+            np.save(os.path.join(working_dir, f"{name}.npy"), array)
+        os.rename(working_dir, entry_dir)
+    except OSError:
+        # Another process stored the same entry first.
+        shutil.rmtree(working_dir, ignore_errors=True)
+        if not os.path.isdir(entry_dir):
+            raise
+
+
+def load_csr_graph(
+        cache_dir: str,
+        key: str) -> dict:
+    '''
+    INPUT
+    cache_dir   cache directory (str)
+    key         cache key, see get_cache_key (str)
+    ------------
+    OUTPUT
+    csr graph with memory-mapped arrays, see csr_graph.get_csr_graph (dict)
+        edge_coordinates        (E, 2, 2) array
+        edge_coordinates_offset (E, 2, 2) array
+    '''
+    entry_dir = os.path.join(cache_dir, key)
+    csr = {
+        name: np.load(
+            os.path.join(entry_dir, f"{name}.npy"), mmap_mode='r')
+        for name in CACHED_ARRAYS}
+    os.utime(entry_dir)  # mark as recently used
+    csr['nodes'] = csr['nodes'].tolist()
+    csr['node_index'] = {n: i for i, n in enumerate(csr['nodes'])}
+    csr['active'] = np.ones(len(csr['tails']), dtype=bool)
+    csr['edge_attributes'] = None
+    return csr
+
+
+def get_nx_graph(
+        csr: dict) -> nx.DiGraph:
+    '''
+    INPUT
+    csr graph, see load_csr_graph (dict)
+    ------------
+    OUTPUT
+    g   inverted graph, as built by get_graph.get_inverted_graph (nx.DiGraph)
+    '''
+    import shapely.geometry
+
+    csr = dict(csr)
+    csr['edge_attributes'] = [
+        {'geometry': shapely.geometry.LineString(coordinates),
+         'coordinates': [tuple(c) for c in coordinates],
+         'coordinates_offset': [tuple(c) for c in coordinates_offset]}
+        for coordinates, coordinates_offset in zip(
+            csr['edge_coordinates'].tolist(),
+            csr['edge_coordinates_offset'].tolist())]
+    return cg.get_nx_graph(csr)
+
+
+# C. EVICT ====================================================================
+def get_entry_size(
+        entry_dir: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(entry_dir, f))
+        for f in os.listdir(entry_dir))
+
+
+def evict_entries(
+        cache_dir: str,
+        max_cache_bytes: int = MAX_CACHE_BYTES,
+        keep: str = None):
+    '''
+    Remove least recently used entries until the cache fits max_cache_bytes.
+    INPUT
+    cache_dir       cache directory (str)
+    max_cache_bytes size bound of the cache on disk (int)
+    keep            key never to evict (str)
+    '''
+    entries = []
+    for key in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, key)
+        if key.startswith('.') or not os.path.isdir(entry_dir):
+            continue
+        entries.append((
+            os.path.getmtime(entry_dir), key, get_entry_size(entry_dir)))
+    cache_bytes = sum(e[2] for e in entries)
+    for _, key, entry_size in sorted(entries):
+        if cache_bytes <= max_cache_bytes:
+            break
+        if key == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        cache_bytes -= entry_size
+        logger.info(f"\tevicted cached graph {key}")
+
+
+# D. GET CACHED GRAPH =========================================================
+def get_cached_inverted_graph(
+        segments: list,
+        cache_dir: str,
+        pruning: tuple = PRUNING,
+        max_cache_bytes: int = MAX_CACHE_BYTES,
+        as_nx: bool = True):
+    '''
+    get_graph.get_inverted_graph followed by pruning,
+    served from the cache whenever the same input was seen before.
+    INPUT
+    segments        segments data (list of dicts)
+    cache_dir       cache directory (str)
+    pruning         prunings applied in order, see PRUNING_FUNCTIONS (tuple)
+    max_cache_bytes size bound of the cache on disk (int)
+    as_nx           whether to return nx.DiGraph or the memory-mapped
+                    csr graph, see load_csr_graph (bool)
+    ------------
+    OUTPUT
+    pruned inverted graph (nx.DiGraph or dict)
+    '''
+    key = get_cache_key(segments, pruning)
+    if os.path.isdir(os.path.join(cache_dir, key)):
+        logger.info(f"\tloading cached graph {key}")
+    else:
+        g = gg.get_inverted_graph(segments)
+        for p in pruning:
+            g = PRUNING_FUNCTIONS[p](g)
+        store_graph(g, cache_dir, key)
+        evict_entries(cache_dir, max_cache_bytes, keep=key)
+        if as_nx:
+            return g
+    csr = load_csr_graph(cache_dir, key)
+    if as_nx:
+        return get_nx_graph(csr)
+    return csr
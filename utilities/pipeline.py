@@ -0,0 +1,185 @@
+import json
+
+import utilities.global_parameters as ug
+import utilities.common as uc
+import utilities.get_random_city as grc
+import utilities.get_graph as gg
+import utilities.forge_graph as fg
+import utilities.get_route as gr
+import utilities.graph_cache as gca
+import utilities.profiler as up
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# ROUTE SEGMENTS ==============================================================
+def run_pipeline(
+        segments: list,
+        balancing_strategy: str = 'iterative',
+        weighted: bool = False,
+        n_workers: int = 1,
+        stages: list = None,
+        trace_memory: bool = True,
+        cache_dir: str = None,
+        ) -> dict:
+    '''
+    Route inspection of the segments:
+    get_inverted_graph -> prune -> balance -> circuit -> real path.
+    INPUT
+    segments            segments data (list of dicts)
+    balancing_strategy  one of forge_graph.BALANCING_STRATEGIES (str)
+    weighted            whether deadhead legs follow MANOEUVRE_PENALTY
+                        weights, see get_route.get_real_path (bool)
+    n_workers           processes computing the distance matrix of the
+                        'assignment' balancing and expanding the real path
+                        (int)
+    stages              stage profiles, see profiler.profile_stage (list)
+    trace_memory        whether to trace peak memory of every stage (bool)
+    cache_dir           where pruned inverted graphs are cached, see
+                        graph_cache.get_cached_inverted_graph;
+                        None to always build them (str)
+    ------------
+    OUTPUT
+    route (dict)
+        inverted_g      pruned inverted graph (nx.DiGraph)
+        virtual_g       balanced inverted graph
+        virtual_circuit eulerian circuit of virtual_g (list of tuples)
+        real_circuit    see get_route.get_real_path (dict)
+    '''
+    def run_stage(stage, function, *args, **kwargs):
+        return up.profile_stage(
+            stages, stage, function, *args,
+            trace_memory=trace_memory, **kwargs)
+
+    if cache_dir is None:
+        inverted_g = run_stage(
+            'get_inverted_graph', gg.get_inverted_graph, segments)
+        inverted_g = run_stage(
+            'prune_u_turns', fg.prune_u_turns, inverted_g)
+        inverted_g = run_stage(
+            'prune_left_turns', fg.prune_left_turns, inverted_g)
+    else:
+        inverted_g = run_stage(
+            'get_cached_inverted_graph', gca.get_cached_inverted_graph,
+            segments, cache_dir, pruning=('u_turns', 'left_turns'))
+    virtual_g = run_stage(
+        fg.BALANCING_STRATEGIES[balancing_strategy].__name__,
+        fg.balance_graph, inverted_g, balancing_strategy,
+        n_workers=n_workers)
+    virtual_circuit = run_stage(
+        'get_virtual_path', gr.get_virtual_path, virtual_g)
+    real_circuit = run_stage(
+        'get_real_path', gr.get_real_path,
+        virtual_circuit, inverted_g, virtual_g,
+        weighted=weighted, n_workers=n_workers)
+    return {
+        'inverted_g': inverted_g,
+        'virtual_g': virtual_g,
+        'virtual_circuit': virtual_circuit,
+        'real_circuit': real_circuit,
+        }
+
+
+def run_random_city_pipeline(
+        city_size: tuple = ug.CITY_SIZE,
+        frequencies: tuple = ug.FREQUENCIES,
+        seed: int = None,
+        report_path: str = None,
+        trace_memory: bool = True,
+        **pipeline_parameters,
+        ) -> dict:
+    '''
+    Profile run_pipeline on a random city.
+    INPUT
+    city_size   west-to-east & south-to-north sizes (tuple)
+    frequencies no_way, one_way_direct, one_way_reverse, two_way (tuple)
+    seed        seed of the vectorised city generator; None to use
+                get_random_city's default generator (int)
+    report_path where to write the JSON profile report (str)
+    trace_memory        whether to trace peak memory of every stage (bool)
+    pipeline_parameters see run_pipeline
+    ------------
+    OUTPUT
+    route, see run_pipeline, with
+        report  profile report, see profiler.get_profile_report (dict)
+    '''
+    stages = []
+    city = up.profile_stage(
+        stages, 'get_random_city', grc.get_random_city,
+        city_size, frequencies,
+        vectorised=seed is not None, seed=seed,
+        trace_memory=trace_memory)
+    route = run_pipeline(
+        city, stages=stages, trace_memory=trace_memory,
+        **pipeline_parameters)
+
+    parameters = {
+        'city_size': list(city_size),
+        'frequencies': list(frequencies),
+        'seed': seed,
+        }
+    parameters.update(pipeline_parameters)
+    route['report'] = up.get_profile_report(stages, parameters)
+    if report_path is not None:
+        up.write_profile_report(route['report'], report_path)
+    return route
+
+
+# READ & WRITE ================================================================
+def read_segments(
+        segments_path: str) -> list:
+    '''
+    INPUT
+    segments_path   JSON file, a list of segments (str)
+        segment_id  unique id (int)
+        coordinates start and end point of a segment (list of lists)
+    ------------
+    OUTPUT
+    segments data, geometry built on access (list of get_random_city.Segment)
+    '''
+    with open(segments_path) as f:
+        segments = json.load(f)
+    return [
+        grc.Segment(
+            s,
+            segment_id=s['segment_id'],
+            coordinates=[tuple(point) for point in s['coordinates']])
+        for s in segments]
+
+
+def write_segments(
+        segments: list,
+        segments_path: str):
+    '''
+    Write segments in the format of read_segments, without geometry.
+    '''
+    uc.write_json(
+        [{k: v for k, v in s.items() if k != 'geometry'} for s in segments],
+        segments_path)
+
+
+def get_route_data(
+        route: dict) -> dict:
+    '''
+    INPUT
+    route   see run_pipeline (dict)
+    ------------
+    OUTPUT
+    route data (dict)
+        n_segments      segments of the pruned inverted graph (int)
+        n_virtual_edges virtual edges added by balancing (int)
+        circuit_len     edges of the real circuit (int)
+        circuit_by_node real circuit (list of segment ids)
+        circuit_by_edge real circuit (list of [tail, head])
+    '''
+    real_circuit = route['real_circuit']
+    return {
+        'n_segments': route['inverted_g'].number_of_nodes(),
+        'n_virtual_edges': (
+            route['virtual_g'].number_of_edges()
+            - route['inverted_g'].number_of_edges()),
+        'circuit_len': len(real_circuit['circuit_by_edge']),
+        'circuit_by_node': list(real_circuit['circuit_by_node']),
+        'circuit_by_edge': [list(e) for e in real_circuit['circuit_by_edge']],
+        }
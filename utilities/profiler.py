@@ -0,0 +1,133 @@
+import datetime
+import time
+import tracemalloc
+
+import networkx as nx
+
+import utilities.common as uc
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# PROFILE STAGES ==============================================================
+def get_output_size(
+        output) -> dict:
+    '''
+    INPUT
+    output  output of a pipeline stage
+    ------------
+    OUTPUT
+    output size (dict)
+        n_nodes & n_edges   for graphs
+        n_edges             for circuits
+        n_items             for other sized outputs
+    '''
+    if isinstance(output, nx.Graph):
+        return {
+            'n_nodes': output.number_of_nodes(),
+            'n_edges': output.number_of_edges()}
+    if isinstance(output, dict) and 'circuit_by_edge' in output:
+        return {'n_edges': len(output['circuit_by_edge'])}
+    if hasattr(output, '__len__'):
+        return {'n_items': len(output)}
+    return {}
+
+
+def profile_stage(
+        stages: list,
+        stage: str,
+        function,
+        *args,
+        trace_memory: bool = True,
+        **kwargs):
+    '''
+    Run function(*args, **kwargs) and append its profile to stages.
+    INPUT
+    stages          stage profiles collected so far (list of dicts),
+                    None to run the function without profiling
+    stage           stage name (str)
+    function        stage function
+    trace_memory    whether to trace peak memory with tracemalloc (bool)
+    ------------
+    OUTPUT
+    output of the function
+    stages gets a new entry (dict)
+        stage       stage name (str)
+        wall_time   seconds (float)
+        peak_memory bytes allocated on top of the memory in use
+                    at the start of the stage (int) or None
+        output size, see get_output_size
+    '''
+    if stages is None:
+        return function(*args, **kwargs)
+
+    if trace_memory:
+        stop_tracing = not tracemalloc.is_tracing()
+        if stop_tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            # Python < 3.9: restarting tracing is the only way
+            # to reset the peak.
+            tracemalloc.stop()
+            tracemalloc.start()
+        memory_start = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    output = function(*args, **kwargs)
+    wall_time = time.perf_counter() - start
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1] - memory_start
+        if stop_tracing:
+            tracemalloc.stop()
+
+    stage_profile = {
+        'stage': stage,
+        'wall_time': wall_time,
+        'peak_memory': peak_memory,
+        }
+    stage_profile.update(get_output_size(output))
+    stages.append(stage_profile)
+    logger.info(
+        f"\t{stage}: {wall_time:.3f}s"
+        + (f", peak {peak_memory / 2**20:.1f} MiB"
+           if peak_memory is not None else ""))
+    return output
+
+
+# REPORT ======================================================================
+def get_profile_report(
+        stages: list,
+        parameters: dict = None) -> dict:
+    '''
+    INPUT
+    stages      stage profiles, see profile_stage (list of dicts)
+    parameters  run parameters to record alongside (dict)
+    ------------
+    OUTPUT
+    report (dict)
+        created         ISO timestamp (str)
+        parameters      run parameters (dict)
+        stages          stage profiles (list of dicts)
+        total_wall_time seconds (float)
+        dominant_stage  stage with the longest wall time (str)
+    '''
+    dominant_stage = None
+    if stages:
+        dominant_stage = max(stages, key=lambda s: s['wall_time'])['stage']
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'parameters': parameters or {},
+        'stages': stages,
+        'total_wall_time': sum(s['wall_time'] for s in stages),
+        'dominant_stage': dominant_stage,
+        }
+
+
+def write_profile_report(
+        report: dict,
+        report_path: str):
+    uc.write_json(report, report_path, indent=2)
+    logger.info(f"\tprofile report written to {report_path}")
@@ -0,0 +1,190 @@
+import concurrent.futures
+
+import numpy as np
+import networkx as nx
+
+import utilities.csr_graph as cg
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Random numbers drawn at once, rather than one per step.
+RANDOM_BLOCK_SIZE = 2 ** 16
+
+# Walk graph of the worker, set once per worker by init_worker.
+WORKER_WALK_GRAPH = None
+
+
+# A. WALK GRAPH ===============================================================
+def get_walk_graph(
+        g: nx.DiGraph) -> dict:
+    '''
+    Plain-list csr adjacency of the graph, see csr_graph.get_csr_graph;
+    a walk step is much faster on Python lists than on numpy scalars.
+    INPUT
+    g   graph (nx.DiGraph)
+    ------------
+    OUTPUT
+    walk graph (dict)
+        nodes   node names (list)
+        indptr  successors of node i are heads[indptr[i]:indptr[i+1]] (list)
+        heads   node index of every edge head (list)
+    '''
+    csr = cg.get_csr_graph(g, keep_attributes=False)
+    return {
+        'nodes': csr['nodes'],
+        'indptr': csr['indptr'].tolist(),
+        'heads': csr['heads'].tolist(),
+        }
+
+
+# B. WALK =====================================================================
+def walk_until_covered(
+        walk_g: dict,
+        seed=None,
+        min_repetitions: bool = False,
+        max_steps: int = None) -> dict:
+    '''
+    Random walk until every node is visited.
+    Visits are kept in a bitmap and random numbers are drawn in blocks
+    of RANDOM_BLOCK_SIZE.
+    INPUT
+    walk_g          see get_walk_graph (dict)
+    seed            seed of the random stream (int or np.random.SeedSequence)
+    min_repetitions whether to step to unvisited successors whenever
+                    there are some (bool)
+    max_steps       stop after that many steps; None to walk until covered,
+                    or stuck in a node without successors (int)
+    ------------
+    OUTPUT
+    walk (dict)
+        path        visited node indices, in order (list)
+        coverage    distinct nodes visited after every step (np.ndarray)
+        is_covered  whether every node was visited (bool)
+    '''
+    indptr = walk_g['indptr']
+    heads = walk_g['heads']
+    n_nodes = len(walk_g['nodes'])
+    rng = np.random.default_rng(seed)
+    if max_steps is None:
+        max_steps = float('inf')
+
+    visited = bytearray(n_nodes)
+    path = []
+    coverage = []
+    n_visited = 0
+    draws = []
+    draw_index = 0
+    node = int(rng.integers(n_nodes))
+    while True:
+        path.append(node)
+        if not visited[node]:
+            visited[node] = 1
+            n_visited += 1
+        coverage.append(n_visited)
+        if n_visited == n_nodes or len(path) >= max_steps:
+            break
+        start, stop = indptr[node], indptr[node + 1]
+        if start == stop:
+            break
+        if draw_index == len(draws):
+            draws = rng.random(RANDOM_BLOCK_SIZE).tolist()
+            draw_index = 0
+        draw = draws[draw_index]
+        draw_index += 1
+        successors = heads[start:stop]
+        if min_repetitions:
+            unvisited = [s for s in successors if not visited[s]]
+            if unvisited:
+                successors = unvisited
+        node = successors[int(draw * len(successors))]
+    return {
+        'path': path,
+        'coverage': np.array(coverage, dtype=np.int64),
+        'is_covered': n_visited == n_nodes,
+        }
+
+
+def init_worker(
+        walk_g: dict):
+    '''
+    Share the walk graph with a worker once, rather than with every task.
+    '''
+    global WORKER_WALK_GRAPH
+    WORKER_WALK_GRAPH = walk_g
+
+
+def run_worker_walk(
+        seed,
+        min_repetitions: bool,
+        max_steps: int) -> dict:
+    return walk_until_covered(
+        WORKER_WALK_GRAPH, seed, min_repetitions, max_steps)
+
+
+def run_random_walks(
+        g: nx.DiGraph,
+        n_walks: int,
+        seed: int = 0,
+        min_repetitions: bool = False,
+        max_steps: int = None,
+        n_workers: int = 1) -> list:
+    '''
+    Independent random walks, see walk_until_covered; walk i always
+    draws from the i-th stream spawned from seed, whatever the workers.
+    INPUT
+    g               graph (nx.DiGraph)
+    n_walks         number of walks (int)
+    seed            seed of all walks (int)
+    min_repetitions see walk_until_covered (bool)
+    max_steps       see walk_until_covered (int)
+    n_workers       number of processes; 1 to walk in this process (int)
+    ------------
+    OUTPUT
+    walks, see walk_until_covered (list of dicts)
+    '''
+    walk_g = get_walk_graph(g)
+    seeds = np.random.SeedSequence(seed).spawn(n_walks)
+    if n_workers > 1 and n_walks > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=n_workers,
+                initializer=init_worker,
+                initargs=(walk_g,)) as executor:
+            walks = list(executor.map(
+                run_worker_walk,
+                seeds,
+                [min_repetitions] * n_walks,
+                [max_steps] * n_walks))
+    else:
+        walks = [
+            walk_until_covered(walk_g, s, min_repetitions, max_steps)
+            for s in seeds]
+    logger.info(
+        f"\t{n_walks} random walks\n"
+        f"\tmean length {np.mean([len(w['path']) for w in walks]):.0f}\n")
+    return walks
+
+
+# C. COVERAGE =================================================================
+def get_coverage_curves(
+        walks: list,
+        n_nodes: int,
+        n_steps: int = None) -> np.ndarray:
+    '''
+    INPUT
+    walks   see run_random_walks (list of dicts)
+    n_nodes number of nodes of the walked graph (int)
+    n_steps length of the curves; defaults to the longest walk (int)
+    ------------
+    OUTPUT
+    share of nodes visited after every step, one row per walk,
+    walks that stopped earlier keep their last value (np.ndarray)
+    '''
+    if n_steps is None:
+        n_steps = max(len(w['coverage']) for w in walks)
+    curves = np.empty((len(walks), n_steps))
+    for curve, w in zip(curves, walks):
+        coverage = w['coverage'][:n_steps]
+        curve[:len(coverage)] = coverage
+        curve[len(coverage):] = coverage[-1]
+    return curves / n_nodes
@@ -0,0 +1,265 @@
+import networkx as nx
+
+import utilities.get_graph as gg
+import utilities.forge_graph as fg
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# A. REMOVE SEGMENTS ==========================================================
+def remove_segments_from_circuit(
+        virtual_g: nx.MultiDiGraph,
+        virtual_circuit: list,
+        removed: set) -> list:
+    '''
+    Splice removed nodes out of the circuit: every pass a -> (removed) -> b
+    becomes a virtual edge (a, b), which re-balances a & b only.
+    INPUT
+    virtual_g       balanced graph, removed nodes already gone
+                    (nx.MultiDiGraph), gets the new virtual edges
+    virtual_circuit eulerian circuit (list of (tail, head, key))
+    removed         removed nodes (set)
+    ------------
+    OUTPUT
+    virtual circuit without the removed nodes (list of (tail, head, key))
+    '''
+    start = next(
+        (i for i, e in enumerate(virtual_circuit) if e[0] not in removed),
+        None)
+    if start is None:
+        return []
+    rotated_circuit = virtual_circuit[start:] + virtual_circuit[:start]
+
+    repaired_circuit = []
+    detour_tail = None
+    for e in rotated_circuit:
+        if detour_tail is None:
+            if e[1] in removed:
+                detour_tail = e[0]
+            else:
+                repaired_circuit.append(e)
+        elif e[1] not in removed:
+            if detour_tail != e[1]:
+                key = virtual_g.add_edge(
+                    detour_tail, e[1], type='virtual_edge')
+                repaired_circuit.append((detour_tail, e[1], key))
+            detour_tail = None
+    return repaired_circuit
+
+
+# B. ADD SEGMENTS =============================================================
+def get_added_edges(
+        segments: list,
+        g: nx.DiGraph,
+        added_segments: list) -> list:
+    '''
+    INPUT
+    segments        segments data of g (list of dicts)
+    g               graph, added segments not yet in it (nx.DiGraph)
+    added_segments  segments data to add (list of dicts)
+    ------------
+    OUTPUT
+    inverted edges of the added segments, see get_graph.get_inverted_edge
+    (list of dicts)
+    '''
+    added_ids = set(s['segment_id'] for s in added_segments)
+    known_segments = [
+        s for s in segments
+        if s['segment_id'] in g and s['segment_id'] not in added_ids]
+    known_by_head = {}
+    for s in known_segments:
+        known_by_head.setdefault(s['coordinates'][1], []).append(s)
+    known_by_tail = gg.get_segments_by_tail(known_segments)
+
+    pairs = gg.get_adjacent_pairs(added_segments)
+    for s in added_segments:
+        pairs += [(s_in, s) for s_in in known_by_head.get(
+            s['coordinates'][0], [])]
+        pairs += [(s, s_out) for s_out in known_by_tail.get(
+            s['coordinates'][1], [])]
+    midpoints = gg.get_segments_midpoints(list(
+        {s['segment_id']: s for pair in pairs for s in pair}.values()))
+    return [
+        gg.get_inverted_edge(s_in, s_out, manoeuvre, midpoints)
+        for (s_in, s_out), manoeuvre in zip(
+            pairs, gg.get_pairs_manoeuvres(pairs))]
+
+
+def get_local_virtual_edges(
+        g: nx.DiGraph,
+        added_edges: list) -> list:
+    '''
+    Minimum-cost virtual edges balancing the nodes of the added edges,
+    see forge_graph.balance_graph_min_cost.
+    INPUT
+    g           graph, with the added edges (nx.DiGraph)
+    added_edges tail & head (list of tuples)
+    ------------
+    OUTPUT
+    virtual edges (list of tuples)
+    '''
+    imbalance = {}
+    for tail, head in added_edges:
+        imbalance[head] = imbalance.get(head, 0) + 1
+        imbalance[tail] = imbalance.get(tail, 0) - 1
+    transport_g = nx.DiGraph()
+    for n, n_imbalance in imbalance.items():
+        if n_imbalance != 0:
+            transport_g.add_node(n, demand=-n_imbalance)
+    excess_outs = set(n for n, i in imbalance.items() if i < 0)
+    for n, n_imbalance in imbalance.items():
+        if n_imbalance > 0:
+            distances = nx.single_source_dijkstra_path_length(
+                g, n, weight=fg.get_deadhead_weight)
+            for m in excess_outs & distances.keys():
+                transport_g.add_edge(n, m, weight=distances[m])
+    if len(transport_g) == 0:
+        return []
+    try:
+        _, flows = nx.network_simplex(transport_g)
+    except nx.NetworkXUnfeasible:
+        raise ValueError(
+            "added segments cannot be balanced, "
+            "some of them cannot be entered or left along the graph")
+    return [
+        (n, m)
+        for n, n_flows in flows.items()
+        for m, flow in n_flows.items()
+        for _ in range(flow)]
+
+
+def add_edges_to_circuit(
+        virtual_circuit: list,
+        new_edges: list) -> list:
+    '''
+    Splice closed trails covering the new edges into the circuit,
+    each at the first pass through a node it shares with the circuit.
+    INPUT
+    virtual_circuit eulerian circuit (list of (tail, head, key))
+    new_edges       balanced set of new edges (list of (tail, head, key))
+    ------------
+    OUTPUT
+    virtual circuit covering the new edges (list of (tail, head, key))
+    '''
+    trails_g = nx.MultiDiGraph()
+    for tail, head, key in new_edges:
+        trails_g.add_edge(tail, head, circuit_key=key)
+    first_pass = {}
+    for i, e in enumerate(virtual_circuit):
+        first_pass.setdefault(e[0], i)
+
+    insertions = {}
+    for component in nx.weakly_connected_components(trails_g):
+        splice_nodes = [n for n in component if n in first_pass]
+        if len(virtual_circuit) == 0 and len(splice_nodes) == 0:
+            splice_nodes = [next(iter(component))]
+            first_pass[splice_nodes[0]] = 0
+        if len(splice_nodes) == 0:
+            raise ValueError(
+                f"added segments {sorted(component)} "
+                f"are not connected to the route")
+        source = min(splice_nodes, key=first_pass.get)
+        trail = [
+            (tail, head, trails_g.edges[tail, head, key]['circuit_key'])
+            for tail, head, key in nx.eulerian_circuit(
+                trails_g.subgraph(component), source=source, keys=True)]
+        insertions.setdefault(first_pass[source], []).extend(trail)
+
+    repaired_circuit = []
+    for i, e in enumerate(virtual_circuit):
+        repaired_circuit += insertions.pop(i, [])
+        repaired_circuit.append(e)
+    for trail in insertions.values():
+        repaired_circuit += trail
+    return repaired_circuit
+
+
+# C. REPAIR ROUTE =============================================================
+def repair_route(
+        g: nx.DiGraph,
+        virtual_g: nx.DiGraph,
+        virtual_circuit: list,
+        segments: list = (),
+        removed_segment_ids: list = (),
+        added_segments: list = (),
+        ) -> dict:
+    '''
+    Update a route after segments close or open, without recomputing it:
+    only nodes next to the changes are re-balanced,
+    and the eulerian circuit is spliced locally.
+    NB! get_route.get_real_path on the result raises NetworkXNoPath
+    if a closure leaves a deadhead leg without any path.
+    INPUT
+    g                   pruned inverted graph, updated in place (nx.DiGraph)
+    virtual_g           g balanced with virtual edges; updated in place
+                        if it is a nx.MultiDiGraph, copied otherwise
+    virtual_circuit     eulerian circuit of virtual_g (list of tuples)
+    segments            segments data of g, to connect added segments
+                        (list of dicts)
+    removed_segment_ids closed segments (list of int)
+    added_segments      opened segments data (list of dicts)
+    ------------
+    OUTPUT
+    repaired route (dict)
+        g               updated graph (nx.DiGraph)
+        virtual_g       updated balanced graph (nx.MultiDiGraph)
+        virtual_circuit eulerian circuit of virtual_g
+                        (list of (tail, head, key))
+        n_virtual_edges_added   (int)
+    '''
+    if not virtual_g.is_multigraph():
+        virtual_g = nx.MultiDiGraph(virtual_g)
+        virtual_circuit = [(tail, head, 0) for tail, head in virtual_circuit]
+    n_edges = virtual_g.number_of_edges()
+
+    removed = set(removed_segment_ids) & set(g.nodes())
+    g.remove_nodes_from(removed)
+    virtual_g.remove_nodes_from(removed)
+    n_removed_edges = n_edges - virtual_g.number_of_edges()
+    virtual_circuit = remove_segments_from_circuit(
+        virtual_g, virtual_circuit, removed)
+
+    added_edges = []
+    if len(added_segments) > 0:
+        for e_data in get_added_edges(segments, g, added_segments):
+            g.add_edge(
+                e_data['tail'],
+                e_data['head'],
+                weight=e_data['weight'],
+                geometry=e_data['geometry'],
+                coordinates=e_data['coordinates'],
+                coordinates_offset=e_data['coordinates_offset'],
+                manoeuvre=e_data['manoeuvre'],
+                type='segment',
+                )
+            for n, coordinates in zip(
+                    (e_data['tail'], e_data['head']),
+                    e_data['coordinates']):
+                g.nodes[n].setdefault('coordinates', coordinates)
+            added_edges.append((e_data['tail'], e_data['head']))
+    new_edges = []
+    for tail, head in added_edges:
+        key = virtual_g.add_edge(tail, head, **g.edges[tail, head])
+        virtual_g.nodes[tail].update(g.nodes[tail])
+        virtual_g.nodes[head].update(g.nodes[head])
+        new_edges.append((tail, head, key))
+    if added_edges:
+        for tail, head in get_local_virtual_edges(g, added_edges):
+            key = virtual_g.add_edge(tail, head, type='virtual_edge')
+            new_edges.append((tail, head, key))
+        virtual_circuit = add_edges_to_circuit(virtual_circuit, new_edges)
+
+    n_virtual_edges_added = (
+        virtual_g.number_of_edges() - n_edges
+        + n_removed_edges - len(added_edges))
+    logger.info(
+        f"\tremoved {len(removed)} segments, "
+        f"added {len(added_segments)} segments\n"
+        f"\tadded {n_virtual_edges_added} virtual edges\n")
+    return {
+        'g': g,
+        'virtual_g': virtual_g,
+        'virtual_circuit': virtual_circuit,
+        'n_virtual_edges_added': n_virtual_edges_added,
+        }
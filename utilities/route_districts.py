@@ -0,0 +1,102 @@
+import concurrent.futures
+import time
+
+import utilities.get_random_city as grc
+import utilities.pipeline as pl
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Segment table of the city, set once per worker by init_worker.
+WORKER_CITY_TABLE = None
+
+
+# ROUTE DISTRICTS =============================================================
+def init_worker(
+        city_table: dict):
+    '''
+    Share the city with a worker once, rather than with every task.
+    '''
+    global WORKER_CITY_TABLE
+    WORKER_CITY_TABLE = city_table
+
+
+def route_district(
+        district_index: int,
+        district_bbox: list,
+        pipeline_parameters: dict,
+        ) -> dict:
+    '''
+    Run the full pipeline on one district of the worker's city.
+    INPUT
+    district_index      position of the district in the batch (int)
+    district_bbox       south-west & north-east coordinates (list of tuples)
+    pipeline_parameters see pipeline.run_pipeline (dict)
+    ------------
+    OUTPUT
+    district route (dict)
+        district_index, district_bbox
+        n_segments      segments within the district (int)
+        n_nodes         nodes of the pruned inverted graph (int)
+        circuit_by_edge real circuit (list of tuples)
+        circuit_by_node real circuit (list of nodes)
+        wall_time       seconds (float)
+        error           why the district could not be routed (str) or None
+    '''
+    start = time.perf_counter()
+    district = grc.get_segments_from_table(
+        grc.get_district_table(WORKER_CITY_TABLE, district_bbox))
+    result = {
+        'district_index': district_index,
+        'district_bbox': district_bbox,
+        'n_segments': len(district),
+        'n_nodes': 0,
+        'circuit_by_edge': [],
+        'circuit_by_node': [],
+        'error': None,
+        }
+    try:
+        route = pl.run_pipeline(district, **pipeline_parameters)
+        result['n_nodes'] = len(route['inverted_g'])
+        result.update(route['real_circuit'])
+    except Exception as e:
+        # NB! e.g. a district without any strongly connected segments.
+        result['error'] = repr(e)
+    result['wall_time'] = time.perf_counter() - start
+    return result
+
+
+def route_districts(
+        city: list,
+        district_bboxes: list,
+        n_workers: int = None,
+        **pipeline_parameters):
+    '''
+    Route every district of the city in a process pool.
+    The city is passed to every worker once, as a compact segment table;
+    tasks only carry their district bbox.
+    INPUT
+    city                segments data (list of dicts)
+    district_bboxes     south-west & north-east coordinates
+                        of every district (list of lists of tuples)
+    n_workers           number of processes, defaults to the number of CPUs
+    pipeline_parameters see pipeline.run_pipeline
+    ------------
+    OUTPUT
+    generator of district routes, see route_district, as they finish
+    '''
+    city_table = grc.get_table_from_segments(city)
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=init_worker,
+            initargs=(city_table,)) as executor:
+        futures = [
+            executor.submit(
+                route_district, i, district_bbox, pipeline_parameters)
+            for i, district_bbox in enumerate(district_bboxes)]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            logger.info(
+                f"\tdistrict {result['district_index']} routed "
+                f"in {result['wall_time']:.3f}s")
+            yield result
@@ -0,0 +1,404 @@
+import bisect
+import concurrent.futures
+import math
+import time
+
+import networkx as nx
+
+import utilities.global_parameters as ug
+import utilities.get_graph as gg
+import utilities.forge_graph as fg
+import utilities.get_route as gr
+import utilities.profiler as up
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Pruned inverted graph of the city, set once per worker by init_worker.
+WORKER_GRAPH = None
+
+
+# A. TILES ====================================================================
+def get_tile_bboxes(
+        city_size: tuple = ug.CITY_SIZE,
+        tile_size: tuple = ug.DISTRICT_SIZE) -> list:
+    '''
+    Cut the city into a grid of tiles,
+    see get_random_city.get_random_district_bbox.
+    INPUT
+    city_size   west-to-east & south-to-north sizes (tuple)
+    tile_size   west-to-east & south-to-north sizes (tuple)
+    ------------
+    OUTPUT
+    south-west & north-east coordinates of every tile,
+    west-to-east, then south-to-north (list of lists of tuples)
+    '''
+    n_tiles = [math.ceil(c / t) for c, t in zip(city_size, tile_size)]
+    return [
+        [(i * tile_size[0], j * tile_size[1]),
+         ((i + 1) * tile_size[0], (j + 1) * tile_size[1])]
+        for j in range(n_tiles[1])
+        for i in range(n_tiles[0])]
+
+
+def get_tile_nodes(
+        g: nx.DiGraph,
+        city_size: tuple = ug.CITY_SIZE,
+        tile_size: tuple = ug.DISTRICT_SIZE) -> list:
+    '''
+    Assign every node to exactly one of the get_tile_bboxes tiles
+    by its coordinates; tiles are half-open, but the last row & column
+    keep their far borders.
+    INPUT
+    g           graph, nodes with 'coordinates' (nx.DiGraph)
+    city_size   west-to-east & south-to-north sizes (tuple)
+    tile_size   west-to-east & south-to-north sizes (tuple)
+    ------------
+    OUTPUT
+    nodes of every tile, in get_tile_bboxes order (list of lists)
+    '''
+    tile_bboxes = get_tile_bboxes(city_size, tile_size)
+    # West & south borders of the columns & rows of tiles.
+    west_borders = sorted({bbox[0][0] for bbox in tile_bboxes})
+    south_borders = sorted({bbox[0][1] for bbox in tile_bboxes})
+    tile_nodes = [[] for _ in tile_bboxes]
+    for n, (x, y) in g.nodes(data='coordinates'):
+        i = max(bisect.bisect_right(west_borders, x) - 1, 0)
+        j = max(bisect.bisect_right(south_borders, y) - 1, 0)
+        tile_nodes[j * len(west_borders) + i].append(n)
+    return tile_nodes
+
+
+# B. ROUTE TILES ==============================================================
+def init_worker(
+        g: nx.DiGraph):
+    '''
+    Share the graph with a worker once, rather than with every task.
+    '''
+    global WORKER_GRAPH
+    WORKER_GRAPH = g
+
+
+def get_tree_distances(
+        g: nx.DiGraph,
+        predecessors: dict) -> dict:
+    '''
+    INPUT
+    g               graph (nx.DiGraph)
+    predecessors    shortest-path tree, see get_route.get_shortest_path_tree
+    ------------
+    OUTPUT
+    distances (dict)
+        node    deadhead cost from the tree source,
+                see forge_graph.get_deadhead_weight
+    '''
+    distances = {}
+    for n in predecessors:
+        path = []
+        while n not in distances and predecessors[n] is not None:
+            path.append(n)
+            n = predecessors[n]
+        distance = distances.setdefault(n, 0)
+        for head in reversed(path):
+            tail = predecessors[head]
+            distance += fg.get_deadhead_weight(tail, head, g.edges[tail, head])
+            distances[head] = distance
+    return distances
+
+
+def route_tile(
+        tile_index: int,
+        tile_nodes: list) -> dict:
+    '''
+    Cover the edges leaving the tile nodes with closed trails along
+    the worker's graph: the tile edges are balanced with minimum-cost
+    deadhead paths (see forge_graph.balance_graph_min_cost), grown from
+    every excess-in node only until the tile's excess-out nodes are reached.
+    INPUT
+    tile_index  position of the tile, see get_tile_bboxes (int)
+    tile_nodes  nodes within the tile (list)
+    ------------
+    OUTPUT
+    tile route (dict)
+        tile_index
+        trails          closed trails of real edges (list of lists of tuples)
+        n_edges         edges leaving the tile nodes (int)
+        deadhead_cost   deadhead cost of the balancing paths (float)
+        wall_time       seconds (float)
+    '''
+    start = time.perf_counter()
+    g = WORKER_GRAPH
+    tile_edges = list(g.out_edges(tile_nodes))
+    imbalance = {}
+    for tail, head in tile_edges:
+        imbalance[head] = imbalance.get(head, 0) + 1
+        imbalance[tail] = imbalance.get(tail, 0) - 1
+    excess_ins = [n for n, i in imbalance.items() if i > 0]
+    excess_outs = set(n for n, i in imbalance.items() if i < 0)
+
+    transport_g = nx.DiGraph()
+    for n, n_imbalance in imbalance.items():
+        if n_imbalance != 0:
+            transport_g.add_node(n, demand=-n_imbalance)
+    trees = {}
+    for n in excess_ins:
+        trees[n] = gr.get_shortest_path_tree(
+            g, n, excess_outs, weighted=True)
+        distances = get_tree_distances(g, trees[n])
+        for m in excess_outs & distances.keys():
+            transport_g.add_edge(n, m, weight=distances[m])
+    deadhead_cost, flows = 0, {}
+    if len(transport_g) > 0:
+        deadhead_cost, flows = nx.network_simplex(transport_g)
+
+    trails_g = nx.MultiDiGraph()
+    trails_g.add_edges_from(tile_edges)
+    for n, n_flows in flows.items():
+        for m, flow in n_flows.items():
+            path = gr.get_path_from_tree(trees[n], m)
+            for _ in range(flow):
+                trails_g.add_edges_from(zip(path[:-1], path[1:]))
+    trails = [
+        list(nx.eulerian_circuit(trails_g.subgraph(component)))
+        for component in nx.weakly_connected_components(trails_g)]
+    return {
+        'tile_index': tile_index,
+        'trails': trails,
+        'n_edges': len(tile_edges),
+        'deadhead_cost': deadhead_cost,
+        'wall_time': time.perf_counter() - start,
+        }
+
+
+def route_tiles(
+        g: nx.DiGraph,
+        tile_nodes: list,
+        n_workers: int = None):
+    '''
+    Route every tile of the graph in a process pool;
+    the graph is passed to every worker once, tasks only carry tile nodes.
+    INPUT
+    g           strongly connected graph (nx.DiGraph)
+    tile_nodes  nodes of every tile, see get_tile_nodes (list of lists)
+    n_workers   number of processes, defaults to the number of CPUs;
+                1 to route the tiles in this process (int)
+    ------------
+    OUTPUT
+    generator of tile routes, see route_tile, as they finish
+    '''
+    tiles = [(i, nodes) for i, nodes in enumerate(tile_nodes) if nodes]
+    if n_workers == 1:
+        init_worker(g)
+        for i, nodes in tiles:
+            yield route_tile(i, nodes)
+        return
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=init_worker,
+            initargs=(g,)) as executor:
+        futures = [
+            executor.submit(route_tile, i, nodes) for i, nodes in tiles]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            logger.info(
+                f"\ttile {result['tile_index']} routed "
+                f"in {result['wall_time']:.3f}s")
+            yield result
+
+
+# C. STITCH TILES =============================================================
+def splice_trails(
+        circuit: list,
+        trails: list) -> dict:
+    '''
+    Splice every trail sharing a node with the circuit into it,
+    at the first pass through that node.
+    INPUT
+    circuit closed trail (list of (tail, head))
+    trails  closed trails (list of lists of (tail, head))
+    ------------
+    OUTPUT
+    circuit         circuit with the spliced trails (list of (tail, head))
+    trails_left     trails without any node of the circuit (list of lists)
+    '''
+    first_pass = {}
+    for i, e in enumerate(circuit):
+        first_pass.setdefault(e[0], i)
+    insertions = {}
+    trails_left = []
+    for trail in trails:
+        shared = [i for i, e in enumerate(trail) if e[0] in first_pass]
+        if not shared:
+            trails_left.append(trail)
+            continue
+        splice_at = min(shared, key=lambda i: first_pass[trail[i][0]])
+        insertions.setdefault(first_pass[trail[splice_at][0]], []).extend(
+            trail[splice_at:] + trail[:splice_at])
+    spliced_circuit = []
+    for i, e in enumerate(circuit):
+        spliced_circuit += insertions.pop(i, [])
+        spliced_circuit.append(e)
+    return {
+        'circuit': spliced_circuit,
+        'trails_left': trails_left,
+        }
+
+
+def stitch_trails(
+        g: nx.DiGraph,
+        trails: list) -> dict:
+    '''
+    Stitch closed trails into one circuit. Trails sharing nodes are
+    spliced together; the rest are reached by connecting grafts in the
+    spirit of forge_graph.add_connecting_grafts: a shortest path from the
+    circuit to the nearest trail and back to where it left the circuit.
+    INPUT
+    g       strongly connected graph (nx.DiGraph)
+    trails  closed trails of real edges (list of lists of tuples)
+    ------------
+    OUTPUT
+    circuit_by_edge real circuit (list of tuples)
+    n_grafts        number of connecting grafts (int)
+    '''
+    trails = sorted(trails, key=len, reverse=True)
+    circuit = trails[0] if trails else []
+    trails_left = trails[1:]
+    n_grafts = 0
+    while trails_left:
+        spliced = splice_trails(circuit, trails_left)
+        circuit = spliced['circuit']
+        if len(spliced['trails_left']) < len(trails_left):
+            trails_left = spliced['trails_left']
+            continue
+        trail_by_node = {
+            e[0]: i for i, trail in enumerate(trails_left) for e in trail}
+        path_out = fg.get_shortest_path_between_node_sets(
+            g, set(e[0] for e in circuit), set(trail_by_node))
+        path_back = fg.get_shortest_path_between_node_sets(
+            g, {path_out[-1]}, {path_out[0]})
+        graft = (
+            list(zip(path_out[:-1], path_out[1:]))
+            + list(zip(path_back[:-1], path_back[1:])))
+        circuit = splice_trails(circuit, [graft])['circuit']
+        n_grafts += 1
+    return {
+        'circuit_by_edge': circuit,
+        'n_grafts': n_grafts,
+        }
+
+
+# D. ROUTE CITY BY TILES ======================================================
+def get_circuit_cost(
+        g: nx.DiGraph,
+        circuit_by_edge: list) -> float:
+    '''
+    Cost of driving the whole circuit, see forge_graph.get_deadhead_weight.
+    '''
+    return sum(
+        fg.get_deadhead_weight(tail, head, g.edges[tail, head])
+        for tail, head in circuit_by_edge)
+
+
+def route_city_by_tiles(
+        g: nx.DiGraph,
+        city_size: tuple = ug.CITY_SIZE,
+        tile_size: tuple = ug.DISTRICT_SIZE,
+        n_workers: int = None) -> dict:
+    '''
+    Route inspection of a whole city, tile by tile:
+    balancing & circuits per tile in parallel, then stitching.
+    INPUT
+    g           pruned inverted graph, strongly connected (nx.DiGraph)
+    city_size   west-to-east & south-to-north sizes (tuple)
+    tile_size   west-to-east & south-to-north sizes (tuple)
+    n_workers   number of processes, see route_tiles (int)
+    ------------
+    OUTPUT
+    route (dict)
+        circuit_by_edge real circuit (list of tuples)
+        circuit_by_node real circuit (list of nodes)
+        n_tiles         tiles with nodes (int)
+        n_grafts        number of connecting grafts (int)
+        cost            see get_circuit_cost (float)
+    '''
+    tile_nodes = get_tile_nodes(g, city_size, tile_size)
+    trails = []
+    for result in route_tiles(g, tile_nodes, n_workers):
+        trails += result['trails']
+    stitched = stitch_trails(g, trails)
+    circuit_by_edge = stitched['circuit_by_edge']
+    cost = get_circuit_cost(g, circuit_by_edge)
+    logger.info(
+        f"\tstitched {len(trails)} trails "
+        f"with {stitched['n_grafts']} grafts\n"
+        f"\teulerian circuit length {len(circuit_by_edge)}, cost {cost}\n")
+    return {
+        'circuit_by_edge': circuit_by_edge,
+        'circuit_by_node': [e[0] for e in circuit_by_edge],
+        'n_tiles': sum(1 for nodes in tile_nodes if nodes),
+        'n_grafts': stitched['n_grafts'],
+        'cost': cost,
+        }
+
+
+def compare_with_monolithic(
+        segments: list,
+        city_size: tuple = ug.CITY_SIZE,
+        tile_size: tuple = ug.DISTRICT_SIZE,
+        n_workers: int = None,
+        trace_memory: bool = False) -> dict:
+    '''
+    Route the segments by tiles and in one go, on the same pruned graph.
+    INPUT
+    segments        segments data (list of dicts)
+    city_size       west-to-east & south-to-north sizes (tuple)
+    tile_size       west-to-east & south-to-north sizes (tuple)
+    n_workers       number of processes, see route_tiles (int)
+    trace_memory    whether to trace peak memory of every stage (bool)
+    ------------
+    OUTPUT
+    comparison (dict)
+        tiled           route, see route_city_by_tiles (dict)
+        monolithic      route, see pipeline.run_pipeline (dict)
+        tiled_cost, monolithic_cost     see get_circuit_cost (float)
+        cost_ratio      tiled over monolithic cost (float)
+        stages          stage profiles, see profiler.profile_stage (list)
+    '''
+    stages = []
+
+    def run_stage(stage, function, *args, **kwargs):
+        return up.profile_stage(
+            stages, stage, function, *args,
+            trace_memory=trace_memory, **kwargs)
+
+    g = run_stage('get_inverted_graph', gg.get_inverted_graph, segments)
+    g = run_stage('prune_u_turns', fg.prune_u_turns, g)
+    g = run_stage('prune_left_turns', fg.prune_left_turns, g)
+
+    tiled = run_stage(
+        'route_city_by_tiles', route_city_by_tiles,
+        g, city_size, tile_size, n_workers)
+    virtual_g = run_stage(
+        'balance_graph_min_cost', fg.balance_graph_min_cost, g)
+    virtual_circuit = run_stage(
+        'get_virtual_path', gr.get_virtual_path, virtual_g)
+    real_circuit = run_stage(
+        'get_real_path', gr.get_real_path,
+        virtual_circuit, g, virtual_g, weighted=True)
+
+    monolithic_cost = get_circuit_cost(g, real_circuit['circuit_by_edge'])
+    logger.info(
+        f"\ttiled cost {tiled['cost']}, monolithic cost {monolithic_cost}\n")
+    return {
+        'tiled': tiled,
+        'monolithic': {
+            'inverted_g': g,
+            'virtual_g': virtual_g,
+            'virtual_circuit': virtual_circuit,
+            'real_circuit': real_circuit,
+            },
+        'tiled_cost': tiled['cost'],
+        'monolithic_cost': monolithic_cost,
+        'cost_ratio': tiled['cost'] / monolithic_cost,
+        'stages': stages,
+        }
@@ -0,0 +1,150 @@
+import math
+
+import networkx as nx
+
+
+# GRID INDEX ==================================================================
+def get_cell(
+        point: tuple,
+        cell_size: float) -> tuple:
+    return (
+        math.floor(point[0] / cell_size),
+        math.floor(point[1] / cell_size))
+
+
+def get_spatial_index(
+        points: list,
+        cell_size: float = 1.) -> dict:
+    '''
+    Grid-bucket index over points.
+    INPUT
+    points      item & its coordinates (list of tuples)
+    cell_size   side of a grid cell (float)
+    ------------
+    OUTPUT
+    spatial index (dict)
+        cell_size   side of a grid cell (float)
+        cells       grid cell -> position, item & coordinates (dict of lists)
+    '''
+    cells = {}
+    for position, (item, point) in enumerate(points):
+        cells.setdefault(get_cell(point, cell_size), []).append(
+            (position, item, point))
+    return {
+        'cell_size': cell_size,
+        'cells': cells,
+        }
+
+
+def query_bbox(
+        spatial_index: dict,
+        bbox: list) -> list:
+    '''
+    Items within the bbox (borders included), looking only at grid cells
+    overlapping it; cost grows with the bbox rather than the index.
+    INPUT
+    spatial_index   see get_spatial_index (dict)
+    bbox            south-west & north-east coordinates (list of tuples)
+    ------------
+    OUTPUT
+    position, item & coordinates (list of tuples), in indexing order
+    '''
+    [(x_min, y_min), (x_max, y_max)] = bbox
+    cell_size = spatial_index['cell_size']
+    cells = spatial_index['cells']
+    cell_min = get_cell((x_min, y_min), cell_size)
+    cell_max = get_cell((x_max, y_max), cell_size)
+    # NB! Scanning cells only pays off while the bbox has fewer cells
+    # than the index; otherwise walk the cells the index does have.
+    n_bbox_cells = (
+        (cell_max[0] - cell_min[0] + 1) * (cell_max[1] - cell_min[1] + 1))
+    if n_bbox_cells <= len(cells):
+        bbox_cells = (
+            cells.get((cx, cy), [])
+            for cx in range(cell_min[0], cell_max[0] + 1)
+            for cy in range(cell_min[1], cell_max[1] + 1))
+    else:
+        bbox_cells = (
+            items for c, items in cells.items()
+            if (cell_min[0] <= c[0] <= cell_max[0]
+                and cell_min[1] <= c[1] <= cell_max[1]))
+    within = [
+        (position, item, point)
+        for items in bbox_cells
+        for position, item, point in items
+        if x_min <= point[0] <= x_max and y_min <= point[1] <= y_max]
+    return sorted(within, key=lambda w: w[0])
+
+
+# GRAPHS & SEGMENTS ===========================================================
+def get_graph_spatial_index(
+        g: nx.DiGraph,
+        cell_size: float = 1.) -> dict:
+    '''
+    INPUT
+    g           graph, nodes with 'coordinates' (nx.DiGraph)
+    cell_size   side of a grid cell (float)
+    ------------
+    OUTPUT
+    spatial index over node coordinates, see get_spatial_index (dict)
+        ...
+        city_size   west-to-east & south-to-north sizes, as computed by
+                    get_graph.get_city_size (tuple)
+    '''
+    points = list(g.nodes(data='coordinates'))
+    spatial_index = get_spatial_index(points, cell_size)
+    spatial_index['city_size'] = (
+        max(c[0] for _, c in points) + 1,
+        max(c[1] for _, c in points) + 1)
+    return spatial_index
+
+
+def get_district_subgraph(
+        g: nx.DiGraph,
+        spatial_index: dict,
+        district_borders: list) -> nx.DiGraph:
+    '''
+    INPUT
+    g                   graph (nx.DiGraph)
+    spatial_index       see get_graph_spatial_index (dict)
+    district_borders    south-west & north-east coordinates (list of tuples)
+    ------------
+    OUTPUT
+    read-only view of g on the nodes within the district (nx.DiGraph),
+    call .copy() on it for a graph of its own
+    '''
+    return g.subgraph(
+        item for _, item, _ in query_bbox(spatial_index, district_borders))
+
+
+def get_segment_spatial_index(
+        segments: list,
+        cell_size: float = 1.) -> dict:
+    '''
+    INPUT
+    segments    segments data (list of dicts)
+    cell_size   side of a grid cell (float)
+    ------------
+    OUTPUT
+    spatial index over segment tails, see get_spatial_index (dict)
+    '''
+    return get_spatial_index(
+        [(s, s['coordinates'][0]) for s in segments], cell_size)
+
+
+def get_district_segments(
+        spatial_index: dict,
+        district_bbox: list) -> list:
+    '''
+    INPUT
+    spatial_index   see get_segment_spatial_index (dict)
+    district_bbox   south-west & north-east coordinates (list of tuples)
+    ------------
+    OUTPUT
+    segments within the district, in city order (list of dicts)
+    '''
+    [(x_min, y_min), (x_max, y_max)] = district_bbox
+    return [
+        s for _, s, _ in query_bbox(spatial_index, district_bbox)
+        if (x_min <= s['coordinates'][1][0] <= x_max
+            and y_min <= s['coordinates'][1][1] <= y_max)]
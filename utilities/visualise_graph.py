@@ -1,93 +1,92 @@
-import os, sys, inspect
+import collections
 
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
-plt.style.use('fivethirtyeight')
 import networkx as nx
-import shapely as sh
 
-import utilities.global_parameters as ug
 import utilities.get_random_city as grc
 
 import logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(levelname)s: %(asctime)s: %(filename)s: %(lineno)s:\n%(message)s")
 logger = logging.getLogger(__name__)
 
 
 # HELPER PLOTTING FUNCTIONS ===================================================
-def plot_arrow(
-    coordinates: list,
-    color: str = 'gray'):
-    x, y = coordinates[0]
-    x_end, y_end = coordinates[1]
-    dx = x_end - x
-    dy = y_end - y
-    plt.arrow(
-        x=x, y=y,
-        dx=dx, dy=dy,
-        length_includes_head=True,
-        shape='left',
-        head_width=.13,
-        head_length=.13,
-        facecolor=color,
-        edgecolor=color,
-        width=.07)
+def plot_arrows(
+        ax,
+        coordinates,
+        color: str = 'gray'):
+    '''
+    Draw all arrows with a single quiver call.
+    INPUT
+    ax          axes
+    coordinates start and end points of the arrows (N x 2 x 2 array-like)
+    color       (str)
+    '''
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2, 2)
+    if len(coordinates) == 0:
+        return
+    starts = coordinates[:, 0]
+    deltas = coordinates[:, 1] - starts
+    ax.quiver(
+        starts[:, 0], starts[:, 1],
+        deltas[:, 0], deltas[:, 1],
+        angles='xy',
+        scale_units='xy',
+        scale=1,
+        units='xy',
+        width=.07,
+        headwidth=2,
+        headlength=2,
+        headaxislength=2,
+        color=color)
+
+
+def plot_nodes(
+        ax,
+        points: list,
+        color: str):
+    '''
+    Highlight nodes with a single scatter call.
+    '''
+    if len(points) > 0:
+        x, y = zip(*points)
+        ax.scatter(x, y, s=500, c=color, alpha=0.3)
+
+
+def get_bbox(
+        points) -> list:
+    points = np.asarray(list(points), dtype=float).reshape(-1, 2)
+    return [tuple(points.min(axis=0)), tuple(points.max(axis=0))]
 
 
 # A. VISUALISE NAIVE GRAPH ====================================================
+@grc.with_plot_style
 def visualise_naive_graph(
-        g: nx.DiGraph):
+        g: nx.DiGraph,
+        path: str = None):
+    '''
+    INPUT
+    g       naive graph (nx.DiGraph)
+    path    where to write the figure, e.g. a .png file;
+            None to show it (str)
+    '''
     nodes_coordinates = nx.get_node_attributes(g, 'coordinates')
-    x_min = min([nc[0] for nc in nodes_coordinates.values()])
-    x_max = max([nc[0] for nc in nodes_coordinates.values()])
-    y_min = min([nc[1] for nc in nodes_coordinates.values()])
-    y_max = max([nc[1] for nc in nodes_coordinates.values()])
-
     g_statistics = get_naive_graph_statistics(g)
-    dead_ends = g_statistics['dead_ends']
-    disconnected_nodes = g_statistics['disconnected_nodes']
 
-    fig, ax = plt.subplots(1, 1, figsize=ug.FIGURE_SIZE)
-    for e in g.edges:
-        e_coordinates = g.get_edge_data(*e)
-        offset_coordinates = grc.get_offset_coordinates(e_coordinates)
-        # Plot arrow for every edge.
-        plot_arrow(offset_coordinates)
+    fig, ax = grc.get_axes(path)
+    # Plot arrow for every edge.
+    plot_arrows(ax, grc.get_offset_coordinates_batch(
+        [data for _, _, data in g.edges(data='coordinates')]))
     # Highlight dead-ends.
-    for n in dead_ends:
-        plt.scatter(
-            *nodes_coordinates[n],
-            s=500,
-            c="grey",
-            alpha=0.3)
+    plot_nodes(
+        ax, [nodes_coordinates[n] for n in g_statistics['dead_ends']], 'grey')
     # Highlight disconnected nodes.
-    for n in disconnected_nodes:
-        plt.scatter(
-            *nodes_coordinates[n],
-            s=500,
-            c="red",
-            alpha=0.3)
-    # Add node ids to graph.
-    # for n in g.nodes():
-    #     plt.text(
-    #         nodes_coordinates[n][0] + 0.1,
-    #         nodes_coordinates[n][1] + 0.1,
-    #         n,
-    #         color='r')
-    # plt.axis('off')
-    plt.xticks(np.arange(x_min, x_max + 1.0, 1), fontsize=14)
-    plt.yticks(np.arange(y_min, y_max + 1.0, 1), fontsize=14)
-    ax.set_xlim(x_min - 1, x_max + 1)
-    ax.set_ylim(y_min - 1, y_max + 1)
-    ax.spines['top'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['left'].set_visible(False)
-    plt.title('')
-    plt.show()
+    plot_nodes(
+        ax,
+        [nodes_coordinates[n] for n in g_statistics['disconnected_nodes']],
+        'red')
+    grc.format_axes(ax, get_bbox(nodes_coordinates.values()))
+    ax.set_title('')
+    grc.show_or_save(fig, path)
 
     
 def get_naive_graph_statistics(
@@ -131,204 +130,179 @@ def get_naive_graph_statistics(
 
 
 # B. VISUALISE MANOEUVRE GRAPH ================================================
+def get_segment_coordinates(
+        g: nx.DiGraph) -> list:
+    '''
+    OUTPUT
+    coordinates of the segment edges of g (list of lists of tuples)
+    '''
+    return [
+        data['coordinates'] for _, _, data in g.edges(data=True)
+        if data['type'] == 'segment']
+
+
+@grc.with_plot_style
 def visualise_manoeuvre_graph(
-        g: nx.DiGraph):
+        g: nx.DiGraph,
+        path: str = None):
+    '''
+    INPUT
+    g       manoeuvre graph (nx.DiGraph)
+    path    where to write the figure, e.g. a .png file;
+            None to show it (str)
+    '''
     nodes_coordinates = nx.get_node_attributes(g, 'coordinates')
-    # print(nodes_coordinates)
-    x_min = min([nc[0] for nc in nodes_coordinates.values()])
-    x_max = max([nc[0] for nc in nodes_coordinates.values()])
-    y_min = min([nc[1] for nc in nodes_coordinates.values()])
-    y_max = max([nc[1] for nc in nodes_coordinates.values()])
-    
     g_statistics = get_graph_statistics(g)
-    dead_ends = g_statistics['dead_ends']
-    disconnected_nodes = g_statistics['disconnected_nodes']
-    
-    fig, ax = plt.subplots(1, 1, figsize=ug.FIGURE_SIZE)
-    for e in g.edges:
-        try:
-            e_data = g.get_edge_data(*e)
-            # print(e_data)
-            if e_data['type'] == 'segment':
-                offset_coordinates = grc.get_offset_coordinates(e_data)
-                # print(offset_coordinates)
-                plot_arrow(offset_coordinates)
-        except ValueError:
-            pass
-    for n in dead_ends:
-        plt.scatter(
-            nodes_coordinates[n][0],
-            nodes_coordinates[n][1],
-            s=500,
-            c="grey",
-            alpha=0.3)
-    for n in disconnected_nodes:
-        plt.scatter(n[0], n[1], s=500, c="red", alpha=0.3)
-    # Label nodes.
-    # for n in g.nodes():
-    #     x_coordinate = nodes_coordinates[n][0] + 0.1
-    #     if n.endswith('t'):
-    #         y_coordinate = nodes_coordinates[n][1] - 0.1
-    #     else:
-    #         y_coordinate = nodes_coordinates[n][1] + 0.1
-    #     plt.text(
-    #         x_coordinate,
-    #         y_coordinate,
-    #         n,
-    #         color='r',
-    #         # size=10,
-    #         )
-    # plt.axis('off')
-    plt.xticks(np.arange(x_min, x_max + 1, 1), fontsize=14)
-    plt.yticks(np.arange(y_min, y_max + 1, 1), fontsize=14)
-    ax.set_xlim(x_min - 1, x_max + 1)
-    ax.set_ylim(y_min - 1, y_max + 1)
-    ax.spines['top'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['left'].set_visible(False)
-    plt.title('')
-    plt.show()
 
-    
+    fig, ax = grc.get_axes(path)
+    plot_arrows(
+        ax, grc.get_offset_coordinates_batch(get_segment_coordinates(g)))
+    plot_nodes(
+        ax, [nodes_coordinates[n] for n in g_statistics['dead_ends']], 'grey')
+    plot_nodes(ax, g_statistics['disconnected_nodes_coordinates'], 'red')
+    grc.format_axes(ax, get_bbox(nodes_coordinates.values()))
+    ax.set_title('')
+    grc.show_or_save(fig, path)
+
+
+# Statistics key of the edges of every manoeuvre.
+MANOEUVRE_STATISTICS = {
+    'go_straight': 'straight_drives',
+    'turn_right': 'right_turns',
+    'turn_left': 'left_turns',
+    'make_u_turn': 'u_turns',
+    }
+
+
 def get_graph_statistics(
-        g: nx.DiGraph):
-    
-    nodes_coordinates = nx.get_node_attributes(g, 'coordinates')
+        g: nx.DiGraph,
+        with_edge_data: bool = False):
+    '''
+    Graph statistics in one pass over the edges
+    and one strongly-connected-components search.
+    INPUT
+    g               graph, edges with 'manoeuvre' (nx.DiGraph)
+    with_edge_data  whether to list the edge data of every manoeuvre (bool)
+    ------------
+    OUTPUT
+    statistics (dict)
+        n_nodes, n_edges    (int)
+        strongly_connected  (bool)
+        n_straight_drives, n_right_turns, n_left_turns, n_u_turns   (int)
+        n_dead_ends, n_disconnected_nodes   (int)
+        dead_ends           nodes only left by a u-turn (list)
+        disconnected_nodes  nodes out of the biggest strongly connected
+                            component (list)
+        disconnected_nodes_coordinates  (list of tuples)
+        straight_drives, right_turns, left_turns, u_turns
+                            edge data, only if with_edge_data (list of dicts)
+    '''
+    manoeuvre_counts = collections.Counter()
+    edge_data = {k: [] for k in MANOEUVRE_STATISTICS.values()}
+    for _, _, data in g.edges(data=True):
+        manoeuvre = data['manoeuvre']
+        manoeuvre_counts[manoeuvre] += 1
+        if with_edge_data and manoeuvre in MANOEUVRE_STATISTICS:
+            edge_data[MANOEUVRE_STATISTICS[manoeuvre]].append(data)
 
-    straight_drives = [g.get_edge_data(*e)
-        for e in g.edges()
-        if g.get_edge_data(*e)['manoeuvre']=='go_straight']
-    right_turns = [g.get_edge_data(*e)
-        for e in g.edges()
-        if g.get_edge_data(*e)['manoeuvre']=='turn_right']
-    left_turns = [g.get_edge_data(*e)
-        for e in g.edges()
-        if g.get_edge_data(*e)['manoeuvre']=='turn_left']
-    u_turns = [g.get_edge_data(*e)
-        for e in g.edges()
-        if g.get_edge_data(*e)['manoeuvre']=='make_u_turn']
+    connected_nodes = max(
+        nx.strongly_connected_components(g), key=len, default=set())
+    disconnected_nodes = [n for n in g.nodes() if n not in connected_nodes]
+    dead_ends = [
+        n for n, successors in g.adjacency()
+        if (len(successors) == 1
+            and len(g.pred[n]) == 1
+            and n in connected_nodes
+            and next(iter(successors.values()))['manoeuvre'] == 'make_u_turn')]
 
-    dead_ends = []
-    for n in g.nodes:
-        if ((g.in_degree(n) == 1)
-                and (g.out_degree(n) == 1)):
-            out_edge = list(g.out_edges(n))[0]
-            manoeuvre = g.get_edge_data(*out_edge)['manoeuvre']
-            if manoeuvre == 'make_u_turn':
-                dead_ends.append(n)
-            
-    connected_nodes = sorted(nx.strongly_connected_components(g),
-                                                   key=len,
-                                                   reverse=True)[0]
-    disconnected_nodes = [nodes_coordinates[n]
-                          for n in list(g.nodes())
-                          if n not in connected_nodes]
-    dead_ends = [n for n in dead_ends if n not in disconnected_nodes]
+    statistics = {
+        'n_nodes': len(g),
+        'n_edges': g.number_of_edges(),
+        'strongly_connected': len(g) > 0 and len(connected_nodes) == len(g),
+        'n_dead_ends': len(dead_ends),
+        'n_disconnected_nodes': len(disconnected_nodes),
+        'dead_ends': dead_ends,
+        'disconnected_nodes': disconnected_nodes,
+        'disconnected_nodes_coordinates': [
+            g.nodes[n].get('coordinates') for n in disconnected_nodes],
+        }
+    for manoeuvre, k in MANOEUVRE_STATISTICS.items():
+        statistics[f"n_{k}"] = manoeuvre_counts[manoeuvre]
+        if with_edge_data:
+            statistics[k] = edge_data[k]
     logger.info(
-    f"\tnodes #: {len(g.nodes())}\n"
-    f"\tedges #: {len(g.edges())}\n"
-    f"\tstrongly connected: {nx.is_strongly_connected(g)}\n"
-    f"\tdisconnected nodes: {len(disconnected_nodes)}\n"
-    f"\tstraight drives: {len(straight_drives)}\n"
-    f"\tright turns: {len(right_turns)}\n"
-    f"\tleft turns: {len(left_turns)}\n"
-    f"\tu-turns: {len(u_turns)}\n"
-    f"\tdead ends: {len(dead_ends)}"
+    f"\tnodes #: {statistics['n_nodes']}\n"
+    f"\tedges #: {statistics['n_edges']}\n"
+    f"\tstrongly connected: {statistics['strongly_connected']}\n"
+    f"\tdisconnected nodes: {statistics['n_disconnected_nodes']}\n"
+    f"\tstraight drives: {statistics['n_straight_drives']}\n"
+    f"\tright turns: {statistics['n_right_turns']}\n"
+    f"\tleft turns: {statistics['n_left_turns']}\n"
+    f"\tu-turns: {statistics['n_u_turns']}\n"
+    f"\tdead ends: {statistics['n_dead_ends']}"
     )
-
-    return{
-        'straight_drives': straight_drives,
-        'right_turns': right_turns,
-        'left_turns': left_turns,
-        'u_turns': u_turns,
-        'dead_ends':dead_ends,
-        'disconnected_nodes':disconnected_nodes}
+    return statistics
 
 
 # C. VISUALISE INVERTED GRAPH =================================================
+@grc.with_plot_style
 def visualise_inverted_graph(
         inverted_g: nx.DiGraph,
-        manoeuvre_g: nx.DiGraph
+        manoeuvre_g: nx.DiGraph,
+        path: str = None,
+        label_nodes: bool = True,
         ):
-
-    fig, ax = plt.subplots(1, 1, figsize=ug.FIGURE_SIZE)
+    '''
+    Draw the inverted graph over the segments of the manoeuvre graph.
+    INPUT
+    inverted_g  inverted graph (nx.DiGraph)
+    manoeuvre_g manoeuvre graph (nx.DiGraph)
+    path        where to write the figure, e.g. a .png file;
+                None to show it (str)
+    label_nodes whether to write node names (bool)
+    '''
+    fig, ax = grc.get_axes(path)
 
     # Plot inverted graph.
     nodes_coordinates_inverted_g = nx.get_node_attributes(
         inverted_g,
         'coordinates')
     statistics_inverted_g = get_graph_statistics(inverted_g)
-    dead_ends_inverted_g = statistics_inverted_g['dead_ends']
-    disconnected_nodes_inverted_g = statistics_inverted_g['disconnected_nodes']
-    for e in inverted_g.edges:
-        try:
-            e_data = inverted_g.get_edge_data(*e)
-            plot_arrow(e_data['coordinates_offset'], color='red')
-        except ValueError:
-            pass
-    for n in dead_ends_inverted_g:
-        plt.scatter(
-            nodes_coordinates_inverted_g[n][0],
-            nodes_coordinates_inverted_g[n][1],
-            s=500,
-            c="grey",
-            alpha=0.3)
-    for n in disconnected_nodes_inverted_g:
-        plt.scatter(n[0], n[1], s=500, c="red", alpha=0.3)
-
+    plot_arrows(
+        ax,
+        [data for _, _, data in inverted_g.edges(data='coordinates_offset')],
+        color='red')
+    plot_nodes(
+        ax,
+        [nodes_coordinates_inverted_g[n]
+         for n in statistics_inverted_g['dead_ends']],
+        'grey')
+    plot_nodes(
+        ax, statistics_inverted_g['disconnected_nodes_coordinates'], 'red')
     # Label nodes.
-    for n in inverted_g.nodes():
-        x_coordinate = nodes_coordinates_inverted_g[n][0] + 0.1
-        y_coordinate = nodes_coordinates_inverted_g[n][1] + 0.1
-        plt.text(
-            x_coordinate,
-            y_coordinate,
-            n,
-            color='r',
-            # size=10,
-            )
-    plt.axis('off')
+    if label_nodes:
+        for n, (x, y) in nodes_coordinates_inverted_g.items():
+            ax.text(x + 0.1, y + 0.1, n, color='r')
 
     # Plot manoeuvre graph.
     nodes_coordinates_manoeuvre_g = nx.get_node_attributes(
         manoeuvre_g,
         'coordinates')
-    statistics_manoeuvre_g= get_graph_statistics(manoeuvre_g)
-    dead_ends_manoeuvre_g = statistics_manoeuvre_g['dead_ends']
-    disconnected_nodes_manoeuvre_g = statistics_manoeuvre_g['disconnected_nodes']
-    
-    for e in manoeuvre_g.edges:
-        try:
-            e_data = manoeuvre_g.get_edge_data(*e)
-            if e_data['type'] == 'segment':
-                offset_coordinates = grc.get_offset_coordinates(e_data)
-                plot_arrow(offset_coordinates)
-        except ValueError:
-            pass
-    for n in dead_ends_manoeuvre_g:
-        plt.scatter(
-            nodes_coordinates_manoeuvre_g[n][0],
-            nodes_coordinates_manoeuvre_g[n][1],
-            s=500,
-            c="grey",
-            alpha=0.3)
-    for n in disconnected_nodes_manoeuvre_g:
-        plt.scatter(n[0], n[1], s=500, c="red", alpha=0.3)
+    statistics_manoeuvre_g = get_graph_statistics(manoeuvre_g)
+    plot_arrows(
+        ax,
+        grc.get_offset_coordinates_batch(
+            get_segment_coordinates(manoeuvre_g)))
+    plot_nodes(
+        ax,
+        [nodes_coordinates_manoeuvre_g[n]
+         for n in statistics_manoeuvre_g['dead_ends']],
+        'grey')
+    plot_nodes(
+        ax, statistics_manoeuvre_g['disconnected_nodes_coordinates'], 'red')
 
     # Set plot parameters.
-    x_min = min([nc[0] for nc in nodes_coordinates_inverted_g.values()])
-    x_max = max([nc[0] for nc in nodes_coordinates_inverted_g.values()])
-    y_min = min([nc[1] for nc in nodes_coordinates_inverted_g.values()])
-    y_max = max([nc[1] for nc in nodes_coordinates_inverted_g.values()])
-
-    plt.xticks(np.arange(x_min, x_max + 1, 1), fontsize=14)
-    plt.yticks(np.arange(y_min, y_max + 1, 1), fontsize=14)
-    ax.set_xlim(x_min - 1, x_max + 1)
-    ax.set_ylim(y_min - 1, y_max + 1)
-    ax.spines['top'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['left'].set_visible(False)
-    plt.title('')
-    plt.show()
+    grc.format_axes(ax, get_bbox(nodes_coordinates_inverted_g.values()))
+    ax.axis('off')
+    ax.set_title('')
+    grc.show_or_save(fig, path)